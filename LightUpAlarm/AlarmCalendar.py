@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+#
+# Class to resolve the alarm alerts into absolute times.
+#
+# Copyright (c) 2015 carlosperate http://carlosperate.github.io
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# This file only contains a class definition, which description can be found in
+# its docstring.
+#
+from __future__ import unicode_literals, absolute_import, print_function
+import sys
+import time
+import bisect
+import datetime
+import threading
+import collections
+
+
+class AlarmCalendar(object):
+    """
+    Converts the alarms local wall clock alerts into absolute times, in seconds
+    since 1970 (UTC), following the daylight saving time rules of the system
+    local timezone (the zoneinfo rules selected with the TZ variable or the
+    system configuration).
+
+    A local alert time can be nonexistent, when the clock moves forward over
+    it, or repeated, when the clock moves back over it. How these are resolved
+    is defined by the nonexistent_policy and repeated_policy class variables:
+        SHIFT: Nonexistent times alert the length of the gap later (an alarm
+               at 02:30 alerts at 03:30 when the clocks go from 02:00 to
+               03:00).
+        SKIP: Nonexistent times do not alert.
+        FIRST: Repeated times alert only the first time.
+        SECOND: Repeated times alert only the second time.
+
+    The alert times of an alarm in a week are resolved once and cached, so that
+    finding the next alert is a search in a sorted list of integers. The cache
+    keeps all the alarms of the max_cache_weeks most recently used weeks, so
+    any number of alarms can be cached as long as they alert in a few weeks.
+    Each cached week also keeps the start time of its days without a daylight
+    saving time change, in which the local times are resolved by adding their
+    minutes to the day start instead of converting each one of them.
+    """
+
+    # Policies for the nonexistent and repeated local times
+    SHIFT = 'shift'
+    SKIP = 'skip'
+    FIRST = 'first'
+    SECOND = 'second'
+
+    nonexistent_policy = SHIFT
+    repeated_policy = FIRST
+
+    # Maximum number of weeks to keep in the cache, when it is full the least
+    # recently used week is dropped with the alert times of all its alarms
+    max_cache_weeks = 16
+
+    # Ordered dictionary, from the least to the most recently used, of
+    # (timezone, policies, week start date) -> (tuple of the day starts,
+    # dictionary of (hour, minute, days mask) -> sorted tuple of the alert
+    # times in that week)
+    __week_cache = collections.OrderedDict()
+    __cache_lock = threading.Lock()
+
+    @staticmethod
+    def resolve(year, month, day, hour, minute):
+        """
+        Converts a local time into an absolute time, applying the nonexistent
+        and repeated time policies.
+        :param year: Integer with the year.
+        :param month: Integer with the month, 1 to 12.
+        :param day: Integer with the day of the month.
+        :param hour: Integer with the hour, 0 to 23.
+        :param minute: Integer with the minute, 0 to 59.
+        :return: Integer with the time in seconds since 1970, or None if the
+                 local time is nonexistent and the policy is to skip it.
+        """
+        candidates = set()
+        for isdst in (-1, 0, 1):
+            try:
+                candidates.add(int(time.mktime(
+                    (year, month, day, hour, minute, 0, 0, 0, isdst))))
+            except (OverflowError, ValueError):
+                pass
+        # Only keep the candidates that convert back to the same local time
+        valid = sorted(
+            candidate for candidate in candidates
+            if datetime.datetime.fromtimestamp(candidate).timetuple()[:5] ==
+            (year, month, day, hour, minute))
+
+        if len(valid) == 1:
+            return valid[0]
+        elif len(valid) > 1:
+            if AlarmCalendar.repeated_policy == AlarmCalendar.SECOND:
+                return valid[-1]
+            return valid[0]
+        elif candidates and \
+                AlarmCalendar.nonexistent_policy == AlarmCalendar.SHIFT:
+            # The time with the offset before the change is after the gap
+            return max(candidates)
+        return None
+
+    @staticmethod
+    def week_alerts(alarm_item, week_start):
+        """
+        Gets the alert times of an alarm during a week.
+        :param alarm_item: AlarmItem instance to resolve the alert times.
+        :param week_start: Date of the Monday starting the week.
+        :return: Sorted tuple of the alert times, in seconds since 1970.
+        """
+        week_key = (time.tzname, time.timezone, time.altzone,
+                    AlarmCalendar.nonexistent_policy,
+                    AlarmCalendar.repeated_policy, week_start.toordinal())
+        alarm_key = (alarm_item.hour, alarm_item.minute, alarm_item.days_mask)
+        with AlarmCalendar.__cache_lock:
+            day_starts, week_alerts = AlarmCalendar.__cached_week(week_key)
+            alerts = week_alerts.get(alarm_key)
+        if alerts is not None:
+            return alerts
+
+        day_minute = (alarm_item.hour * 60) + alarm_item.minute
+        alerts = []
+        for day in range(7):
+            if alarm_item.days_mask & (1 << day):
+                alert = AlarmCalendar.resolve_day_minute(
+                    week_start + datetime.timedelta(days=day), day_minute,
+                    day_starts[day])
+                if alert is not None:
+                    alerts.append(alert)
+        alerts = tuple(sorted(alerts))
+        with AlarmCalendar.__cache_lock:
+            AlarmCalendar.__cached_week(week_key)[1][alarm_key] = alerts
+        return alerts
+
+    @staticmethod
+    def day_starts(week_start):
+        """
+        Gets the start times of the days of a week, to be used with the
+        resolve_day_minute method.
+        :param week_start: Date of the Monday starting the week.
+        :return: Tuple with the time, in seconds since 1970, of the 00:00 of
+                 each day of the week, or None for the days with a daylight
+                 saving time change.
+        """
+        week_key = (time.tzname, time.timezone, time.altzone,
+                    AlarmCalendar.nonexistent_policy,
+                    AlarmCalendar.repeated_policy, week_start.toordinal())
+        with AlarmCalendar.__cache_lock:
+            return AlarmCalendar.__cached_week(week_key)[0]
+
+    @staticmethod
+    def resolve_day_minute(date, day_minute, day_start):
+        """
+        Converts a minute of a local day into an absolute time, in the same way
+        as the resolve method.
+        :param date: Date of the local day.
+        :param day_minute: Integer with the minute of the day, 0 to 1439.
+        :param day_start: The start time of the day, from the day_starts
+                          method, or None if the day has a daylight saving
+                          time change.
+        :return: Integer with the time in seconds since 1970, or None if the
+                 local time is nonexistent and the policy is to skip it.
+        """
+        if day_start is not None:
+            return day_start + (day_minute * 60)
+        return AlarmCalendar.resolve(
+            date.year, date.month, date.day, day_minute // 60, day_minute % 60)
+
+    @staticmethod
+    def __day_start(date):
+        """
+        :param date: Date of the local day.
+        :return: Time, in seconds since 1970, of the 00:00 of the day, or None
+                 if the day is not exactly 24 hours long, as it contains a
+                 daylight saving time change.
+        """
+        next_date = date + datetime.timedelta(days=1)
+        try:
+            start = int(time.mktime(
+                (date.year, date.month, date.day, 0, 0, 0, 0, 0, -1)))
+            end = int(time.mktime(
+                (next_date.year, next_date.month, next_date.day,
+                 0, 0, 0, 0, 0, -1)))
+        except (OverflowError, ValueError):
+            return None
+        if end - start != 86400 or \
+                datetime.datetime.fromtimestamp(start).timetuple()[:5] != \
+                (date.year, date.month, date.day, 0, 0):
+            return None
+        return start
+
+    @staticmethod
+    def __cached_week(week_key):
+        """
+        Gets the cached alert times of a week, adding the week to the cache if
+        it is not there, and marks it as the most recently used. Must be called
+        with the cache lock acquired.
+        :param week_key: Tuple with the timezone, policies and week start date.
+        :return: Tuple with the tuple of the day starts of the week, and the
+                 dictionary of (hour, minute, days mask) -> sorted tuple of the
+                 alert times in that week.
+        """
+        cache = AlarmCalendar.__week_cache
+        week = cache.pop(week_key, None)
+        if week is None:
+            week_start = datetime.date.fromordinal(week_key[-1])
+            week = (tuple(AlarmCalendar.__day_start(
+                week_start + datetime.timedelta(days=day))
+                for day in range(7)), {})
+            while cache and len(cache) >= AlarmCalendar.max_cache_weeks:
+                cache.popitem(last=False)
+        cache[week_key] = week
+        return week
+
+    @staticmethod
+    def next_alert_time(alarm_item, from_time):
+        """
+        Calculates the time of the next alert for an alarm.
+        :param alarm_item: AlarmItem instance to calculate the alert time.
+        :param from_time: Time, in seconds since 1970, to start searching from.
+                          The minute containing this time is included.
+        :return: Time, in seconds since 1970, of the start of the alert minute,
+                 or None if the alarm has no repeat days.
+        """
+        if alarm_item.days_mask == 0:
+            return None
+        minute_start = int(from_time) - (int(from_time) % 60)
+        today = datetime.datetime.fromtimestamp(minute_start).date()
+        week_start = today - datetime.timedelta(days=today.weekday())
+        # A week can have all its alerts skipped, so also check the next ones
+        for week in range(3):
+            alerts = AlarmCalendar.week_alerts(
+                alarm_item, week_start + datetime.timedelta(days=7 * week))
+            index = bisect.bisect_left(alerts, minute_start)
+            if index < len(alerts):
+                return alerts[index]
+        print('ERROR: Could not find the next alert of the Alarm %s !' %
+              alarm_item.id_, file=sys.stderr)
+        return None
+
+    @staticmethod
+    def clear_cache():
+        """ Removes all the cached alert times. """
+        with AlarmCalendar.__cache_lock:
+            AlarmCalendar.__week_cache.clear()
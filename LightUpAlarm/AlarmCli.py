@@ -19,7 +19,7 @@ import os
 import cmd
 import sys
 import time
-import random
+import threading
 try:
     from LightUpAlarm.AlarmManager import AlarmManager
 except ImportError:
@@ -46,7 +46,7 @@ class AlarmCli(cmd.Cmd):
         default alarm alert callback.
         """
         cmd.Cmd.__init__(self)
-        self.alert_running = False
+        self.alert_lock = threading.Lock()
         if alarm_mgr is None:
             self.alarm_mgr = AlarmManager(alert_callback=self.alarm_alert)
         else:
@@ -477,18 +477,14 @@ class AlarmCli(cmd.Cmd):
         This is the default command line interface Alarm Alert function. It will
         be executed every time an alarm alert is triggered.
         """
-        # Try to prevent re-entry
-        while self.alert_running is True:
-            time.sleep(float(random.randint(1, 100)) / 1000.0)
-        # Should be safe now
-        self.alert_running = True
-        # '\a' is a request to the terminal to beep
-        print('\n\nRING RING RING!!!!\a')
-        print('\a')
-        time.sleep(0.8)
-        print('\a')
-        time.sleep(0.8)
-        print('\a')
-        # print without a new line, using sys to work on python 2 and 3
-        sys.stdout.write(self.prompt)
-        self.alert_running = False
+        # Prevent re-entry
+        with self.alert_lock:
+            # '\a' is a request to the terminal to beep
+            print('\n\nRING RING RING!!!!\a')
+            print('\a')
+            time.sleep(0.8)
+            print('\a')
+            time.sleep(0.8)
+            print('\a')
+            # print without a new line, using sys to work on python 2 and 3
+            sys.stdout.write(self.prompt)
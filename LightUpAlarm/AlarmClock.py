@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+#
+# Clocks used by the alarm and hardware threads to read the time and wait.
+#
+# Copyright (c) 2015 carlosperate http://carlosperate.github.io
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# The SystemClock is used by default. The VirtualClock moves forward straight
+# away on every wait, so the alarms of a whole week can be simulated in
+# seconds, and it records the alerts and hardware actions with the virtual
+# time they happened.
+#
+from __future__ import unicode_literals, absolute_import, print_function
+import time
+import threading
+try:
+    from LightUpAlarm.Py23Compatibility import *
+except ImportError:
+    from Py23Compatibility import *
+
+
+class SystemClock(object):
+    """ Clock following the system time, waits take real time. """
+
+    def time(self):
+        """ :return: Current time, in seconds since 1970. """
+        return time.time()
+
+    def monotonic(self):
+        """ :return: Seconds from a monotonic clock, unaffected by changes. """
+        return monotonic()
+
+    def sleep(self, seconds):
+        """
+        Blocks the calling thread.
+        :param seconds: Time to sleep, in seconds.
+        """
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def wait(self, waitable, timeout=None):
+        """
+        Waits on an Event or a Condition (which must be acquired).
+        :param waitable: threading Event or Condition to wait on.
+        :param timeout: Maximum time to wait, in seconds, or None to wait until
+                        it is set or notified.
+        """
+        waitable.wait(timeout)
+
+    def hold(self):
+        """ Indicates some work started in another thread, see VirtualClock. """
+        pass
+
+    def release(self):
+        """ Indicates the work started with hold() has finished. """
+        pass
+
+    def record(self, event_type, **details):
+        """ Events are only recorded by the VirtualClock. """
+        pass
+
+    def get_records(self, event_type=None):
+        """ :return: Empty list, events are only recorded by VirtualClock. """
+        return []
+
+
+class VirtualClock(SystemClock):
+    """
+    Clock with a virtual time that only moves forward when a thread sleeps or
+    waits on it, and it does it straight away.
+
+    The time should only be waited on by a single thread, which drives the
+    simulation. Other threads doing work for it (like the hardware actions
+    running in a worker pool) should call hold() before starting and release()
+    when finished, so that the virtual time does not move forward while they
+    run. Until then, waits take a short real time instead.
+
+    Every event recorded is kept with the virtual time it happened.
+    """
+
+    # Real time, in seconds, of the waits while some work holds the clock
+    real_wait_time = 0.01
+
+    def __init__(self, start_time=None):
+        """
+        VirtualClock initialiser.
+        :param start_time: Virtual time to start from, in seconds since 1970.
+                           Defaults to the current system time.
+        """
+        self.__now = time.time() if start_time is None else start_time
+        self.__start_time = self.__now
+        self.__end_time = None
+        self.__end_callback = None
+        self.__holds = 0
+        self.__records = []
+        self.__lock = threading.Lock()
+
+    def time(self):
+        with self.__lock:
+            return self.__now
+
+    def monotonic(self):
+        with self.__lock:
+            return self.__now - self.__start_time
+
+    def sleep(self, seconds):
+        self.__advance(seconds)
+
+    def wait(self, waitable, timeout=None):
+        """
+        Moves the time forward by the timeout, or to the end time if there is
+        no timeout. If some work holds the clock it waits a short real time
+        instead, so that the caller can check again after the work finishes.
+        Without a timeout nor an end time it waits until the waitable is set
+        or notified from another thread.
+        """
+        with self.__lock:
+            held = self.__holds > 0
+            end_time = self.__end_time
+        if held is True:
+            waitable.wait(VirtualClock.real_wait_time)
+        elif timeout is not None:
+            self.__advance(timeout)
+        elif end_time is not None:
+            self.__advance(end_time - self.time())
+        else:
+            waitable.wait()
+
+    def hold(self):
+        with self.__lock:
+            self.__holds += 1
+
+    def release(self):
+        with self.__lock:
+            self.__holds = max(self.__holds - 1, 0)
+
+    def run_until(self, end_time, end_callback):
+        """
+        Sets the end of the simulation. When the virtual time reaches the end
+        time it stops moving forward, and the callback is executed once to
+        stop the thread driving the simulation.
+        :param end_time: Virtual time, in seconds since 1970, to stop at.
+        :param end_callback: Function without arguments to call at the end.
+        """
+        with self.__lock:
+            self.__end_time = end_time
+            self.__end_callback = end_callback
+        self.__advance(0)
+
+    def record(self, event_type, **details):
+        """
+        Records an event at the current virtual time.
+        :param event_type: String with the type of event, like 'alert'.
+        :param details: Any other data to keep with the event.
+        """
+        with self.__lock:
+            details['type'] = event_type
+            details['time'] = self.__now
+            self.__records.append(details)
+
+    def get_records(self, event_type=None):
+        """
+        :param event_type: Optional type of the events to retrieve.
+        :return: List of dictionaries with the 'time' and 'type' of each
+                 event, and its details, in the order they were recorded.
+        """
+        with self.__lock:
+            return [dict(record) for record in self.__records
+                    if event_type is None or record['type'] == event_type]
+
+    def __advance(self, seconds):
+        end_callback = None
+        with self.__lock:
+            self.__now += max(seconds, 0)
+            if self.__end_time is not None and self.__now >= self.__end_time:
+                self.__now = self.__end_time
+                end_callback = self.__end_callback
+                self.__end_callback = None
+        if end_callback is not None:
+            end_callback()
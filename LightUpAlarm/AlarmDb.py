@@ -28,10 +28,13 @@
 #   row 1 -> column 'snooze_time', column 'offset_alert_time'
 #
 from __future__ import unicode_literals, absolute_import, print_function
+import os
 import sys
 import json
 import time
 import types
+import atexit
+import threading
 # StringIO embedded into io in python 3
 try:
     import StringIO
@@ -39,6 +42,7 @@ except ImportError:
     from io import StringIO
 try:
     import dataset
+    from sqlalchemy import Integer, Boolean, UnicodeText
 except ImportError:
     print("The dataset package needs to be installed !\nThe LightUpAlarm " +
           "folder contains a README file with more information.")
@@ -52,7 +56,31 @@ except ImportError:
 
 
 class AlarmDb(object):
-    """ Creates and manages a Sqlite database to store and retrieve alarms. """
+    """
+    Creates and manages a Sqlite database to store and retrieve alarms.
+
+    Connecting with dataset creates a new SQLAlchemy engine and reflects the
+    database schema, so this is only done once per database file and the
+    resulting dataset Database is shared between all AlarmDb instances. The
+    SQLAlchemy engine is thread safe, giving each operation its own SQLite
+    connection, so the same database can be used from any thread.
+    """
+
+    # Columns of the alarms table, created on connection so that concurrent
+    # inserts do not race each other creating the columns on first use
+    __alarms_columns = (
+        ('hour', Integer), ('minute', Integer), ('monday', Boolean),
+        ('tuesday', Boolean), ('wednesday', Boolean), ('thursday', Boolean),
+        ('friday', Boolean), ('saturday', Boolean), ('sunday', Boolean),
+        ('enabled', Boolean), ('label', UnicodeText), ('timestamp', Integer))
+
+    # Columns of the repeat weekdays, from Monday to Sunday
+    __weekday_columns = ('monday', 'tuesday', 'wednesday', 'thursday',
+                         'friday', 'saturday', 'sunday')
+
+    # Dictionary of absolute database file path -> dataset Database instance
+    __databases = {}
+    __databases_lock = threading.Lock()
 
     #
     # constructor
@@ -66,32 +94,91 @@ class AlarmDb(object):
         :param db_name: Optional string indicating the database filename.
         """
         if isinstance(db_name, str_type):
-            self.db_file = 'sqlite:///%s.db' % db_name
+            db_path = '%s.db' % db_name
         else:
             if db_name is not None:
                 print('The database name inputted in the AlarmDbHelper ' +
                       'constructor is not a valid String !')
-            self.db_file = 'sqlite:///alarmdatabase.db'
+            db_path = 'alarmdatabase.db'
+        self.db_path = os.path.abspath(db_path)
+        self.db_file = 'sqlite:///%s' % self.db_path
 
-        # Check if the settings table is empty
-        settings_table = self.__connect_settings()
-        rows = settings_table.all()
-        if rows.count == 0:
-            settings_table.insert(dict(snooze_time=3, offset_alert_time=-15))
+        # Connecting to the database also checks the settings table
+        self.__connect()
 
     #
     # db connection member functions
     #
+    def __connect(self):
+        """
+        Gets the shared dataset Database for this database file. It connects to
+        it if it has not been used before, if it has been closed, or if the
+        database file has been removed since.
+        On connection it creates any missing alarms table columns, and if the
+        settings table is empty it adds the defaults.
+        :return: dataset Database instance.
+        """
+        with AlarmDb.__databases_lock:
+            database = AlarmDb.__databases.get(self.db_path)
+            if database is not None and not os.path.isfile(self.db_path):
+                database.engine.dispose()
+                database = None
+            if database is None:
+                database = dataset.connect(self.db_file)
+                AlarmDb.__databases[self.db_path] = database
+                alarms_table = database['alarms']
+                for name, column_type in AlarmDb.__alarms_columns:
+                    if name not in alarms_table.columns:
+                        alarms_table.create_column(name, column_type)
+                settings_table = database['settings']
+                if settings_table.find_one(id=1) is None:
+                    settings_table.insert(
+                        dict(snooze_time=3, offset_alert_time=-15))
+            return database
+
+    def __connect_transaction(self):
+        """
+        Gets the shared dataset Database to be used as a transaction context.
+        When a transaction ends dataset 0.5 reads a thread local flag that only
+        exists in the threads that have already done a schema operation, like
+        the new threads of the flask server, so it is set for the calling
+        thread. No schema operations are done inside the transactions, so the
+        flag is always False.
+        :return: dataset Database instance.
+        """
+        database = self.__connect()
+        if not hasattr(database.local, 'must_release'):
+            database.local.must_release = False
+        return database
+
     def __connect_alarms(self):
         """ Connecting to a SQLite database table 'alarms'. """
-        alarms_table = dataset.connect(self.db_file)['alarms']
+        alarms_table = self.__connect()['alarms']
         return alarms_table
 
     def __connect_settings(self):
         """ Connecting to a SQLite database table 'settings'. """
-        settings_table = dataset.connect(self.db_file)['settings']
+        settings_table = self.__connect()['settings']
         return settings_table
 
+    def close(self):
+        """
+        Closes the shared connection to this database file. Any AlarmDb
+        instance using the same file will reconnect on its next operation.
+        """
+        with AlarmDb.__databases_lock:
+            database = AlarmDb.__databases.pop(self.db_path, None)
+            if database is not None:
+                database.engine.dispose()
+
+    @classmethod
+    def close_all(cls):
+        """ Closes the shared connections to all the database files. """
+        with cls.__databases_lock:
+            for database in cls.__databases.values():
+                database.engine.dispose()
+            cls.__databases.clear()
+
     #
     # member functions to set settings
     #
@@ -180,13 +267,7 @@ class AlarmDb(object):
         alarm_list = []
         for alarm in alarms_table:
             alarm_list.append(
-                AlarmItem(alarm['hour'], alarm['minute'],
-                          days=(alarm['monday'], alarm['tuesday'],
-                                alarm['wednesday'], alarm['thursday'],
-                                alarm['friday'], alarm['saturday'],
-                                alarm['sunday']),
-                          enabled=alarm['enabled'], label=alarm['label'],
-                          timestamp=alarm['timestamp'], alarm_id=alarm['id']))
+                AlarmDb.__row_to_alarm(alarm))
         return alarm_list
 
     def get_all_enabled_alarms(self):
@@ -200,13 +281,7 @@ class AlarmDb(object):
         enabled_alarms = alarms_table.find(enabled=True)
         for alarm in enabled_alarms:
             alarm_list.append(
-                AlarmItem(alarm['hour'], alarm['minute'],
-                          days=(alarm['monday'], alarm['tuesday'],
-                                alarm['wednesday'], alarm['thursday'],
-                                alarm['friday'], alarm['saturday'],
-                                alarm['sunday']),
-                          enabled=alarm['enabled'], label=alarm['label'],
-                          timestamp=alarm['timestamp'], alarm_id=alarm['id']))
+                AlarmDb.__row_to_alarm(alarm))
         return alarm_list
 
     def get_all_disabled_alarms(self):
@@ -220,13 +295,7 @@ class AlarmDb(object):
         disabled_alarms = alarms_table.find(enabled=False)
         for alarm in disabled_alarms:
             alarm_list.append(
-                AlarmItem(alarm['hour'], alarm['minute'],
-                          days=(alarm['monday'], alarm['tuesday'],
-                                alarm['wednesday'], alarm['thursday'],
-                                alarm['friday'], alarm['saturday'],
-                                alarm['sunday']),
-                          enabled=alarm['enabled'], label=alarm['label'],
-                          timestamp=alarm['timestamp'], alarm_id=alarm['id']))
+                AlarmDb.__row_to_alarm(alarm))
         return alarm_list
 
     def get_alarm(self, alarm_id):
@@ -242,16 +311,7 @@ class AlarmDb(object):
         if alarm_dict is None:
             return None
         else:
-            return AlarmItem(alarm_dict['hour'], alarm_dict['minute'],
-                             days=(alarm_dict['monday'], alarm_dict['tuesday'],
-                                   alarm_dict['wednesday'],
-                                   alarm_dict['thursday'],
-                                   alarm_dict['friday'], alarm_dict['saturday'],
-                                   alarm_dict['sunday']),
-                             enabled=alarm_dict['enabled'],
-                             label=alarm_dict['label'],
-                             timestamp=alarm_dict['timestamp'],
-                             alarm_id=alarm_dict['id'])
+            return AlarmDb.__row_to_alarm(alarm_dict)
 
     def export_alarms_json(self):
         """
@@ -310,15 +370,47 @@ class AlarmDb(object):
             alarm_item.timestamp = int(round(time.time()))
 
         alarms_table = self.__connect_alarms()
-        key = alarms_table.insert(
-            dict(hour=alarm_item.hour, minute=alarm_item.minute,
-                 monday=alarm_item.monday, tuesday=alarm_item.tuesday,
-                 wednesday=alarm_item.wednesday, thursday=alarm_item.thursday,
-                 friday=alarm_item.friday, saturday=alarm_item.saturday,
-                 sunday=alarm_item.sunday, enabled=alarm_item.enabled,
-                 label=alarm_item.label, timestamp=alarm_item.timestamp))
+        key = alarms_table.insert(AlarmDb.__alarm_to_row(alarm_item))
         return key
 
+    def add_alarms(self, alarm_items):
+        """
+        Adds a list of alarms to the database in a single transaction. Each
+        alarm is added in the same way as with the add_alarm method.
+        :param alarm_items: List of AlarmItem instances to add.
+        :return: List with the new row primary key of each of the alarms, in
+                 the same order as the input, or None for the invalid items.
+        """
+        return self.apply_batch(add=alarm_items)[0]
+
+    @staticmethod
+    def __row_to_alarm(row):
+        """
+        The rows have already been validated by the AlarmItem accessors before
+        being saved, so the AlarmItem is created without the input sanitation.
+        :param row: Dictionary with the alarms table row data.
+        :return: AlarmItem instance with the row data.
+        """
+        days_mask = AlarmItem.days_to_mask(
+            [row[day] for day in AlarmDb.__weekday_columns])
+        return AlarmItem.from_trusted(
+            row['hour'], row['minute'], days_mask, row['enabled'],
+            row['label'], row['timestamp'], row['id'])
+
+    @staticmethod
+    def __alarm_to_row(alarm_item):
+        """
+        :param alarm_item: AlarmItem instance to convert.
+        :return: Dictionary with the alarms table row data, without the ID.
+        """
+        return dict(hour=alarm_item.hour, minute=alarm_item.minute,
+                    monday=alarm_item.monday, tuesday=alarm_item.tuesday,
+                    wednesday=alarm_item.wednesday,
+                    thursday=alarm_item.thursday, friday=alarm_item.friday,
+                    saturday=alarm_item.saturday, sunday=alarm_item.sunday,
+                    enabled=alarm_item.enabled, label=alarm_item.label,
+                    timestamp=alarm_item.timestamp)
+
     #
     # member functions to edit alarm data
     #
@@ -327,6 +419,9 @@ class AlarmDb(object):
         """
         Edits an alarm to the database with the new input data.
         Uses the input sanitation of the AlarmItem class before the data is set.
+        All the valid edited values are written with a single update inside a
+        transaction, any invalid input is skipped and makes the operation fail,
+        in which case the timestamp is not updated.
         :param hour: Optional integer to indicate the new alarm hour.
         :param minute: Optional integer to indicate the new alarm minute.
         :param days: Optional 7-item list of booleans to indicate the new repeat
@@ -334,80 +429,84 @@ class AlarmDb(object):
         :param enabled: Optional boolean to indicate new alarm enabled state.
         :return: Boolean indicating the success of the 'edit' operation.
         """
-        alarms_table = self.__connect_alarms()
-        success = True
+        return self.edit_alarms([dict(
+            alarm_id=alarm_id, hour=hour, minute=minute, days=days,
+            enabled=enabled, label=label)])[0]
+
+    def edit_alarms(self, edits):
+        """
+        Edits a list of alarms in a single transaction. Each edit is applied in
+        the same way as with the edit_alarm method.
+        :param edits: List of dictionaries with the edit_alarm arguments for
+                      each alarm to edit, 'alarm_id' being required.
+        :return: List of booleans indicating the success of the 'edit'
+                 operation for each alarm, in the same order as the input.
+        """
+        return self.apply_batch(edit=edits)[1]
+
+    @staticmethod
+    def __edit_to_row(alarm_id, hour=None, minute=None, days=None,
+                      enabled=None, label=None):
+        """
+        Validates the edit_alarm arguments using the input sanitation of the
+        AlarmItem class and converts them into an alarms table row data.
+        :return: Tuple with the dictionary with the row ID and the valid edited
+                 columns, plus a new timestamp only if all the inputs are
+                 valid, and a boolean indicating if all the inputs are valid.
+        """
+        row = dict(id=alarm_id)
+        valid = True
 
         # Parse hour variable
         if hour is not None:
             alarm_item = AlarmItem(hour, 0)
-            if alarm_item is not None:
-                individual_success = alarms_table.update(
-                    dict(id=alarm_id, hour=alarm_item.hour), ['id'])
-                if not individual_success:
-                    success = False
+            if alarm_item is None:
+                valid = False
             else:
-                success = False
+                row['hour'] = alarm_item.hour
 
         # Parse minute variable
         if minute is not None:
             alarm_item = AlarmItem(0, minute)
-            if alarm_item is not None:
-                individual_success = alarms_table.update(
-                    dict(id=alarm_id, minute=alarm_item.minute), ['id'])
-                if not individual_success:
-                    success = False
+            if alarm_item is None:
+                valid = False
             else:
-                success = False
+                row['minute'] = alarm_item.minute
 
         # Parse days variable
         if days is not None:
             alarm_item = AlarmItem(0, 0, days=days)
-            if alarm_item is not None:
-                individual_success = alarms_table.update(
-                    dict(id=alarm_id, monday=alarm_item.monday,
-                         tuesday=alarm_item.tuesday,
-                         wednesday=alarm_item.wednesday,
-                         thursday=alarm_item.thursday,
-                         friday=alarm_item.friday,
-                         saturday=alarm_item.saturday,
-                         sunday=alarm_item.sunday),
-                    ['id'])
-                if not individual_success:
-                    success = False
+            if alarm_item is None:
+                valid = False
             else:
-                success = False
+                row.update(monday=alarm_item.monday,
+                           tuesday=alarm_item.tuesday,
+                           wednesday=alarm_item.wednesday,
+                           thursday=alarm_item.thursday,
+                           friday=alarm_item.friday,
+                           saturday=alarm_item.saturday,
+                           sunday=alarm_item.sunday)
 
         # Parse enabled variable
         if enabled is not None:
             alarm_item = AlarmItem(0, 0, enabled=enabled)
-            if alarm_item is not None:
-                individual_success = alarms_table.update(
-                    dict(id=alarm_id, enabled=alarm_item.enabled), ['id'])
-                if not individual_success:
-                    success = False
+            if alarm_item is None:
+                valid = False
             else:
-                success = False
+                row['enabled'] = alarm_item.enabled
 
         # Parse label variable
         if label is not None:
             alarm_item = AlarmItem(0, 0, label=label)
-            if alarm_item is not None:
-                individual_success = alarms_table.update(
-                    dict(id=alarm_id, label=alarm_item.label), ['id'])
-                if not individual_success:
-                    success = False
+            if alarm_item is None:
+                valid = False
             else:
-                success = False
+                row['label'] = alarm_item.label
 
-        # Apply the timestamp if changes have been successful
-        if success is True:
-            new_timestamp = int(round(time.time()))
-            individual_success = alarms_table.update(
-                dict(id=alarm_id, timestamp=new_timestamp), ['id'])
-            if not individual_success:
-                success = False
-
-        return success
+        # Set the new timestamp only if all the changes are valid
+        if valid is True:
+            row['timestamp'] = int(round(time.time()))
+        return row, valid
 
     def update_alarm(self, alarm):
         """
@@ -446,6 +545,64 @@ class AlarmDb(object):
         success = alarms_table.delete(id=alarm_id)
         return success
 
+    def delete_alarms(self, alarm_ids):
+        """
+        Removes a list of alarms from the database in a single transaction.
+        :param alarm_ids: List of integers to indicate the primary keys of the
+                          rows to be removed.
+        :return: List of booleans indicating the success of the 'delete'
+                 operation for each alarm, in the same order as the input.
+        """
+        return self.apply_batch(delete=alarm_ids)[2]
+
+    #
+    # member functions to change several alarms at once
+    #
+    def apply_batch(self, add=None, edit=None, delete=None):
+        """
+        Adds, edits and deletes lists of alarms, in that order, in a single
+        transaction, so if any of the operations raises an error none of them
+        is saved. Each item is applied in the same way as with the add_alarm,
+        edit_alarm and delete_alarm methods, so an invalid item fails on its
+        own without affecting the rest.
+        :param add: Optional list of AlarmItem instances to add.
+        :param edit: Optional list of dictionaries with the edit_alarm
+                     arguments for each alarm to edit, 'alarm_id' being
+                     required.
+        :param delete: Optional list of integers to indicate the primary keys
+                       of the rows to be removed.
+        :return: Tuple with the list of the new row primary keys of the added
+                 alarms (None for the invalid items), and the lists of booleans
+                 indicating the success of each edit and delete operation, in
+                 the same order as the inputs.
+        """
+        keys, edit_results, delete_results = [], [], []
+        with self.__connect_transaction() as database:
+            alarms_table = database['alarms']
+            for alarm_item in add or []:
+                if not isinstance(alarm_item, AlarmItem):
+                    print('ERROR: Provided items to AlarmDb().apply_batch ' +
+                          'must be of the AlarmItem type and not %s !' %
+                          type(alarm_item), file=sys.stderr)
+                    keys.append(None)
+                    continue
+                if alarm_item.timestamp is None:
+                    alarm_item.timestamp = int(round(time.time()))
+                keys.append(
+                    alarms_table.insert(AlarmDb.__alarm_to_row(alarm_item)))
+
+            for edit_args in edit or []:
+                row, valid = AlarmDb.__edit_to_row(**edit_args)
+                # The row always contains the ID, only update if there is more
+                success = False
+                if len(row) > 1:
+                    success = alarms_table.update(row, ['id'])
+                edit_results.append(valid is True and bool(success))
+
+            for alarm_id in delete or []:
+                delete_results.append(alarms_table.delete(id=alarm_id))
+        return keys, edit_results, delete_results
+
     def delete_all_alarms(self):
         """
         Remove all the alarms by dropping the table and creating it again.
@@ -454,3 +611,7 @@ class AlarmDb(object):
         alarms_table = self.__connect_alarms()
         success = alarms_table.delete()
         return success
+
+
+# Close the shared database connections on interpreter exit
+atexit.register(AlarmDb.close_all)
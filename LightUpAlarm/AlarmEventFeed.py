@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+#
+# Feed of the changes and alerts of the alarms.
+#
+# Copyright (c) 2015 carlosperate http://carlosperate.github.io
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# This file only contains a class definition, which description can be found in
+# its docstring.
+#
+from __future__ import (unicode_literals, absolute_import, print_function,
+    division)
+import time
+import threading
+import collections
+
+
+class AlarmEventFeed(object):
+    """
+    Keeps a list of the latest alarm events (alarm added, edited, deleted,
+    reloaded, or alert triggered) so that any number of readers can follow
+    them.
+
+    Each event is a dictionary with an increasing 'version' number, its
+    'type', the alarm 'id' and the 'time', in seconds since 1970, that it was
+    published, plus any extra event data. Readers keep the version of the last
+    event they have received and ask for the events after it, optionally
+    waiting until there is a new event.
+    Only the latest max_events events are kept, if a reader asks for events
+    that have already been discarded it receives a 'reset' event first, to
+    indicate that it has to retrieve all the alarms data again.
+
+    All the member variables are protected by the same condition variable, so
+    the public methods can be safely called from any thread.
+    """
+
+    # Event types
+    ADD = 'add'
+    EDIT = 'edit'
+    DELETE = 'delete'
+    RELOAD = 'reload'
+    ALERT = 'alert'
+    RESET = 'reset'
+
+    #
+    # metaclass methods
+    #
+    def __init__(self, max_events=256):
+        """
+        AlarmEventFeed initialiser.
+        :param max_events: Maximum number of events to keep.
+        """
+        self.__events = collections.deque(maxlen=max_events)
+        self.__version = 0
+        self.__condition = threading.Condition()
+
+    #
+    # member methods
+    #
+    def publish(self, event_type, alarm_id=None, **data):
+        """
+        Adds an event to the feed and wakes up any readers waiting for it.
+        :param event_type: String with the event type.
+        :param alarm_id: ID of the alarm the event belongs to.
+        :param data: Any additional event data.
+        :return: Integer with the version of the new event.
+        """
+        self.__condition.acquire()
+        try:
+            self.__version += 1
+            event = dict(data)
+            event.update({'version': self.__version, 'type': event_type,
+                          'id': alarm_id, 'time': time.time()})
+            self.__events.append(event)
+            self.__condition.notify_all()
+            return self.__version
+        finally:
+            self.__condition.release()
+
+    def get_version(self):
+        """
+        :return: Integer with the version of the latest event, 0 if there are
+                 no events yet.
+        """
+        self.__condition.acquire()
+        try:
+            return self.__version
+        finally:
+            self.__condition.release()
+
+    def get_events(self, since=0, timeout=None):
+        """
+        Gets the events published after the given version. If there are none
+        it waits for new events for up to the given timeout.
+        :param since: Integer with the version of the last event received, or
+                      0 to receive all the events kept.
+        :param timeout: Maximum time to wait for new events, in seconds. If
+                        None it does not wait.
+        :return: List of events, ordered by version. The first event is a
+                 'reset' event if any events after the 'since' version have
+                 been discarded, or if 'since' is newer than the feed version.
+        """
+        end_time = None if timeout is None else time.time() + timeout
+        self.__condition.acquire()
+        try:
+            while since == self.__version and end_time is not None:
+                wait_time = end_time - time.time()
+                if wait_time <= 0:
+                    break
+                self.__condition.wait(wait_time)
+
+            events = [dict(event) for event in self.__events
+                      if event['version'] > since]
+            oldest_version = self.__version - len(self.__events) + 1
+            if since > self.__version or \
+                    (self.__version > since and since + 1 < oldest_version):
+                events.insert(0, {'version': self.__version,
+                                  'type': AlarmEventFeed.RESET, 'id': None,
+                                  'time': time.time()})
+            return events
+        finally:
+            self.__condition.release()
@@ -6,14 +6,56 @@
 #
 # Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
 #
+# The repeat weekdays are stored as a 7-bit mask, bit 0 for Monday to bit 6 for
+# Sunday, and the instances use __slots__ to keep them small when all the
+# alarms are loaded from the database.
+#
 from __future__ import unicode_literals, absolute_import, print_function
-import collections
 try:
     from LightUpAlarm.Py23Compatibility import *
 except ImportError:
     from Py23Compatibility import *
 
 
+WEEKDAYS = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday',
+            'Saturday', 'Sunday')
+
+DAY_MINUTES = 1440
+WEEK_MINUTES = DAY_MINUTES * 7
+ALL_DAYS_MASK = 0b1111111
+
+# Lookup table of [days mask][weekday] -> number of days from the weekday,
+# inclusive, to the first repeat day of the mask. None for an empty mask.
+_DAYS_TO_REPEAT = [[None] * 7] + [
+    [next(days for days in range(7) if mask & (1 << ((weekday + days) % 7)))
+     for weekday in range(7)]
+    for mask in range(1, ALL_DAYS_MASK + 1)]
+
+
+def _day_property(day):
+    """
+    Creates the accessor property for a single repeat weekday.
+    :param day: Integer of the weekday, 0 for Monday to 6 for Sunday.
+    :return: Property to get and set the repeat state of the weekday.
+    """
+    bit = 1 << day
+
+    def get_day(self):
+        return (self._AlarmItem__days & bit) != 0
+
+    def set_day(self, new_day):
+        if isinstance(new_day, bool_type):
+            if new_day is True:
+                self._AlarmItem__days |= bit
+            else:
+                self._AlarmItem__days &= ~bit
+        else:
+            print('ERROR: New value for the AlarmItem().%s variable has to ' %
+                  WEEKDAYS[day].lower() + 'be a Boolean !', file=sys.stderr)
+
+    return property(get_day, set_day)
+
+
 class AlarmItem(object):
     """
     This class defines an Alarm object, with the following data items.
@@ -33,7 +75,14 @@ class AlarmItem(object):
                    was modified. This is stored and read from the storage
                    database, so this class does not set the value without an
                    input (stays as None).
+        next_alert: Minutes left to the next alert, only set by the
+                    AlarmManager when retrieving the next alarms. Not
+                    validated nor compared.
+    Two alarms are equal, and have the same hash, if all their data is equal.
+    An alarm used as a dictionary key or in a set should not be modified.
     """
+    __slots__ = ('__id', '__hour', '__minute', '__days', '__enabled',
+                 '__label', '__timestamp', 'next_alert')
 
     #
     # metaclass methods: constructor, initialiser and print
@@ -66,48 +115,30 @@ class AlarmItem(object):
         instance.__hour = 0
         # Indicates if the alarm is enabled or not
         instance.__enabled = False
-        # Contains the days of the weeks that this alarm repeats
-        instance.__repeat = collections.OrderedDict()
-        instance.__repeat['Monday'] = False
-        instance.__repeat['Tuesday'] = False
-        instance.__repeat['Wednesday'] = False
-        instance.__repeat['Thursday'] = False
-        instance.__repeat['Friday'] = False
-        instance.__repeat['Saturday'] = False
-        instance.__repeat['Sunday'] = False
+        # Mask of the days of the weeks that this alarm repeats
+        instance.__days = 0
         # Contains the label string
         instance.__label = ''
         # Contains the timestamp of the last time it was modified
         instance.__timestamp = None
-
-        # Assigning values using accessors with input sanitation
-        instance.hour = hour
-        instance.minute = minute
-        instance.repeat = days
-        instance.enabled = enabled
-        instance.label = label
+        instance.next_alert = None
+
+        # Assigning values using the accessors input sanitation, which return
+        # False if the input was invalid and the object should not be created
+        valid_inputs = instance.__set_hour(hour)
+        valid_inputs &= instance.__set_minute(minute)
+        if days is not None:
+            valid_inputs &= instance.__set_repeat(days)
+        enabled_set = instance.__set_enabled(enabled)
+        if enabled is not None:
+            valid_inputs &= enabled_set
+        label_set = instance.__set_label(label)
+        if label is not None:
+            valid_inputs &= label_set
         if timestamp is not None:
-            instance.timestamp = timestamp
+            valid_inputs &= instance.__set_timestamp(timestamp)
         if alarm_id is not None:
-            instance.id_ = alarm_id
-
-        # Now we check if the values have been set, if not, it means an input
-        # was invalid and the object should not be created.
-        valid_inputs = True
-        if instance.hour != hour:
-            valid_inputs = False
-        if instance.minute != minute:
-            valid_inputs = False
-        if days is not None and instance.repeat != tuple(days):
-            valid_inputs = False
-        if enabled is not None and instance.enabled != enabled:
-            valid_inputs = False
-        if label is not None and instance.label != label:
-            valid_inputs = False
-        if timestamp is not None and instance.timestamp != timestamp:
-            valid_inputs = False
-        if alarm_id is not None and instance.id_ != alarm_id:
-            valid_inputs = False
+            valid_inputs &= instance.__set_id(alarm_id)
 
         if valid_inputs is True:
             return instance
@@ -124,6 +155,33 @@ class AlarmItem(object):
         """
         pass
 
+    @classmethod
+    def from_trusted(cls, hour, minute, days_mask, enabled, label, timestamp,
+                     alarm_id):
+        """
+        Creates an alarm without the input sanitation, for data that has
+        already been validated, like the rows read from the alarm database.
+        :param hour: Integer from 0 to 23 to indicate the alarm hour.
+        :param minute: Integer from 0 to 59 to indicate the alarm minute.
+        :param days_mask: Integer with the repeat weekdays bits, bit 0 for
+                          Monday to bit 6 for Sunday.
+        :param enabled: Boolean to indicate alarm enabled state.
+        :param label: String with the alarm label.
+        :param timestamp: Positive integer with the modification time, or None.
+        :param alarm_id: Positive integer with the Alarm ID, or None.
+        :return: instance of the AlarmItem class.
+        """
+        instance = object.__new__(cls)
+        instance.__id = alarm_id
+        instance.__hour = hour
+        instance.__minute = minute
+        instance.__days = days_mask
+        instance.__enabled = enabled
+        instance.__label = label
+        instance.__timestamp = timestamp
+        instance.next_alert = None
+        return instance
+
     def __str__(self):
         """
         Converts the class instance data into a readable string format.
@@ -132,14 +190,54 @@ class AlarmItem(object):
         enabled = 'Yes' if self.enabled is True else 'No'
         ret_str = 'Alarm ID: %3d | Time: %02d:%02d | Enabled: %3s | Repeat: ' %\
                   (self.id_, self.hour, self.minute, enabled)
-        for day in self.__repeat:
-            if self.__repeat[day] is True:
-                ret_str += "%s " % str(day)[:3]
+        for day in range(7):
+            if self.__days & (1 << day):
+                ret_str += "%s " % WEEKDAYS[day][:3]
             else:
                 ret_str += "--- "
 
         return ret_str
 
+    def __key(self):
+        return (self.__id, self.__hour, self.__minute, self.__days,
+                self.__enabled, self.__label, self.__timestamp)
+
+    def __eq__(self, other):
+        if not isinstance(other, AlarmItem):
+            return NotImplemented
+        return self.__key() == other.__key()
+
+    def __ne__(self, other):
+        if not isinstance(other, AlarmItem):
+            return NotImplemented
+        return self.__key() != other.__key()
+
+    def __hash__(self):
+        return hash(self.__key())
+
+    #
+    # mask conversion methods
+    #
+    @staticmethod
+    def days_to_mask(days):
+        """
+        :param days: 7-item list of booleans, from Monday to Sunday.
+        :return: Integer with the weekdays bits, bit 0 for Monday.
+        """
+        mask = 0
+        for day in range(7):
+            if days[day]:
+                mask |= 1 << day
+        return mask
+
+    @staticmethod
+    def mask_to_days(mask):
+        """
+        :param mask: Integer with the weekdays bits, bit 0 for Monday.
+        :return: Tuple with 7 booleans, from Monday to Sunday.
+        """
+        return tuple((mask & (1 << day)) != 0 for day in range(7))
+
     #
     # id accesor
     #
@@ -150,12 +248,15 @@ class AlarmItem(object):
         """
         Sets id value. Must be a positive integer.
         :param new_id: new ID for the alarm instance.
+        :return: Boolean indicating if the value was set.
         """
         if isinstance(new_id, int_type) and new_id >= 0:
             self.__id = new_id
+            return True
         else:
             print('ERROR: Provided AlarmItem().id type is not a positive ' +
                   'Integer: %s!' % new_id, file=sys.stderr)
+            return False
 
     id_ = property(__get_id, __set_id)
 
@@ -169,12 +270,15 @@ class AlarmItem(object):
         """
         Ensure new value is a boolean before setting the enabled state.
         :param new_enabled: new enabled state for the alarm instance.
+        :return: Boolean indicating if the value was set.
         """
         if isinstance(new_enabled, bool_type):
             self.__enabled = new_enabled
+            return True
         else:
             print('ERROR: Provided AlarmItem().enabled type is not a boolean' +
                   ': %s!' % new_enabled, file=sys.stderr)
+            return False
 
     enabled = property(__get_enabled, __set_enabled)
 
@@ -188,16 +292,19 @@ class AlarmItem(object):
         """
         Checks input is an integer is a value between 0 - 59.
         :param new_minute: new alarm minutes for the alarm instance.
+        :return: Boolean indicating if the value was set.
         """
         if isinstance(new_minute, int_type):
             if 0 <= new_minute < 60:
                 self.__minute = new_minute
+                return True
             else:
                 print('ERROR: Provided AlarmItem().minute is not between 0 ' +
                       'and 59: %s!' % new_minute, file=sys.stderr)
         else:
             print('ERROR: Provided AlarmItem().minute type is not an Integer' +
                   ': %s!' % new_minute, file=sys.stderr)
+        return False
 
     minute = property(__get_minute, __set_minute)
 
@@ -211,16 +318,19 @@ class AlarmItem(object):
         """
         Checks input is an integer and a value between 0 - 23.
         :param new_hour: new alarm hours for the alarm instance.
+        :return: Boolean indicating if the value was set.
         """
         if isinstance(new_hour, int_type):
             if 0 <= new_hour < 24:
                 self.__hour = new_hour
+                return True
             else:
                 print('ERROR: Provided AlarmItem().hour is not between 0 and ' +
                       '23: %s!' % new_hour, file=sys.stderr)
         else:
             print('ERROR: Provided AlarmItem().hour type is not an Integer' +
                   ': %s!' % new_hour, file=sys.stderr)
+        return False
 
     hour = property(__get_hour, __set_hour)
 
@@ -234,12 +344,15 @@ class AlarmItem(object):
         """
         Checks that the input can be converted to a string and saves it.
         :param new_label: new label for the alarm instance.
+        :return: Boolean indicating if the value was set without changes.
         """
         try:
             self.__label = str(new_label)
         except Exception:
             print('ERROR: Provided AlarmItem().label is not convertible to ' +
                   'a string: %s!' % new_label, file=sys.stderr)
+            return False
+        return self.__label == new_label
 
     label = property(__get_label, __set_label)
 
@@ -254,12 +367,15 @@ class AlarmItem(object):
         Sets timestamp value in seconds since 1970. Must be an positive integer.
         Even at 32bit this should last until the year 2038.
         :param new_timestamp: new ID for the alarm instance.
+        :return: Boolean indicating if the value was set.
         """
         if isinstance(new_timestamp, int_type) and new_timestamp >= 0:
             self.__timestamp = new_timestamp
+            return True
         else:
             print('ERROR: Provided AlarmItem().timestamp type is not a ' +
                   'positive Integer: %s!' % new_timestamp, file=sys.stderr)
+            return False
 
     timestamp = property(__get_timestamp, __set_timestamp)
 
@@ -271,119 +387,47 @@ class AlarmItem(object):
         Returns the days of the week alarm repetition in the form of a tuple.
         :return: Tuple with 7 booleans to indicate repetition for the weekdays.
         """
-        repeat_tuple = (self.__repeat['Monday'], self.__repeat['Tuesday'],
-                        self.__repeat['Wednesday'], self.__repeat['Thursday'],
-                        self.__repeat['Friday'], self.__repeat['Saturday'],
-                        self.__repeat['Sunday'])
-        return repeat_tuple
+        return AlarmItem.mask_to_days(self.__days)
 
     def __set_repeat(self, new_repeat):
         """
         Checks that it is a list/tuple of 7 booleans and if so assigns them to
-        the _repeat dictionary.
+        the repeat weekdays mask.
         :param new_repeat: List of containing 7 booleans to indicate the days
                            of the week the alarm repeats.
+        :return: Boolean indicating if the value was set.
         """
         if len(new_repeat) == 7:
             for day in new_repeat:
                 if not isinstance(day, bool_type):
                     print('ERROR: All items in the AlarmItem().repeat list ' +
                           'have to be Booleans!', file=sys.stderr)
-                    break
-            else:
-                day_int = 0
-                for day in self.__repeat:
-                    self.__repeat[day] = new_repeat[day_int]
-                    day_int += 1
+                    return False
+            self.__days = AlarmItem.days_to_mask(new_repeat)
+            return True
         else:
             print('ERROR: The AlarmItem().repeat must be a list of 7 booleans!',
                   file=sys.stderr)
+            return False
 
     repeat = property(__get_repeat, __set_repeat)
 
-    def __get_monday(self):
-        return self.__repeat['Monday']
-
-    def __set_monday(self, new_monday):
-        if isinstance(new_monday, bool_type):
-            self.__repeat['Monday'] = new_monday
-        else:
-            print('ERROR: New value for the AlarmItem().monday variable has ' +
-                  'to be a Boolean !', file=sys.stderr)
-
-    monday = property(__get_monday, __set_monday)
-
-    def __get_tuesday(self):
-        return self.__repeat['Tuesday']
-
-    def __set_tuesday(self, new_tuesday):
-        if isinstance(new_tuesday, bool_type):
-            self.__repeat['Tuesday'] = new_tuesday
-        else:
-            print('ERROR: New value for the AlarmItem().tuesday variable has ' +
-                  'to be a Boolean !', file=sys.stderr)
-
-    tuesday = property(__get_tuesday, __set_tuesday)
-
-    def __get_wednesday(self):
-        return self.__repeat['Wednesday']
-
-    def __set_wednesday(self, new_wednesday):
-        if isinstance(new_wednesday, bool_type):
-            self.__repeat['Wednesday'] = new_wednesday
-        else:
-            print('ERROR: New value for the AlarmItem().wednesday variable ' +
-                  'has to be a Boolean !', file=sys.stderr)
-
-    wednesday = property(__get_wednesday, __set_wednesday)
-
-    def __get_thursday(self):
-        return self.__repeat['Thursday']
-
-    def __set_thursday(self, new_thursday):
-        if isinstance(new_thursday, bool_type):
-            self.__repeat['Thursday'] = new_thursday
-        else:
-            print('ERROR: New value for the AlarmItem().thursday variable ' +
-                  'has to be a Boolean !', file=sys.stderr)
-
-    thursday = property(__get_thursday, __set_thursday)
-
-    def __get_friday(self):
-        return self.__repeat['Friday']
-
-    def __set_friday(self, new_friday):
-        if isinstance(new_friday, bool_type):
-            self.__repeat['Friday'] = new_friday
-        else:
-            print('ERROR: New value for the AlarmItem().friday variable has ' +
-                  'to be a Boolean !', file=sys.stderr)
-
-    friday = property(__get_friday, __set_friday)
-
-    def __get_saturday(self):
-        return self.__repeat['Saturday']
-
-    def __set_saturday(self, new_saturday):
-        if isinstance(new_saturday, bool_type):
-            self.__repeat['Saturday'] = new_saturday
-        else:
-            print('ERROR: New value for the AlarmItem().saturday variable ' +
-                  'has to be a Boolean !', file=sys.stderr)
-
-    saturday = property(__get_saturday, __set_saturday)
-
-    def __get_sunday(self):
-        return self.__repeat['Sunday']
+    def __get_days_mask(self):
+        """
+        :return: Integer with the repeat weekdays bits, bit 0 for Monday to
+                 bit 6 for Sunday.
+        """
+        return self.__days
 
-    def __set_sunday(self, new_sunday):
-        if isinstance(new_sunday, bool_type):
-            self.__repeat['Sunday'] = new_sunday
-        else:
-            print('ERROR: New value for the AlarmItem().sunday variable ' +
-                  'has to be a Boolean !', file=sys.stderr)
+    days_mask = property(__get_days_mask)
 
-    sunday = property(__get_sunday, __set_sunday)
+    monday = _day_property(0)
+    tuesday = _day_property(1)
+    wednesday = _day_property(2)
+    thursday = _day_property(3)
+    friday = _day_property(4)
+    saturday = _day_property(5)
+    sunday = _day_property(6)
 
     #
     # member methods to retrieve specific data
@@ -393,11 +437,7 @@ class AlarmItem(object):
         Checks if there are any repeat days enabled.
         :return: A boolean value indicating if an repeat weekday is activated.
         """
-        any_enabled = False
-        for day in self.__repeat:
-            if self.__repeat[day] is True:
-                any_enabled = True
-        return any_enabled
+        return self.__days != 0
 
     def is_active(self):
         """
@@ -413,6 +453,16 @@ class AlarmItem(object):
     #
     # member methods to calculate time
     #
+    def week_minutes(self):
+        """
+        Calculates the minutes of the week, from Monday at 00:00, of each of
+        the alarm alerts.
+        :return: Sorted list of integers, one for each repeat weekday.
+        """
+        day_minute = (self.__hour * 60) + self.__minute
+        return [(day * DAY_MINUTES) + day_minute for day in range(7)
+                if self.__days & (1 << day)]
+
     def minutes_to_alert(self, hour, minute, weekday):
         """
         Calculates the time in minutes that will elapse from the initial
@@ -424,43 +474,16 @@ class AlarmItem(object):
         :return: Integer indicating the amount in minutes until the alarm
                  triggers from the initial reference time and weekday.
         """
-        alarm_day_minute = self.minute + (self.hour * 60)
-        ref_day_minute = minute + (hour * 60)
-        one_day_minutes = 1440
-
-        # First corner case, check the same day after input time
-        if (self.repeat[weekday] is True) and \
-                (alarm_day_minute >= ref_day_minute):
-            return alarm_day_minute - ref_day_minute
-
-        # Check the rest of the week until, but not including, the same day
-        day = weekday + 1
-        if day > 6:
-            day = 0
-        day_count = 1
-        while day != weekday:
-            if self.repeat[day] is True:
-                # Add the days in minutes and relative time to reference
-                minutes_difference = day_count * one_day_minutes
-                if alarm_day_minute >= ref_day_minute:
-                    minutes_difference += alarm_day_minute - ref_day_minute
-                else:
-                    minutes_difference -= ref_day_minute - alarm_day_minute
-                # Returns on first encountered alarm
-                return minutes_difference
-            else:
-                day += 1
-                day_count += 1
-                if day > 6:
-                    day = 0
-
-        # Second corner case, check the same day before input time
-        if (self.repeat[weekday] is True) and \
-                (ref_day_minute > alarm_day_minute):
-            return (one_day_minutes * 7) - ref_day_minute + alarm_day_minute
-
-        # Alarm has no enabled days
-        return None
+        if self.__days == 0:
+            # Alarm has no enabled days
+            return None
+        minutes = ((self.__hour - hour) * 60) + self.__minute - minute
+        if minutes < 0:
+            # Already past the alarm time, so start looking from the next day
+            minutes += DAY_MINUTES
+            weekday = (weekday + 1) % 7
+        return minutes + \
+            (_DAYS_TO_REPEAT[self.__days][weekday] * DAY_MINUTES)
 
     def diff_alarm(self, min_difference):
         """
@@ -468,10 +491,8 @@ class AlarmItem(object):
         a time difference indicated by the parameter.
         It edits the label to indicate the time difference.
         It does not copy the ID nor the timestamp.
-        We are reducing the use case to have a range of -59 to 59 minutes to
-        simplify the code.
-        :para min_difference: Time difference, positive or negative in minutes
-                              from -59 to 59, for the new Alarm.
+        :para min_difference: Time difference, positive or negative in minutes,
+                              for the new Alarm.
         :return: Alarm instance with this data + time difference. Returns None
                  if there was an issue with the input data
         """
@@ -480,47 +501,17 @@ class AlarmItem(object):
             print('ERROR: Provided diff_alarm min_difference type is not an '
                   'Integer: %s!' % min_difference, file=sys.stderr)
             return None
-        else:
-            if not (-60 < min_difference < 60):
-                print('ERROR: Provided diff_alarm min_difference is not between'
-                      ' -59 and 59: %s!' % min_difference, file=sys.stderr)
-                return None
-
-        extra_hours = 0
-        extra_days = 0
-
-        new_minute = self.minute + min_difference
-        while new_minute >= 60:
-            new_minute %= 60
-            extra_hours += 1
-        while new_minute < 0:
-            new_minute += 60
-            extra_hours -= 1
-
-        new_hour = self.hour + extra_hours
-        while new_hour >= 24:
-            new_hour %= 24
-            extra_days += 1
-        while new_hour < 0:
-            new_hour += 24
-            extra_days -= 1
-
-        new_days = list(self.repeat)
-        if extra_days < 0:
-            # Move all items up by 1 per day
-            while extra_days < 0:
-                new_days.append(new_days.pop(0))
-                extra_days += 1
-        elif extra_days > 0:
-            # Move all items down by 1 per day, input sanitation protects
-            # against this breaking if extra_days > 6
-            list_to_head = new_days[(len(new_days) - extra_days):]
-            new_days = list_to_head + \
-                new_days[0:(len(new_days) - extra_days)]
+
+        extra_days, day_minute = divmod(
+            (self.__hour * 60) + self.__minute + min_difference, DAY_MINUTES)
+        # Each repeat day moves forward the extra days, rotating the mask bits
+        shift = extra_days % 7
+        new_days = ((self.__days << shift) | (self.__days >> (7 - shift))) & \
+            ALL_DAYS_MASK
 
         new_label = self.label + \
             (" (Alarm %s %+dmin)" % (self.id_, min_difference))
 
-        alarm_diff = AlarmItem(new_hour, new_minute, days=new_days,
-                               enabled=self.enabled, label=new_label)
-        return alarm_diff
+        return AlarmItem.from_trusted(
+            day_minute // 60, day_minute % 60, new_days, self.__enabled,
+            new_label, None, None)
@@ -8,34 +8,97 @@
 #
 # Alarm management system. It saves alarms into a database using the AlarmDb
 # class and launches a running thread per active alarm using the AlarmThread
-# class.
+# class, or alternatively it schedules all active alarms in a single thread
+# using the AlarmScheduler class. The alerts of all the alarms are executed
+# one at a time in the order they trigger by the AlertDispatcher class.
+# The alarm changes and alerts are published into an AlarmEventFeed.
+# All the alarms are kept in an in-memory cache, so reading alarms does not
+# access the database. Any change done through this class is written to both.
+# The cache also contains a sorted index of the minutes of the week in which
+# each active alarm alerts, used to find the next alarms to alert. The alerts
+# found in the index are resolved into absolute times, across daylight saving
+# time changes, by the AlarmCalendar class.
 # It also provides access to the Alarm settings (snooze time, and alarm
 # offset alert time).
 #
 from __future__ import unicode_literals, absolute_import, print_function
+import os
 import sys
 import time
+import bisect
+import datetime
+import threading
+import collections
 try:
     from LightUpAlarm.AlarmDb import AlarmDb
     from LightUpAlarm.AlarmItem import AlarmItem
     from LightUpAlarm.AlarmThread import AlarmThread
+    from LightUpAlarm.AlarmScheduler import AlarmScheduler
+    from LightUpAlarm.AlertDispatcher import AlertDispatcher
+    from LightUpAlarm.AlarmEventFeed import AlarmEventFeed
+    from LightUpAlarm.AlarmCalendar import AlarmCalendar
+    from LightUpAlarm.AlarmClock import SystemClock, VirtualClock
     from LightUpAlarm.Py23Compatibility import *
 except ImportError:
     from AlarmDb import AlarmDb
     from AlarmItem import AlarmItem
     from AlarmThread import AlarmThread
+    from AlarmScheduler import AlarmScheduler
+    from AlertDispatcher import AlertDispatcher
+    from AlarmEventFeed import AlarmEventFeed
+    from AlarmCalendar import AlarmCalendar
+    from AlarmClock import SystemClock, VirtualClock
     from Py23Compatibility import *
 
 
 class AlarmManager(object):
     """
     General management system for the LightUp Alarm package.
+
+    The alarms are cached in memory at class level, as the static methods and
+    all the instances share the same database. The cache is loaded once and
+    updated by every add, edit, update and delete operation. If the database
+    file is modified by anything else (like another process or a direct use
+    of the AlarmDb class) the cache is reloaded on the next read, unless the
+    reload_on_change class variable is set to False. As the cache, this
+    setting is shared by all the instances.
     """
 
+    # Reload the alarm cache when the database file is modified outside of the
+    # AlarmManager
+    reload_on_change = True
+
+    # Ordered dictionary of alarm ID -> AlarmItem, None until loaded
+    __alarm_cache = None
+    # Sorted list of (minute of the week, alarm ID) for every alert of the
+    # active alarms, with the minute of the week starting on Monday at 00:00
+    __alert_index = []
+    # Dictionary of alarm ID -> list of its alert minutes of the week
+    __alert_minutes = {}
+    # Database file (modification time, size) when the cache was last synced
+    __cache_signature = None
+    # Counter increased on every change to the cached alarms
+    __alarms_version = 0
+    # Feed of the alarm changes and alerts, shared like the cache
+    __event_feed = AlarmEventFeed()
+    # Alert dispatchers shared by all the instances, so their alerts are
+    # executed one at a time, as dictionary of clock (None for the system
+    # clock) -> (AlertDispatcher, dictionary of its queue options)
+    __dispatchers = {}
+    __dispatchers_lock = threading.Lock()
+    __cache_lock = threading.RLock()
+    __week_minutes = 7 * 1440
+    # Minutes an alert can be moved from its wall clock minute when resolved,
+    # larger than any daylight saving time change
+    __dst_margin = 240
+
     #
     # Instance initialiser
     #
-    def __init__(self, alert_callback=None, offset_alert_callback=None):
+    def __init__(self, alert_callback=None, offset_alert_callback=None,
+                 use_scheduler=False, clock=None,
+                 alert_queue_size=32, alert_ordering=AlertDispatcher.FIFO,
+                 alert_coalesce_time=0):
         """
         On initialization we connect to the database and check if there are
         any alarms to load. If not, load a couple of dummy alarms.
@@ -45,16 +108,57 @@ class AlarmManager(object):
         :param offset_alert_callback: Optional argument to register a callback
                                       function to be executed on an offset time
                                       of the alarm.
+        :param use_scheduler: Optional boolean to run all the active alarms in
+                              a single AlarmScheduler thread instead of an
+                              AlarmThread per alarm.
+        :param clock: Optional clock instance, from the AlarmClock module, to
+                      read the time from. With a VirtualClock the scheduler is
+                      always used, and its thread is not started, instead the
+                      simulate method runs the alarms in the calling thread.
+        :param alert_queue_size: Optional maximum number of alerts waiting to
+                                 be executed, any more alerts are dropped.
+                                 This and the following options are only used
+                                 by the first instance to start the shared
+                                 alert dispatcher.
+        :param alert_ordering: Optional order to execute the queued alerts,
+                               AlertDispatcher.FIFO (default) or
+                               AlertDispatcher.PRIORITY (offset alerts after
+                               the alarm alerts).
+        :param alert_coalesce_time: Optional time, in seconds, for an alert to
+                                    be merged into a queued alert with the same
+                                    callback. 0 (default) to never merge them.
         """
+        # Load the alarm cache from the database
+        AlarmManager.__load_alarm_cache()
+
         # Save the alarm callback functions as a private member variable
         self.__alert_callback = alert_callback
         self.__offset_alert_callback = offset_alert_callback
+        self.__clock = clock if clock is not None else SystemClock()
+        self.__simulated = isinstance(clock, VirtualClock)
+        if self.__simulated is True and use_scheduler is False:
+            print('ERROR: A VirtualClock can only be used with the scheduler, '
+                  'which has been enabled !', file=sys.stderr)
+            use_scheduler = True
+
+        # The alerts of all the instances are queued into a single dispatcher
+        # thread, the queue options are only used if it is started by this one
+        self.__dispatcher_options = {'max_size': alert_queue_size,
+                                     'ordering': alert_ordering,
+                                     'coalesce_time': alert_coalesce_time}
+        self.__dispatcher = None
+        self.__start_dispatcher()
 
         # Create a private member list for the alarm threads
         self.__alarm_threads = []
 
+        # The scheduler replaces the alarm threads if requested
+        self.__scheduler = None
+        if use_scheduler is True:
+            self.__start_scheduler()
+
         # Set dummy alarms if database empty
-        if AlarmDb().get_number_of_alarms() == 0:
+        if AlarmManager.get_number_of_alarms() == 0:
             self.load_dummy_alarms()
 
         # Register and launch any active (enabled with repeat days) alarms
@@ -113,7 +217,8 @@ class AlarmManager(object):
         :return: List of AlarmItems containing all alarms. Returns an empty list
                  if there aren't any.
         """
-        return AlarmDb().get_all_alarms()
+        return [AlarmManager.__copy_alarm(alarm) for alarm in
+                AlarmManager.__get_alarm_cache().values()]
 
     @staticmethod
     def get_number_of_alarms():
@@ -121,7 +226,7 @@ class AlarmManager(object):
         Gets the number of alarms stored in the database.
         :return: Integer indicating the number of alarms in the db.
         """
-        return AlarmDb().get_number_of_alarms()
+        return len(AlarmManager.__get_alarm_cache())
 
     @staticmethod
     def get_all_enabled_alarms():
@@ -130,7 +235,8 @@ class AlarmManager(object):
         :return: List of AlarmItems containing all enabled alarms. Returns an
                  empty list if there aren't any.
         """
-        return AlarmDb().get_all_enabled_alarms()
+        return [alarm for alarm in AlarmManager.get_all_alarms()
+                if alarm.enabled is True]
 
     @staticmethod
     def get_all_disabled_alarms():
@@ -139,7 +245,8 @@ class AlarmManager(object):
         :return: List of AlarmItems containing all enabled alarms. Returns an
                  empty list if there aren't any.
         """
-        return AlarmDb().get_all_disabled_alarms()
+        return [alarm for alarm in AlarmManager.get_all_alarms()
+                if alarm.enabled is False]
 
     @staticmethod
     def get_all_active_alarms():
@@ -168,30 +275,364 @@ class AlarmManager(object):
         :return: AlarmItem with the alarm data, or None if id could not be
                  found.
         """
-        return AlarmDb().get_alarm(alarm_id)
+        alarm = AlarmManager.__get_alarm_cache().get(alarm_id)
+        if alarm is None:
+            return None
+        return AlarmManager.__copy_alarm(alarm)
 
     @staticmethod
-    def get_next_alarm():
+    def get_next_alarm(from_time=None):
         """
         Gets the current time and all the active alarms. For each of these
         alarms it calculates the elapsed time that will pass for its next alert.
         Then it sorts the list based on this value and returns closes.
+        :param from_time: Optional time, in seconds since 1970, to search from.
+                          Defaults to the current time, use the clock time for
+                          an AlarmManager with a VirtualClock.
         :return: AlarmItem of the next alarm to alert.
         """
-        # now_time[3] = tm_hour, now_time[4] = tm_minute, now_time[6] = tm_wday
-        now_time = time.localtime(time.time())
-
-        all_alarms = AlarmManager.get_all_active_alarms()
-        if len(all_alarms) > 0:
-            for alarm in all_alarms:
-                alarm.next_alert = alarm.minutes_to_alert(
-                    now_time[3], now_time[4], now_time[6])
-            sorted_alarms = sorted(
-                all_alarms, key=lambda a: a.next_alert)
-            return sorted_alarms[0]
+        next_alarms = AlarmManager.get_next_alarms(1, from_time)
+        if next_alarms:
+            return next_alarms[0]
         else:
             return None
 
+    @staticmethod
+    def get_next_alarms(number, from_time=None):
+        """
+        Gets the next alerts from the current time, searching the sorted index
+        of the active alarms alert minutes of the week. Only the alerts found
+        in the index are resolved into absolute times by the AlarmCalendar, so
+        they follow its daylight saving time policies. An alarm repeating on
+        several days can appear more than once.
+        :param number: Integer, maximum number of alerts to retrieve. At most
+                       the alerts for the next 7 days are retrieved.
+        :param from_time: Optional time, in seconds since 1970, to search from.
+                          Defaults to the current time.
+        :return: List of AlarmItems in the order they will alert, each with
+                 a 'next_alert' attribute with the minutes left to its alert,
+                 0 if it is in the current minute.
+        """
+        now = time.time() if from_time is None else from_time
+        minute_start = int(now) - (int(now) % 60)
+        end_time = minute_start + (7 * 24 * 3600)
+        local_start = datetime.datetime.fromtimestamp(minute_start)
+        week_start = local_start.date() - \
+            datetime.timedelta(days=local_start.weekday())
+        start_minute = AlarmManager.__wall_minute(week_start, local_start)
+        margin = AlarmManager.__dst_margin
+        last_minute = start_minute + AlarmManager.__week_minutes + margin
+
+        alerts = []
+        with AlarmManager.__cache_lock:
+            cache = AlarmManager.__get_alarm_cache()
+            # The index is read in windows of wall clock minutes. Once enough
+            # alerts are found one more window is read, as its alerts can be
+            # moved before the ones found by a daylight saving time change.
+            low = start_minute - margin
+            found = False
+            while AlarmManager.__alert_index and low < last_minute:
+                alerts.extend(AlarmManager.__resolve_index(
+                    week_start, low, low + margin, minute_start, end_time))
+                low += margin
+                if found is True:
+                    break
+                found = len(alerts) >= number
+            alerts.sort()
+
+            next_alarms = []
+            for alert_time, _, alarm_id in alerts[:number]:
+                alarm = AlarmManager.__copy_alarm(cache[alarm_id])
+                alarm.next_alert = (alert_time - minute_start) // 60
+                next_alarms.append(alarm)
+        return next_alarms
+
+    @staticmethod
+    def upcoming(start, end):
+        """
+        Gets all the alerts, including the offset alerts, between two times.
+        The alerts of the time window are sliced directly from the sorted alert
+        index, instead of calculating them alarm by alarm, and resolved into
+        absolute times by the AlarmCalendar, so they follow its daylight saving
+        time policies.
+        :param start: Local datetime of the start of the window, inclusive.
+        :param end: Local datetime of the end of the window, exclusive.
+        :return: List of (alarm ID, alert datetime, offset alert flag) tuples,
+                 sorted by alert time.
+        """
+        start_time = AlarmManager.__local_timestamp(start)
+        end_time = AlarmManager.__local_timestamp(end)
+        week_start = start.date() - datetime.timedelta(days=start.weekday())
+        margin = AlarmManager.__dst_margin
+        low = AlarmManager.__wall_minute(week_start, start) - margin
+        high = AlarmManager.__wall_minute(week_start, end) + 1 + margin
+        offset_alarm_time = AlarmManager.get_offset_alert_time()
+        shifts = [(0, False)]
+        if offset_alarm_time is not None:
+            shifts.append((offset_alarm_time, True))
+
+        alerts = []
+        with AlarmManager.__cache_lock:
+            AlarmManager.__get_alarm_cache()
+            for shift, offset_flag in shifts:
+                alerts.extend(AlarmManager.__resolve_index(
+                    week_start, low, high, start_time, end_time, shift,
+                    offset_flag))
+        alerts.sort()
+        # Many alerts share the same time, so its datetime is reused
+        date_times = {}
+        upcoming_alerts = []
+        for alert_time, offset_flag, alarm_id in alerts:
+            date_time = date_times.get(alert_time)
+            if date_time is None:
+                date_time = date_times[alert_time] = \
+                    datetime.datetime.fromtimestamp(alert_time)
+            upcoming_alerts.append((alarm_id, date_time, offset_flag))
+        return upcoming_alerts
+
+    @staticmethod
+    def __resolve_index(week_start, low, high, start_time, end_time, shift=0,
+                        offset_flag=False):
+        """
+        Gets the alerts of the alert index in a window of wall clock minutes,
+        and resolves them into absolute times with the AlarmCalendar. Must be
+        called with the cache lock acquired.
+        :param week_start: Date of the Monday the minutes are counted from.
+        :param low: Integer, first minute of the window, counted from the week
+                    start at 00:00. It can be negative, or over a week.
+        :param high: Integer, minute after the end of the window.
+        :param start_time: Time, in seconds since 1970, of the first alert
+                           time to return, inclusive.
+        :param end_time: Time, in seconds since 1970, of the last alert time
+                         to return, exclusive.
+        :param shift: Optional integer, minutes to add to the alerts from the
+                      index, for the offset alerts.
+        :param offset_flag: Optional offset alert flag to set in the alerts.
+        :return: List of (alert time, offset alert flag, alarm ID) tuples, not
+                 sorted.
+        """
+        index = AlarmManager.__alert_index
+        week_minutes = AlarmManager.__week_minutes
+        alerts = []
+        # Each day is resolved on its own, with the same day start time
+        for day in range(low // 1440, -(-high // 1440)):
+            date = week_start + datetime.timedelta(days=day)
+            day_start = AlarmCalendar.day_starts(
+                date - datetime.timedelta(days=date.weekday()))[date.weekday()]
+            day_low = max(low, day * 1440)
+            day_high = min(high, (day + 1) * 1440)
+            if day_start is not None:
+                # The time limits are converted into minutes of the window
+                day_low = max(day_low, (day * 1440) +
+                              int(-((day_start - start_time) // 60)))
+                day_high = min(day_high, (day * 1440) +
+                               int(-((day_start - end_time) // 60)))
+            day_low -= shift
+            day_high -= shift
+            # The minutes of the day can wrap around the end of the index week
+            base = (day_low // week_minutes) * week_minutes
+            while base < day_high:
+                first = bisect.bisect_left(index, (day_low - base,))
+                last = bisect.bisect_left(index, (day_high - base,))
+                minutes = base + shift - (day * 1440)
+                if day_start is not None:
+                    alert_start = day_start + (minutes * 60)
+                    alerts.extend(
+                        (alert_start + (week_minute * 60), offset_flag,
+                         alarm_id)
+                        for week_minute, alarm_id in index[first:last])
+                else:
+                    for week_minute, alarm_id in index[first:last]:
+                        alert_time = AlarmCalendar.resolve_day_minute(
+                            date, week_minute + minutes, None)
+                        if alert_time is not None and \
+                                start_time <= alert_time < end_time:
+                            alerts.append((alert_time, offset_flag, alarm_id))
+                base += week_minutes
+        return alerts
+
+    @staticmethod
+    def __wall_minute(week_start, date_time):
+        """
+        :param week_start: Date of the Monday the minutes are counted from.
+        :param date_time: Local datetime.
+        :return: Integer with the local wall clock minute containing date_time,
+                 counted from the week start at 00:00.
+        """
+        delta = date_time - datetime.datetime.combine(
+            week_start, datetime.time())
+        return (delta.days * 1440) + (delta.seconds // 60)
+
+    @staticmethod
+    def __local_timestamp(date_time):
+        """
+        :param date_time: Local datetime.
+        :return: Time, in seconds since 1970, of the local datetime.
+        """
+        return time.mktime(date_time.timetuple()) + \
+            (date_time.microsecond / 1000000.0)
+
+    @staticmethod
+    def get_alarms_version():
+        """
+        Gets a version number of the alarms data, which changes every time any
+        alarm is added, edited or deleted, or the cache is reloaded. It can be
+        used to check if the alarms have changed without retrieving them.
+        :return: Integer with the current alarms version.
+        """
+        with AlarmManager.__cache_lock:
+            AlarmManager.__get_alarm_cache()
+            return AlarmManager.__alarms_version
+
+    @staticmethod
+    def get_events(since=0, timeout=None):
+        """
+        Gets the alarm events (alarms added, edited, deleted, reloaded from the
+        database, or alerts triggered), as described in the
+        AlarmEventFeed.get_events method.
+        :param since: Integer with the version of the last event received.
+        :param timeout: Maximum time, in seconds, to wait for new events.
+        :return: List of event dictionaries, ordered by version.
+        """
+        return AlarmManager.__event_feed.get_events(since, timeout)
+
+    @staticmethod
+    def get_events_version():
+        """
+        :return: Integer with the version of the latest alarm event.
+        """
+        return AlarmManager.__event_feed.get_version()
+
+    #
+    # static methods to manage the alarm cache
+    #
+    @staticmethod
+    def __copy_alarm(alarm):
+        """
+        Creates a copy of an AlarmItem, so that the cached instances cannot be
+        modified from outside.
+        :param alarm: AlarmItem to copy.
+        :return: New AlarmItem instance with the same data.
+        """
+        return AlarmItem.from_trusted(
+            alarm.hour, alarm.minute, alarm.days_mask, alarm.enabled,
+            alarm.label, alarm.timestamp, alarm.id_)
+
+    @staticmethod
+    def __db_file_signature():
+        """
+        :return: Tuple with the modification time and size of the database
+                 file, or None if the file does not exist.
+        """
+        try:
+            stat = os.stat(AlarmDb().db_path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
+
+    @staticmethod
+    def __load_alarm_cache():
+        """ Loads all the alarms from the database into the cache. """
+        with AlarmManager.__cache_lock:
+            reload_flag = AlarmManager.__alarm_cache is not None
+            cache = collections.OrderedDict()
+            AlarmManager.__alert_index = []
+            AlarmManager.__alert_minutes = {}
+            for alarm in AlarmDb().get_all_alarms():
+                cache[alarm.id_] = alarm
+                AlarmManager.__index_alarm(alarm)
+            AlarmManager.__alarm_cache = cache
+            AlarmManager.__cache_signature = AlarmManager.__db_file_signature()
+            AlarmManager.__alarms_version += 1
+            if reload_flag is True:
+                AlarmManager.__event_feed.publish(AlarmEventFeed.RELOAD)
+
+    @staticmethod
+    def __get_alarm_cache():
+        """
+        Gets the alarm cache, loading it first if it is not loaded yet, or if
+        reload_on_change is set and the database file has been modified since
+        it was last synchronised.
+        :return: Ordered dictionary of alarm ID -> cached AlarmItem.
+        """
+        with AlarmManager.__cache_lock:
+            if AlarmManager.__alarm_cache is None or \
+                    (AlarmManager.reload_on_change is True and
+                     AlarmManager.__cache_signature !=
+                     AlarmManager.__db_file_signature()):
+                AlarmManager.__load_alarm_cache()
+            return AlarmManager.__alarm_cache
+
+    @staticmethod
+    def __get_loaded_alarm_cache():
+        """
+        Gets the alarm cache, loading it first if it is not loaded yet. Used
+        to write into the cache the changes just saved into the database, so
+        the modified database file does not trigger a reload.
+        :return: Ordered dictionary of alarm ID -> cached AlarmItem.
+        """
+        with AlarmManager.__cache_lock:
+            if AlarmManager.__alarm_cache is None:
+                AlarmManager.__load_alarm_cache()
+            return AlarmManager.__alarm_cache
+
+    @staticmethod
+    def __cache_alarm(alarm):
+        """
+        Writes an alarm already saved in the database into the cache.
+        :param alarm: AlarmItem to add or replace in the cache.
+        """
+        with AlarmManager.__cache_lock:
+            cache = AlarmManager.__get_loaded_alarm_cache()
+            event_type = AlarmEventFeed.EDIT if alarm.id_ in cache else \
+                AlarmEventFeed.ADD
+            cache[alarm.id_] = AlarmManager.__copy_alarm(alarm)
+            AlarmManager.__unindex_alarm(alarm.id_)
+            AlarmManager.__index_alarm(alarm)
+            AlarmManager.__cache_signature = AlarmManager.__db_file_signature()
+            AlarmManager.__alarms_version += 1
+            AlarmManager.__event_feed.publish(event_type, alarm.id_)
+
+    @staticmethod
+    def __uncache_alarm(alarm_id):
+        """
+        Removes an alarm already deleted from the database from the cache.
+        :param alarm_id: ID of the AlarmItem to remove from the cache.
+        """
+        with AlarmManager.__cache_lock:
+            alarm = AlarmManager.__get_loaded_alarm_cache().pop(alarm_id, None)
+            AlarmManager.__unindex_alarm(alarm_id)
+            AlarmManager.__cache_signature = AlarmManager.__db_file_signature()
+            AlarmManager.__alarms_version += 1
+            if alarm is not None:
+                AlarmManager.__event_feed.publish(
+                    AlarmEventFeed.DELETE, alarm_id)
+
+    @staticmethod
+    def __index_alarm(alarm):
+        """
+        Adds the alert minutes of the week of an alarm into the alert index, if
+        the alarm is active. Must be called with the cache lock acquired.
+        :param alarm: AlarmItem to add to the alert index.
+        """
+        if alarm.is_active() is False:
+            return
+        minutes = alarm.week_minutes()
+        for week_minute in minutes:
+            bisect.insort(AlarmManager.__alert_index, (week_minute, alarm.id_))
+        AlarmManager.__alert_minutes[alarm.id_] = minutes
+
+    @staticmethod
+    def __unindex_alarm(alarm_id):
+        """
+        Removes the alert minutes of the week of an alarm from the alert index.
+        Must be called with the cache lock acquired.
+        :param alarm_id: ID of the AlarmItem to remove from the alert index.
+        """
+        index = AlarmManager.__alert_index
+        for week_minute in AlarmManager.__alert_minutes.pop(alarm_id, []):
+            del index[bisect.bisect_left(index, (week_minute, alarm_id))]
+
     #
     # member methods to add alarms
     #
@@ -218,10 +659,22 @@ class AlarmManager(object):
         if alarm is not None:
             alarm.id_ = AlarmDb().add_alarm(alarm)
             if alarm.id_ is not None:
+                AlarmManager.__cache_alarm(alarm)
                 self.__set_alarm_thread(alarm)
                 return alarm.id_
         return None
 
+    def add_alarms(self, alarms):
+        """
+        Adds a list of alarms to the database in a single transaction, and then
+        launches all the active ones.
+        :param alarms: List of dictionaries with the add_alarm arguments for
+                       each alarm to add.
+        :return: List with the newly created alarm ID of each alarm, in the
+                 same order as the input, or None for the ones that failed.
+        """
+        return self.apply_batch(add=alarms)[0]
+
     def load_dummy_alarms(self):
         """
         It loads 2 inactive dummy alarms into the database for demonstration
@@ -257,12 +710,26 @@ class AlarmManager(object):
             alarm_id,  hour=hour, minute=minute, days=days, enabled=enabled,
             label=label)
 
-        # If a successful edit was carried, then make sure the alarm is launched
-        if success is True:
-            self.__set_alarm_thread(AlarmManager.get_alarm(alarm_id))
+        # The valid values are saved even if the edit fails, so make sure the
+        # alarm is launched with its current data
+        alarm = db.get_alarm(alarm_id)
+        if alarm is not None:
+            AlarmManager.__cache_alarm(alarm)
+            self.__set_alarm_thread(alarm)
 
         return success
 
+    def edit_alarms(self, edits):
+        """
+        Edits a list of alarms from the database in a single transaction, and
+        then relaunches all the edited alarms.
+        :param edits: List of dictionaries with the edit_alarm arguments for
+                      each alarm to edit, 'alarm_id' being required.
+        :return: List of booleans indicating the success of the 'edit'
+                 operation for each alarm, in the same order as the input.
+        """
+        return self.apply_batch(edit=edits)[1]
+
     @staticmethod
     def update_alarm(alarm):
         """
@@ -274,6 +741,8 @@ class AlarmManager(object):
         """
         if isinstance(alarm, AlarmItem):
             success = AlarmDb().update_alarm(alarm)
+            if success is True:
+                AlarmManager.__cache_alarm(alarm)
         else:
             success = False
         return success
@@ -289,7 +758,82 @@ class AlarmManager(object):
         # First we need to ensure it there is no alarm thread running for it
         self.__stop_alarm_thread(alarm_id)
         # Remove it from the database
-        return AlarmDb().delete_alarm(alarm_id)
+        success = AlarmDb().delete_alarm(alarm_id)
+        if success is True:
+            AlarmManager.__uncache_alarm(alarm_id)
+        return success
+
+    def delete_alarms(self, alarm_ids):
+        """
+        Removes a list of alarms from the database in a single transaction, and
+        then removes their alarm threads.
+        :param alarm_ids: List of integers to indicate the primary key of the
+                          Alarms to be removed.
+        :return: List of booleans indicating the success of the 'delete alarm'
+                 operation for each alarm, in the same order as the input.
+        """
+        return self.apply_batch(delete=alarm_ids)[2]
+
+    #
+    # member methods to change several alarms at once
+    #
+    def apply_batch(self, add=None, edit=None, delete=None):
+        """
+        Adds, edits and deletes alarms from the database in a single
+        transaction, and once it has been committed it launches, relaunches
+        and stops all the changed alarms in a single reschedule.
+        An invalid edit argument discards the whole transaction, so all the
+        operations fail, as it happens to the edit_alarm method.
+        :param add: List of dictionaries with the add_alarm arguments for each
+                    alarm to add.
+        :param edit: List of dictionaries with the edit_alarm arguments for
+                     each alarm to edit, 'alarm_id' being required.
+        :param delete: List of integers to indicate the primary key of the
+                       Alarms to be removed.
+        :return: Tuple with the list of the newly created alarm IDs, or None
+                 for the ones that failed, the list of booleans indicating the
+                 success of each 'edit' operation, and the list of booleans
+                 indicating the success of each 'delete alarm' operation, all
+                 in the same order as the inputs.
+        """
+        add = add or []
+        edit = edit or []
+        delete = delete or []
+        alarm_items = []
+        for alarm in add:
+            try:
+                alarm_items.append(AlarmItem(**alarm))
+            except TypeError:
+                alarm_items.append(None)
+        valid_items = [alarm for alarm in alarm_items if alarm is not None]
+
+        db = AlarmDb()
+        try:
+            ids, edit_results, delete_results = db.apply_batch(
+                add=valid_items, edit=edit, delete=delete)
+        except TypeError:
+            return [None] * len(alarm_items), [False] * len(edit), \
+                [False] * len(delete)
+
+        changed_alarms = []
+        for alarm, alarm_id in zip(valid_items, ids):
+            alarm.id_ = alarm_id
+            if alarm_id is not None:
+                AlarmManager.__cache_alarm(alarm)
+                changed_alarms.append(alarm)
+        # The valid values of a failed edit are saved as well
+        for edit_args in edit:
+            alarm = db.get_alarm(edit_args['alarm_id'])
+            if alarm is not None:
+                AlarmManager.__cache_alarm(alarm)
+                changed_alarms.append(alarm)
+        for alarm_id, success in zip(delete, delete_results):
+            if success is True:
+                AlarmManager.__uncache_alarm(alarm_id)
+        self.__set_alarm_threads(changed_alarms, removed_ids=delete)
+
+        return [alarm.id_ if alarm is not None else None
+                for alarm in alarm_items], edit_results, delete_results
 
     def delete_all_alarms(self):
         """
@@ -300,6 +844,7 @@ class AlarmManager(object):
         thread_success = self.__stop_all_alarm_threads()
         # Remove from database
         db_success = AlarmDb().delete_all_alarms()
+        AlarmManager.__load_alarm_cache()
 
         if thread_success is True and db_success is True:
             return True
@@ -309,15 +854,23 @@ class AlarmManager(object):
     #
     # member methods to launch, edit and stop alarm events
     #
-    def __set_alarm_thread(self, alarm):
+    def __set_alarm_thread(self, alarm, offset_alarm_time=None):
         """
         Takes an input alarm and determines if is active, in order to be
         launched as an alarm thread, or if a thread should be changed due to
         the new alarm data.
         Maintains the thread list updated with the running alarms.
         :param alarm: AlarmItem to launch, edited, or stop thread.
+        :param offset_alarm_time: Optional offset alert time, to avoid reading
+                                  it from the database for every alarm.
         :return: Boolean indicating if Alarm Thread is running.
         """
+        if offset_alarm_time is None:
+            offset_alarm_time = self.get_offset_alert_time()
+        if self.__scheduler is not None:
+            return self.__scheduler.set_alarm(
+                alarm, offset_alarm_time=offset_alarm_time)
+
         thread_up = False
         # First check if the alarm to be register is already in the list
         for i, alarm_thread in enumerate(self.__alarm_threads):
@@ -332,8 +885,9 @@ class AlarmManager(object):
                         self.__alarm_threads[i] = AlarmThread(
                             alarm,
                             alarm_callback=self.__alert_callback,
-                            offset_alarm_time=self.get_offset_alert_time(),
-                            offset_callback=self.__offset_alert_callback)
+                            offset_alarm_time=offset_alarm_time,
+                            offset_callback=self.__offset_alert_callback,
+                            dispatcher=self.__dispatcher, clock=self.__clock)
                         self.__alarm_threads[i].start()
                     thread_up = alarm_thread.isAlive()
                 break
@@ -344,14 +898,38 @@ class AlarmManager(object):
                 alarm_thread = AlarmThread(
                     alarm,
                     alarm_callback=self.__alert_callback,
-                    offset_alarm_time=self.get_offset_alert_time(),
-                    offset_callback=self.__offset_alert_callback)
+                    offset_alarm_time=offset_alarm_time,
+                    offset_callback=self.__offset_alert_callback,
+                    dispatcher=self.__dispatcher, clock=self.__clock)
                 self.__alarm_threads.append(alarm_thread)
                 alarm_thread.start()
                 thread_up = alarm_thread.isAlive()
 
         return thread_up
 
+    def __set_alarm_threads(self, alarms, removed_ids=None):
+        """
+        Launches, edits or stops the alarm threads for a list of alarms, in the
+        same way as the __set_alarm_thread method, reading the offset alert
+        time only once and rescheduling the AlarmScheduler only once.
+        :param alarms: List of AlarmItems to launch, edited, or stop thread.
+        :param removed_ids: Optional list of IDs of the AlarmItems for the
+                            alarm threads to stop.
+        """
+        if not alarms and not removed_ids:
+            return
+        offset_alarm_time = self.get_offset_alert_time()
+        if self.__scheduler is not None:
+            self.__scheduler.set_alarms(
+                alarms, offset_alarm_time=offset_alarm_time,
+                removed_ids=removed_ids)
+        else:
+            if removed_ids:
+                self.__stop_alarm_threads(removed_ids)
+            for alarm in alarms:
+                self.__set_alarm_thread(
+                    alarm, offset_alarm_time=offset_alarm_time)
+
     def __stop_alarm_thread(self, alarm_id):
         """
         Stops an AlarmThread and removes item from the threads list.
@@ -359,6 +937,9 @@ class AlarmManager(object):
         :param alarm_id: ID of the AlarmItem for the alarm thread to stop.
         :return: Boolean indicating if the operation was successful.
         """
+        if self.__scheduler is not None:
+            return self.__scheduler.remove_alarm(alarm_id)
+
         success = False
         for alarm_thread in self.__alarm_threads:
             if alarm_id == alarm_thread.get_id():
@@ -374,12 +955,41 @@ class AlarmManager(object):
                     self.__alarm_threads.remove(alarm_thread)
         return success
 
+    def __stop_alarm_threads(self, alarm_ids):
+        """
+        Stops the AlarmThreads for a list of alarms, and removes them from the
+        threads list. All threads are stopped first and then waited for
+        together, so this method can also take up to 3 seconds to run.
+        :param alarm_ids: List of IDs of the AlarmItems for the threads to stop.
+        """
+        if self.__scheduler is not None:
+            self.__scheduler.remove_alarms(alarm_ids)
+            return
+
+        stopping_threads = [alarm_thread for alarm_thread
+                            in self.__alarm_threads
+                            if alarm_thread.get_id() in alarm_ids]
+        for alarm_thread in stopping_threads:
+            alarm_thread.stop()
+        milliseconds_passed = 0
+        while any(alarm_thread.isAlive() for alarm_thread in stopping_threads) \
+                and (milliseconds_passed < 3000):
+            time.sleep(0.01)
+            milliseconds_passed += 10
+        for alarm_thread in stopping_threads:
+            if alarm_thread.isAlive() is False:
+                self.__alarm_threads.remove(alarm_thread)
+
     def __stop_all_alarm_threads(self):
         """
         Stops all AlarmThreads and removes items from the threads list.
         This method can take up to 15 seconds to run.
         :return: Boolean indicating if the operation was successful.
         """
+        if self.__scheduler is not None:
+            self.__scheduler.remove_all_alarms()
+            return True
+
         for alarm_thread in self.__alarm_threads:
             alarm_thread.stop()
 
@@ -406,8 +1016,12 @@ class AlarmManager(object):
         """
         Checks if the given alarm ID is running as a thread.
         :param alarm_id: ID of the AlarmItem for the alarm thread to check.
-        :return:
+        :return: Boolean indicating if the alarm is running.
         """
+        if self.__scheduler is not None:
+            return (self.__simulated or self.__scheduler.isAlive()) and \
+                self.__scheduler.is_scheduled(alarm_id)
+
         for alarm_thread in self.__alarm_threads:
             if alarm_thread.get_id() == alarm_id:
                 return alarm_thread.isAlive()
@@ -422,10 +1036,84 @@ class AlarmManager(object):
         # self test and self recovery
         self.check_threads_state()
         alarm_list = []
-        for alarm_thread in self.__alarm_threads:
-            alarm_list.append(AlarmManager.get_alarm(alarm_thread.get_id()))
+        for alarm_id in self.__running_alarm_ids():
+            alarm_list.append(AlarmManager.get_alarm(alarm_id))
         return alarm_list
 
+    def __running_alarm_ids(self):
+        """
+        :return: List of the IDs of the alarms with a thread, or scheduled in
+                 the AlarmScheduler.
+        """
+        if self.__scheduler is not None:
+            return self.__scheduler.get_alarm_ids()
+        return [alarm_thread.get_id() for alarm_thread in self.__alarm_threads]
+
+    def __start_scheduler(self):
+        """
+        Creates and starts a new AlarmScheduler thread, replacing the previous
+        one if there was any. Any previously scheduled alarms are not carried
+        over, so they have to be set again.
+        With a VirtualClock the thread is not started, see simulate.
+        """
+        if self.__scheduler is not None:
+            self.__scheduler.stop()
+        self.__scheduler = AlarmScheduler(
+            alarm_callback=self.__alert_callback,
+            offset_callback=self.__offset_alert_callback,
+            dispatcher=self.__dispatcher, clock=self.__clock)
+        if self.__simulated is False:
+            self.__scheduler.start()
+
+    def simulate(self, end_time):
+        """
+        Runs the scheduled alarms in the calling thread, with the VirtualClock
+        given to the initialiser, until its time reaches the end time. The
+        alerts are dispatched as usual, and recorded in the clock.
+        :param end_time: Virtual time, in seconds since 1970, to run until.
+        :return: Boolean indicating if the simulation has run.
+        """
+        if self.__simulated is False:
+            print('ERROR: The AlarmManager can only simulate the alarms with a '
+                  'VirtualClock !', file=sys.stderr)
+            return False
+        self.__scheduler.simulate(end_time)
+        return True
+
+    def __start_dispatcher(self):
+        """
+        Gets the AlertDispatcher thread shared by all the instances with the
+        same clock, creating and starting a new one if there is none or if its
+        thread has died. The alarm threads and the scheduler keep a reference
+        to the dispatcher, so they have to be set again if it changes.
+        Each VirtualClock has its own dispatcher, as it holds the clock while
+        the alerts are queued.
+        """
+        clock_key = self.__clock if self.__simulated is True else None
+        with AlarmManager.__dispatchers_lock:
+            dispatcher, options = AlarmManager.__dispatchers.get(
+                clock_key, (None, None))
+            if dispatcher is None or dispatcher.isAlive() is False:
+                options = self.__dispatcher_options
+                dispatcher = AlertDispatcher(
+                    event_feed=AlarmManager.__event_feed, clock=self.__clock,
+                    **options)
+                dispatcher.start()
+                AlarmManager.__dispatchers[clock_key] = (dispatcher, options)
+            elif options != self.__dispatcher_options:
+                print('ERROR: The alert dispatcher is shared with another '
+                      'AlarmManager, its alert queue options are used instead '
+                      'of %s !' % self.__dispatcher_options, file=sys.stderr)
+        self.__dispatcher = dispatcher
+
+    def get_alert_stats(self):
+        """
+        Gets the statistics of the alert dispatcher, shared by all the
+        instances, as described in the AlertDispatcher.get_stats method.
+        :return: Dictionary with the alert queue statistics.
+        """
+        return self.__dispatcher.get_stats()
+
     def check_threads_state(self):
         """
         Retrieves all the alarms and checks if the are running or not as they
@@ -437,6 +1125,23 @@ class AlarmManager(object):
         previously_correct = True
         running_counter = 0
         all_alarms = AlarmManager.get_all_alarms()
+
+        # If the dispatcher thread has died all alarms need to be set again
+        # with the new dispatcher, which might have been already started by
+        # another instance
+        if self.__dispatcher.isAlive() is False:
+            self.__start_dispatcher()
+            if self.__scheduler is not None:
+                self.__start_scheduler()
+            else:
+                self.__stop_all_alarm_threads()
+            previously_correct = False
+
+        # If the scheduler thread has died all alarms need to be set again
+        if self.__scheduler is not None and self.__simulated is False and \
+                self.__scheduler.isAlive() is False:
+            self.__start_scheduler()
+            previously_correct = False
         for alarm in all_alarms:
             if alarm.is_active() is True:
                 # This alarm should be running
@@ -451,18 +1156,18 @@ class AlarmManager(object):
                     previously_correct = False
 
         # Check we have as many threads as expected
-        if len(self.__alarm_threads) != running_counter:
+        if len(self.__running_alarm_ids()) != running_counter:
             previously_correct = False
             # We can only attempt to recover if there are extra threads not
             # meant to be running
-            for alarm_thread in self.__alarm_threads:
+            for running_id in self.__running_alarm_ids():
                 for alarm in all_alarms:
-                    if alarm.id_ == alarm_thread.get_id():
+                    if alarm.id_ == running_id:
                         break
                 else:
-                    self.__stop_alarm_thread(alarm_thread.get_id())
+                    self.__stop_alarm_thread(running_id)
 
-            if len(self.__alarm_threads) != running_counter:
+            if len(self.__running_alarm_ids()) != running_counter:
                 print('ERROR: Could not correct the alarm threads in' +
                       'AlarmManager().check_threads_state !',
                       file=sys.stderr)
@@ -0,0 +1,341 @@
+# -*- coding: utf-8 -*-
+#
+# Single thread scheduler for all the alarms.
+#
+# Copyright (c) 2015 carlosperate http://carlosperate.github.io
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# This file only contains a class definition, which description can be found in
+# its docstring.
+#
+from __future__ import (unicode_literals, absolute_import, print_function,
+    division)
+import sys
+import heapq
+import threading
+try:
+    from LightUpAlarm.AlarmClock import SystemClock
+    from LightUpAlarm.AlarmThread import AlarmThread
+except ImportError:
+    from AlarmClock import SystemClock
+    from AlarmThread import AlarmThread
+
+
+class AlarmScheduler(threading.Thread):
+    """
+    This thread class is an alternative to running an AlarmThread per alarm.
+    It keeps all the active alarms (and their offset alerts) in a min-heap
+    keyed on their next alert time, and sleeps until the earliest one is due.
+    Any change to the scheduled alarms wakes up the thread early so that it can
+    recalculate its sleep time.
+
+    Heap entries are never removed or edited in place. Instead, each alarm has
+    a version number that is increased every time the alarm is set or removed,
+    and any popped heap entry with an old version is simply discarded.
+
+    The alert callbacks are executed with the same AlarmThread.alarm_alert()
+    method used by the AlarmThread class, so the alert behaviour is the same
+    for both. Like the AlarmThread class, the alerts can be queued into an
+    AlertDispatcher instead.
+
+    All the member variables are protected by the same condition variable, so
+    the public methods can be safely called from any thread.
+
+    The time is read from, and waited on, the given clock. With a VirtualClock
+    the thread is not started, and the simulate method runs the scheduled
+    alarms in the calling thread instead.
+    """
+
+    #
+    # metaclass methods
+    #
+    def __init__(self, alarm_callback=None, offset_callback=None,
+                 dispatcher=None, clock=None):
+        """
+        AlarmScheduler initialiser.
+        :param alarm_callback: Callback function to execute when an alarm
+                               triggers.
+        :param offset_callback: Callback function to execute when the offset
+                                alert of an alarm triggers.
+        :param dispatcher: Optional AlertDispatcher instance to queue the alerts
+                           into, instead of executing them in this thread.
+        :param clock: Optional clock instance, from the AlarmClock module, to
+                      read the time from. Defaults to the system clock.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.__alarm_callback = alarm_callback
+        self.__offset_callback = offset_callback
+        self.__dispatcher = dispatcher
+        self.__clock = clock if clock is not None else SystemClock()
+
+        # Heap with tuples of (alert time, entry counter, alarm ID, version,
+        # offset flag). The counter ensures tuples are never compared further.
+        self.__heap = []
+        self.__counter = 0
+        # Dictionary of alarm ID -> (AlarmItem, offset AlarmItem or None)
+        self.__alarms = {}
+        # Dictionary of alarm ID -> latest version
+        self.__versions = {}
+        self.__condition = threading.Condition()
+        self.__run = True
+
+    #
+    # control thread methods
+    #
+    def run(self):
+        """
+        Loop function to run until it is stopped by calling the stop() method.
+        It sleeps until the earliest scheduled alert is due, or until it is
+        notified of a change. Due alerts are executed and rescheduled to their
+        next alert time.
+        """
+        self.__condition.acquire()
+        try:
+            while self.__run:
+                if not self.__heap:
+                    self.__clock.wait(self.__condition)
+                    continue
+
+                wait_time = self.__heap[0][0] - self.__clock.time()
+                if wait_time > 0:
+                    self.__clock.wait(self.__condition, wait_time)
+                    continue
+
+                alert_time, _, alarm_id, version, offset_flag = \
+                    heapq.heappop(self.__heap)
+                if self.__versions.get(alarm_id) != version:
+                    # Old entry from an edited or removed alarm
+                    continue
+                alarm_item, offset_alarm = self.__alarms[alarm_id]
+                alert_alarm = offset_alarm if offset_flag else alarm_item
+
+                # Like the AlarmThread, only alert within the alarm minute
+                if self.__clock.time() < (alert_time + 60):
+                    self.__clock.record(
+                        'alert', id=alarm_id, offset=offset_flag)
+                    callback = self.__offset_callback if offset_flag else \
+                        self.__alarm_callback
+                    if self.__dispatcher is not None:
+                        self.__dispatcher.dispatch(
+                            alert_alarm, callback, priority=int(offset_flag),
+                            alarm_id=alarm_id, offset_flag=offset_flag)
+                    else:
+                        self.__condition.release()
+                        try:
+                            self.__alert(alert_alarm, callback)
+                        finally:
+                            self.__condition.acquire()
+
+                # The alarm could have been edited while the alert was running
+                if self.__versions.get(alarm_id) == version:
+                    self.__push(alarm_id, alert_alarm, alert_time + 60,
+                                version, offset_flag)
+        finally:
+            self.__condition.release()
+
+    def simulate(self, end_time):
+        """
+        Runs the loop of the run method in the calling thread, instead of
+        starting the thread, until the time of the clock, which has to be a
+        VirtualClock, reaches the end time. It can be called any number of
+        times, and the alarms stay scheduled in between.
+        :param end_time: Virtual time, in seconds since 1970, to run until.
+        """
+        self.__condition.acquire()
+        try:
+            self.__run = True
+        finally:
+            self.__condition.release()
+        self.__clock.run_until(end_time, self.stop)
+        self.run()
+
+    def stop(self):
+        """
+        Stops the loop in the run method and causes the thread to exit once the
+        current operation finishes.
+        """
+        self.__condition.acquire()
+        try:
+            self.__run = False
+            self.__condition.notify()
+        finally:
+            self.__condition.release()
+
+    #
+    # member methods
+    #
+    def set_alarm(self, alarm_item, offset_alarm_time=None):
+        """
+        Schedules an alarm, or reschedules it if it was already scheduled. If
+        the alarm is not active it is removed from the scheduler instead.
+        :param alarm_item: AlarmItem instance to schedule.
+        :param offset_alarm_time: Indicates if a pre or post alarm alert shall
+                                  be triggered. Input sanitation done at
+                                  AlarmItem.diff_alarm()
+        :return: Boolean indicating if the alarm is now scheduled.
+        """
+        return self.set_alarms([alarm_item], offset_alarm_time)[0]
+
+    def set_alarms(self, alarm_items, offset_alarm_time=None,
+                   removed_ids=None):
+        """
+        Schedules a list of alarms in the same way as the set_alarm method, but
+        waking up the scheduler thread only once.
+        :param alarm_items: List of AlarmItem instances to schedule.
+        :param offset_alarm_time: Indicates if a pre or post alarm alert shall
+                                  be triggered. Input sanitation done at
+                                  AlarmItem.diff_alarm()
+        :param removed_ids: Optional list of IDs of the AlarmItems to remove
+                            from the scheduler in the same wake up.
+        :return: List of booleans indicating if each alarm is now scheduled.
+        """
+        now = self.__clock.time()
+        results = []
+        self.__condition.acquire()
+        try:
+            for alarm_id in removed_ids or []:
+                if self.__alarms.pop(alarm_id, None) is not None:
+                    self.__versions[alarm_id] += 1
+            for alarm_item in alarm_items:
+                version = self.__versions.get(alarm_item.id_, 0) + 1
+                self.__versions[alarm_item.id_] = version
+                if alarm_item.is_active() is False:
+                    self.__alarms.pop(alarm_item.id_, None)
+                    results.append(False)
+                    continue
+
+                offset_alarm = None
+                if offset_alarm_time is not None:
+                    offset_alarm = alarm_item.diff_alarm(offset_alarm_time)
+                self.__alarms[alarm_item.id_] = (alarm_item, offset_alarm)
+                self.__push(alarm_item.id_, alarm_item, now, version, False)
+                if offset_alarm is not None:
+                    self.__push(
+                        alarm_item.id_, offset_alarm, now, version, True)
+                results.append(True)
+            self.__condition.notify()
+        finally:
+            self.__condition.release()
+        return results
+
+    def remove_alarm(self, alarm_id):
+        """
+        Removes an alarm from the scheduler.
+        :param alarm_id: ID of the AlarmItem to remove.
+        :return: Boolean indicating if the alarm was scheduled and it has been
+                 removed.
+        """
+        return self.remove_alarms([alarm_id])[0]
+
+    def remove_alarms(self, alarm_ids):
+        """
+        Removes a list of alarms from the scheduler, waking up the scheduler
+        thread only once.
+        :param alarm_ids: List of IDs of the AlarmItems to remove.
+        :return: List of booleans indicating if each alarm was scheduled and it
+                 has been removed.
+        """
+        results = []
+        self.__condition.acquire()
+        try:
+            for alarm_id in alarm_ids:
+                if alarm_id not in self.__alarms:
+                    results.append(False)
+                    continue
+                del self.__alarms[alarm_id]
+                self.__versions[alarm_id] += 1
+                results.append(True)
+            self.__condition.notify()
+        finally:
+            self.__condition.release()
+        return results
+
+    def remove_all_alarms(self):
+        """ Removes all the alarms from the scheduler. """
+        self.__condition.acquire()
+        try:
+            for alarm_id in self.__alarms:
+                self.__versions[alarm_id] += 1
+            self.__alarms = {}
+            self.__heap = []
+            self.__condition.notify()
+        finally:
+            self.__condition.release()
+
+    def is_scheduled(self, alarm_id):
+        """
+        Checks if the given alarm ID is scheduled.
+        :param alarm_id: ID of the AlarmItem to check.
+        :return: Boolean indicating if the alarm is scheduled.
+        """
+        self.__condition.acquire()
+        try:
+            return alarm_id in self.__alarms
+        finally:
+            self.__condition.release()
+
+    def get_alarm_ids(self):
+        """
+        :return: List of the scheduled alarm IDs, in ascending order.
+        """
+        self.__condition.acquire()
+        try:
+            return sorted(self.__alarms.keys())
+        finally:
+            self.__condition.release()
+
+    def get_next_alert_time(self):
+        """
+        :return: Time, in seconds since 1970, of the next scheduled alert, or
+                 None if there are no alarms scheduled.
+        """
+        self.__condition.acquire()
+        try:
+            while self.__heap and \
+                    self.__versions.get(self.__heap[0][2]) != self.__heap[0][3]:
+                heapq.heappop(self.__heap)
+            return self.__heap[0][0] if self.__heap else None
+        finally:
+            self.__condition.release()
+
+    @staticmethod
+    def next_alert_time(alarm_item, from_time):
+        """
+        Calculates the time of the next alert for an alarm, in the same way as
+        the AlarmThread class.
+        :param alarm_item: AlarmItem instance to calculate the alert time.
+        :param from_time: Time, in seconds since 1970, to start searching from.
+                          The minute containing this time is included.
+        :return: Time, in seconds since 1970, of the start of the alert minute,
+                 or None if the alarm has no repeat days.
+        """
+        return AlarmThread.next_alert_time(alarm_item, from_time)
+
+    def __push(self, alarm_id, alarm_item, from_time, version, offset_flag):
+        """
+        Adds the next alert of an alarm into the heap. Must be called with the
+        condition variable acquired.
+        The alarm ID is an argument because the offset alert AlarmItem does not
+        contain the ID of the alarm it belongs to.
+        """
+        alert_time = AlarmScheduler.next_alert_time(alarm_item, from_time)
+        if alert_time is not None:
+            self.__counter += 1
+            heapq.heappush(
+                self.__heap,
+                (alert_time, self.__counter, alarm_id, version, offset_flag))
+
+    @staticmethod
+    def __alert(alarm_item, callback):
+        """
+        Executes the alert. Exceptions are reported and not propagated, as a
+        failing callback should not stop the rest of the scheduled alarms.
+        """
+        try:
+            AlarmThread.alarm_alert(alarm_item, callback)
+        except Exception as e:
+            print('ERROR: Alert callback for the Alarm %s failed: %s' %
+                  (alarm_item.id_, e), file=sys.stderr)
@@ -12,16 +12,39 @@
 from __future__ import (unicode_literals, absolute_import, print_function,
     division)
 import sys
-import time
-import random
 import threading
+import collections
+try:
+    from LightUpAlarm.AlarmClock import SystemClock
+    from LightUpAlarm.AlarmCalendar import AlarmCalendar
+    from LightUpAlarm.Py23Compatibility import *
+except ImportError:
+    from AlarmClock import SystemClock
+    from AlarmCalendar import AlarmCalendar
+    from Py23Compatibility import *
 
 
 class AlarmThread(threading.Thread):
     """
     This thread class contains an instance to an AlarmItem and when it is
-    running checks the time every 5 seconds to determine if the Alarm (or any
-    pre or post alert) should be triggered.
+    running it calculates the time of the next Alarm alert (and of any pre or
+    post alert) and sleeps until then. It wakes up at least every
+    max_sleep_time seconds to re-read the alarm data.
+
+    An alert is expected to trigger within its alarm minute. If the thread is
+    delayed past that minute (for example due to a long callback, or a forward
+    jump of the system clock) the alert is considered missed, and depending on
+    the missed_alert_policy it is either triggered late (CATCH_UP, only once
+    for all the missed alerts) or not triggered (SKIP).
+    System clock jumps are detected by comparing the elapsed wall clock time
+    against a monotonic clock. On a backwards jump the alerts are calculated
+    again from the new current time.
+    The alert times are absolute times resolved by the AlarmCalendar class, so
+    daylight saving time changes do not skip or repeat alerts.
+    The thread keeps track of how late each alert was triggered, from the
+    start of its alarm minute, which can be retrieved with get_alert_stats().
+    The alerts are executed in this thread, or queued into an AlertDispatcher
+    if one is provided.
 
     This class does NOT edit the variables from the AlarmItem instance reference
     that it takes as constructor parameter. It does attach a callback function
@@ -37,16 +60,29 @@ class AlarmThread(threading.Thread):
     method).
     """
 
-    # This class variable blocks any alarm thread to execute the callback while
-    # it is already running. This is because the callback is most likely to be
+    # This class lock blocks any alarm thread to execute the callback while it
+    # is already running. This is because the callback is most likely to be
     # controlling hardware
-    __alert_running = False
+    __alert_lock = threading.Lock()
+
+    # Policies for the alerts missed past their alarm minute
+    CATCH_UP = 'catch_up'
+    SKIP = 'skip'
+
+    # Maximum time, in seconds, to sleep before re-reading the alarm data
+    max_sleep_time = 10.0
+    # Wall clock deviation, in seconds, from the monotonic clock to consider
+    # the system clock has been changed
+    clock_jump_threshold = 2.0
+    # Number of alert lateness values to keep
+    lateness_history = 100
 
     #
     # metaclass methods
     #
     def __init__(self, alarm_item, alarm_callback=None, offset_alarm_time=None,
-                 offset_callback=None):
+                 offset_callback=None, missed_alert_policy=SKIP,
+                 dispatcher=None, clock=None):
         """
         AlarmThread initialiser. Takes an AlarmItem instance, a callback
         function and a pre or post alert time and callback to initialise the
@@ -58,9 +94,18 @@ class AlarmThread(threading.Thread):
                                  Alar.diff_alarm()
         :param offset_callback: If the offset_alarm_time is set, it will
                                 execute this callback on the pre or post alert.
+        :param missed_alert_policy: AlarmThread.SKIP (default) to not trigger
+                                    the alerts missed past their alarm minute,
+                                    or AlarmThread.CATCH_UP to trigger them
+                                    late.
+        :param dispatcher: Optional AlertDispatcher instance to queue the alerts
+                           into, instead of executing them in this thread.
+        :param clock: Optional clock instance, from the AlarmClock module, to
+                      read the time from. Defaults to the system clock.
         """
         threading.Thread.__init__(self)
         self.daemon = True
+        self.__clock = clock if clock is not None else SystemClock()
 
         self.__alarm = alarm_item
         self.__id = self.__alarm.id_
@@ -74,10 +119,31 @@ class AlarmThread(threading.Thread):
         if offset_alarm_time is not None:
             self.__offset_time = offset_alarm_time
             self.__offset_callback = offset_callback
-            self.__offset_alarm = self.__alarm.diff_alarm(self.__offset_time)
+            self.__update_offset_alarm()
             if self.__offset_alarm is not None:
                 self.__offset_flag = True
 
+        if missed_alert_policy not in (AlarmThread.CATCH_UP, AlarmThread.SKIP):
+            print('ERROR: Invalid AlarmThread missed alert policy "%s", using '
+                  '"%s" instead !' % (missed_alert_policy, AlarmThread.SKIP),
+                  file=sys.stderr)
+            missed_alert_policy = AlarmThread.SKIP
+        self.__missed_alert_policy = missed_alert_policy
+        self.__dispatcher = dispatcher
+
+        # Dictionary of offset flag -> time, in seconds since 1970, from which
+        # to search for the next alert. Set when the thread starts running
+        self.__from_time = {}
+        # Wall and monotonic clock times of the last check, for jump detection
+        self.__last_wall_time = None
+        self.__last_monotonic_time = None
+        self.__stats = {'alerts': 0, 'caught_up': 0, 'skipped': 0,
+                        'clock_jumps': 0}
+        self.__lateness = collections.deque(
+            maxlen=AlarmThread.lateness_history)
+
+        # Event set to wake up the thread when stopped or edited
+        self.__wake_event = threading.Event()
         self.__run = True
 
     #
@@ -85,45 +151,77 @@ class AlarmThread(threading.Thread):
     #
     def run(self):
         """
-        Infinite loop function to run until it is stopped by calling the stop()
-        method. It sleeps for 1 second between iterations.
-        At each iteration it first determines if the alarm is enabled and set to
-        trigger any day, if so it then checks if this time is the alarm time.
+        Loop function to run until it is stopped by calling the stop() method.
+        At each iteration it checks for clock jumps, triggers any due alerts
+        (the alarm and its pre/post alert) and sleeps until the next one is
+        due, for a maximum of max_sleep_time seconds.
         """
+        now = self.__clock.time()
+        self.__from_time = {False: now, True: now}
         while self.__run:
-            # Only check for the time if the Alarm is active
-            if self.__alarm.is_active() is True:
-                time_now = time.localtime(time.time())
-                alert_triggered = False
-
-                # Check if it is the alarm time
-                if (self.__alarm.repeat[time_now.tm_wday] is True) and \
-                        (self.__alarm.hour == time_now.tm_hour) and \
-                        (self.__alarm.minute == time_now.tm_min):
-                    self.alarm_alert(self.__alarm, self.__alarm_callback)
+            now = self.__clock.time()
+            self.__check_clock_jump(now)
+            if self.__offset_flag is True:
+                self.sync_offset_alarm()
+
+            next_alert_time = None
+            alert_triggered = False
+            for offset_flag in (False, True):
+                if offset_flag is False:
+                    alarm, callback = self.__alarm, self.__alarm_callback
+                elif self.__offset_flag is True:
+                    alarm = self.__offset_alarm
+                    callback = self.__offset_callback
+                else:
+                    continue
+                # Only check for the time if the Alarm is active
+                if alarm.is_active() is False:
+                    continue
+                alert_time = AlarmThread.next_alert_time(
+                    alarm, self.__from_time[offset_flag])
+                if alert_time is None:
+                    continue
+
+                if now < alert_time:
+                    # Not due yet
+                    if next_alert_time is None or alert_time < next_alert_time:
+                        next_alert_time = alert_time
+                    continue
+
+                if now < (alert_time + 60):
+                    # Within the alarm minute, search again after this minute
+                    # in order to not execute the callback/s more than once
+                    self.__from_time[offset_flag] = alert_time + 60
+                    trigger = True
+                else:
+                    # Missed, skip any other missed alerts as well
+                    self.__from_time[offset_flag] = now
+                    trigger = \
+                        self.__missed_alert_policy == AlarmThread.CATCH_UP
+                    self.__stats['caught_up' if trigger else 'skipped'] += 1
+
+                if trigger is True:
+                    self.__clock.record('alert', id=self.__id,
+                                        offset=offset_flag)
+                    self.__stats['alerts'] += 1
+                    self.__lateness.append(now - alert_time)
                     alert_triggered = True
+                    if self.__dispatcher is not None:
+                        self.__dispatcher.dispatch(
+                            alarm, callback, priority=int(offset_flag),
+                            alarm_id=self.__id, offset_flag=offset_flag)
+                    else:
+                        self.alarm_alert(alarm, callback)
 
-                if self.__offset_flag is True:
-                    # Sync and check if it is the pre/post alert time
-                    self.sync_offset_alarm()
-                    if (self.__offset_alarm.repeat[time_now.tm_wday] is True) \
-                            and (self.__offset_alarm.hour == time_now.tm_hour) \
-                            and (self.__offset_alarm.minute == time_now.tm_min):
-                        self.alarm_alert(
-                            self.__offset_alarm, self.__offset_callback)
-                        alert_triggered = True
-
-                if alert_triggered:
-                    # Wait for the current minute to be over, in order to not
-                    # execute the callback/s more than once
-                    time_to_elapse = time_now
-                    while (time_to_elapse.tm_hour == time_now.tm_hour) and \
-                          (time_to_elapse.tm_min == time_now.tm_min):
-                        time.sleep(1)
-                        time_now = time.localtime(time.time())
-
-            # Now just sleep for 5 seconds before checking again
-            time.sleep(1)
+            # After an alert the time has moved on, so check again straight away
+            if alert_triggered is False and self.__run is True:
+                sleep_time = AlarmThread.max_sleep_time
+                if next_alert_time is not None:
+                    sleep_time = min(
+                        sleep_time, next_alert_time - self.__clock.time())
+                if sleep_time > 0:
+                    self.__clock.wait(self.__wake_event, sleep_time)
+                self.__wake_event.clear()
 
     def stop(self):
         """
@@ -131,6 +229,30 @@ class AlarmThread(threading.Thread):
         the current operation finishes.
         """
         self.__run = False
+        self.__wake_event.set()
+
+    def __check_clock_jump(self, now):
+        """
+        Compares the wall clock time elapsed since the last check against the
+        monotonic clock to detect changes to the system time. On a backwards
+        jump the alerts are searched again from the current time, as alerts
+        between the new time and the previous time would not trigger until
+        the following week. Forward jumps result in missed alerts, handled by
+        the missed alert policy.
+        :param now: Current wall clock time, in seconds since 1970.
+        """
+        monotonic_now = self.__clock.monotonic()
+        if self.__last_wall_time is not None:
+            jump = (now - self.__last_wall_time) - \
+                (monotonic_now - self.__last_monotonic_time)
+            if abs(jump) > AlarmThread.clock_jump_threshold:
+                self.__stats['clock_jumps'] += 1
+                if jump < 0:
+                    for offset_flag in self.__from_time:
+                        self.__from_time[offset_flag] = min(
+                            self.__from_time[offset_flag], now)
+        self.__last_wall_time = now
+        self.__last_monotonic_time = monotonic_now
 
     #
     # member methods
@@ -156,8 +278,9 @@ class AlarmThread(threading.Thread):
             self.__alarm = alarm_item
             # Edit the offset alert if enabled
             if self.__offset_flag is True:
-                self.__offset_alarm = \
-                    self.__alarm.diff_alarm(self.__offset_time)
+                self.__update_offset_alarm()
+            # Wake up the thread to recalculate the next alert time
+            self.__wake_event.set()
             success = True
         else:
             print('ERROR: Provided AlarmItem is not correct for this thread.\n'
@@ -166,39 +289,66 @@ class AlarmThread(threading.Thread):
             success = False
         return success
 
+    def get_alert_stats(self):
+        """
+        :return: Dictionary with the number of triggered 'alerts', how many of
+                 those were missed and 'caught_up', the number of missed alerts
+                 'skipped', the number of 'clock_jumps' detected, and the
+                 'lateness' list, with the time in seconds from the start of
+                 the alarm minute to the trigger of each of the last alerts.
+        """
+        stats = dict(self.__stats)
+        stats['lateness'] = list(self.__lateness)
+        return stats
+
+    @staticmethod
+    def next_alert_time(alarm_item, from_time):
+        """
+        Calculates the time of the next alert for an alarm, following the
+        daylight saving time changes as described in the AlarmCalendar class.
+        :param alarm_item: AlarmItem instance to calculate the alert time.
+        :param from_time: Time, in seconds since 1970, to start searching from.
+                          The minute containing this time is included.
+        :return: Time, in seconds since 1970, of the start of the alert minute,
+                 or None if the alarm has no repeat days.
+        """
+        return AlarmCalendar.next_alert_time(alarm_item, from_time)
+
     def sync_offset_alarm(self):
         """
         This method will check if the alarm and the offset_alarm data are still
         the same. Required because the alarm instance can be edited outside of
         this class and the alarm data has to stay synchronised.
         This method edits the class member variable __offset_alarm directly.
-        Doing these checks, instead of recreating the offset_alarm each time
-        is about an order of magnitude faster.
+        Comparing the alarm data the offset_alarm was created from, instead of
+        recreating the offset_alarm each time, is about an order of magnitude
+        faster.
         """
-        if (self.__offset_alarm.hour != self.__alarm.hour) or \
-                (self.__offset_alarm.minute != self.__alarm.minute) or \
-                (self.__offset_alarm.repeat != self.__alarm.repeat) or \
-                (self.__offset_alarm.enabled != self.__alarm.enabled):
-            self.__offset_alarm = self.__alarm.diff_alarm(self.__offset_time)
+        alarm = self.__alarm
+        if self.__offset_source != \
+                (alarm.hour, alarm.minute, alarm.days_mask, alarm.enabled):
+            self.__update_offset_alarm()
+
+    def __update_offset_alarm(self):
+        """
+        Recreates the offset_alarm from the alarm data, and keeps the data it
+        was created from to be checked by sync_offset_alarm.
+        """
+        alarm = self.__alarm
+        self.__offset_source = \
+            (alarm.hour, alarm.minute, alarm.days_mask, alarm.enabled)
+        self.__offset_alarm = alarm.diff_alarm(self.__offset_time)
 
     @classmethod
     def alarm_alert(cls, alarm_item, callback):
         """
         This method is executed when the alarm alert is raised.
         It executes the callback indicated on AlertThread constructor.
+        It blocks until any other alert callback has finished.
         """
-        # Try to block reentry
-        while cls.__alert_running is True:
-            time.sleep(float(random.randint(1, 100)) / 1000.0)
-        # Now should be safe to execute
-        cls.__alert_running = True
-
-        try:
+        with cls.__alert_lock:
             # run AlertManager callback event
             print('\nALERT for the Alarm %s, with label:"%s" !!!' %
                   (alarm_item.id_, alarm_item.label))
             if callback is not None:
                 callback()
-        finally:
-            # Unblock
-            cls.__alert_running = False
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+#
+# Single worker thread to execute the alarm alert callbacks.
+#
+# Copyright (c) 2015 carlosperate http://carlosperate.github.io
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# This file only contains a class definition, which description can be found in
+# its docstring.
+#
+from __future__ import (unicode_literals, absolute_import, print_function,
+    division)
+import sys
+import time
+import heapq
+import threading
+try:
+    from LightUpAlarm.AlarmClock import SystemClock
+    from LightUpAlarm.AlarmThread import AlarmThread
+    from LightUpAlarm.AlarmEventFeed import AlarmEventFeed
+except ImportError:
+    from AlarmClock import SystemClock
+    from AlarmThread import AlarmThread
+    from AlarmEventFeed import AlarmEventFeed
+
+
+class AlertDispatcher(threading.Thread):
+    """
+    This thread class executes the alarm alerts queued by the AlarmThread and
+    AlarmScheduler classes, one at a time, so the alert callbacks never run
+    concurrently and the alarm threads are not blocked while the callbacks
+    (most likely controlling hardware) are running.
+
+    The queue is bounded, any alert dispatched while it is full is dropped and
+    reported. The alerts are executed in the order they are dispatched (FIFO),
+    or in priority order (lowest value first, and FIFO for the same priority).
+    Alerts with the same callback dispatched within coalesce_time seconds of a
+    queued one are merged into it, so that alarms triggering together only
+    execute their callback once.
+    If an AlarmEventFeed is provided, an 'alert' event is published for every
+    alert executed.
+    The dispatch times are read from the given clock, which is held from an
+    alert being queued until it is executed, so that a VirtualClock does not
+    move forward while the alerts are waiting or running.
+
+    All the member variables are protected by the same condition variable, so
+    the public methods can be safely called from any thread.
+    """
+
+    # Alert ordering options
+    FIFO = 'fifo'
+    PRIORITY = 'priority'
+
+    #
+    # metaclass methods
+    #
+    def __init__(self, max_size=32, ordering=FIFO, coalesce_time=0,
+                 event_feed=None, clock=None):
+        """
+        AlertDispatcher initialiser.
+        :param max_size: Maximum number of alerts waiting to be executed.
+        :param ordering: AlertDispatcher.FIFO (default) or
+                         AlertDispatcher.PRIORITY.
+        :param coalesce_time: Time, in seconds, for an alert to be merged into
+                              a queued alert with the same callback. Set to 0
+                              (default) to never merge alerts.
+        :param event_feed: Optional AlarmEventFeed instance to publish the
+                           executed alerts.
+        :param clock: Optional clock instance, from the AlarmClock module, to
+                      read the time from. Defaults to the system clock.
+        """
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        if ordering not in (AlertDispatcher.FIFO, AlertDispatcher.PRIORITY):
+            print('ERROR: Invalid AlertDispatcher ordering "%s", using "%s" '
+                  'instead !' % (ordering, AlertDispatcher.FIFO),
+                  file=sys.stderr)
+            ordering = AlertDispatcher.FIFO
+        self.__ordering = ordering
+        self.__max_size = max_size
+        self.__coalesce_time = coalesce_time
+        self.__event_feed = event_feed
+        self.__clock = clock if clock is not None else SystemClock()
+
+        # Heap with lists of [priority, entry counter, dispatch time,
+        # AlarmItem, callback, alarm ID, offset flag]. The counter keeps the
+        # FIFO order and ensures the entries are never compared further.
+        self.__heap = []
+        self.__counter = 0
+        self.__stats = {'dispatched': 0, 'executed': 0, 'dropped': 0,
+                        'coalesced': 0, 'max_queue_depth': 0,
+                        'last_wait_time': None, 'max_wait_time': 0,
+                        'total_wait_time': 0}
+        self.__executing = False
+        self.__condition = threading.Condition()
+        self.__run = True
+
+    #
+    # control thread methods
+    #
+    def run(self):
+        """
+        Loop function to run until it is stopped by calling the stop() method.
+        It waits for alerts to be queued and executes them one by one.
+        """
+        self.__condition.acquire()
+        try:
+            while self.__run:
+                if not self.__heap:
+                    self.__condition.wait()
+                    continue
+
+                _, _, dispatch_time, alarm_item, callback, alarm_id, \
+                    offset_flag = heapq.heappop(self.__heap)
+                wait_time = self.__clock.time() - dispatch_time
+                self.__stats['last_wait_time'] = wait_time
+                self.__stats['total_wait_time'] += wait_time
+                self.__stats['max_wait_time'] = \
+                    max(self.__stats['max_wait_time'], wait_time)
+                self.__stats['executed'] += 1
+
+                self.__executing = True
+                self.__condition.release()
+                try:
+                    if self.__event_feed is not None:
+                        self.__event_feed.publish(
+                            AlarmEventFeed.ALERT, alarm_id,
+                            label=alarm_item.label, offset=offset_flag)
+                    AlertDispatcher.__alert(alarm_item, callback)
+                finally:
+                    self.__clock.release()
+                    self.__condition.acquire()
+                    self.__executing = False
+                self.__condition.notify_all()
+        finally:
+            self.__condition.release()
+
+    def stop(self):
+        """
+        Stops the loop in the run method and causes the thread to exit once the
+        current alert finishes. Any alerts still queued are not executed.
+        """
+        self.__condition.acquire()
+        try:
+            if self.__run is True:
+                # The queued alerts will not be executed to release the clock
+                for _ in self.__heap:
+                    self.__clock.release()
+            self.__run = False
+            self.__condition.notify_all()
+        finally:
+            self.__condition.release()
+
+    #
+    # member methods
+    #
+    def dispatch(self, alarm_item, callback, priority=0, alarm_id=None,
+                 offset_flag=False):
+        """
+        Queues an alert to be executed by the dispatcher thread.
+        :param alarm_item: AlarmItem instance of the alert.
+        :param callback: Callback function to execute for the alert.
+        :param priority: Integer to order the alerts when using the PRIORITY
+                         ordering, lowest value first.
+        :param alarm_id: ID of the alarm the alert belongs to, as the offset
+                         alert AlarmItem does not have one. Defaults to the
+                         alarm_item ID.
+        :param offset_flag: Boolean indicating if it is an offset alert.
+        :return: Boolean indicating if the alert has been queued or merged
+                 into a queued alert, False if it has been dropped.
+        """
+        if alarm_id is None:
+            alarm_id = alarm_item.id_
+        now = self.__clock.time()
+        self.__condition.acquire()
+        try:
+            self.__stats['dispatched'] += 1
+            if self.__coalesce_time > 0:
+                for entry in self.__heap:
+                    if entry[4] == callback and \
+                            (now - entry[2]) <= self.__coalesce_time:
+                        self.__stats['coalesced'] += 1
+                        return True
+
+            if len(self.__heap) >= self.__max_size:
+                self.__stats['dropped'] += 1
+                print('ERROR: Alert queue full, dropped alert for the Alarm '
+                      '%s !' % alarm_id, file=sys.stderr)
+                return False
+
+            if self.__ordering != AlertDispatcher.PRIORITY:
+                priority = 0
+            self.__counter += 1
+            heapq.heappush(
+                self.__heap,
+                [priority, self.__counter, now, alarm_item, callback,
+                 alarm_id, offset_flag])
+            self.__stats['max_queue_depth'] = \
+                max(self.__stats['max_queue_depth'], len(self.__heap))
+            if self.__run is True:
+                self.__clock.hold()
+            self.__condition.notify_all()
+            return True
+        finally:
+            self.__condition.release()
+
+    def get_queue_depth(self):
+        """
+        :return: Integer with the number of alerts waiting to be executed.
+        """
+        self.__condition.acquire()
+        try:
+            return len(self.__heap)
+        finally:
+            self.__condition.release()
+
+    def get_stats(self):
+        """
+        :return: Dictionary with the number of alerts 'dispatched', 'executed',
+                 'dropped' and 'coalesced', the current 'queue_depth' and the
+                 'max_queue_depth', and the 'last_wait_time', 'max_wait_time'
+                 and 'average_wait_time', in seconds, from the alerts being
+                 dispatched to being executed.
+        """
+        self.__condition.acquire()
+        try:
+            stats = dict(self.__stats)
+            stats['queue_depth'] = len(self.__heap)
+        finally:
+            self.__condition.release()
+        total_wait_time = stats.pop('total_wait_time')
+        if stats['executed'] > 0:
+            stats['average_wait_time'] = total_wait_time / stats['executed']
+        else:
+            stats['average_wait_time'] = None
+        return stats
+
+    def wait_until_idle(self, timeout=None):
+        """
+        Blocks until all the queued alerts have been executed.
+        :param timeout: Optional maximum time to wait, in seconds. It is always
+                        real time, as it waits for the dispatcher thread.
+        :return: Boolean indicating if there are no alerts queued or running.
+        """
+        end_time = None if timeout is None else time.time() + timeout
+        self.__condition.acquire()
+        try:
+            while (self.__heap or self.__executing) and self.__run:
+                if end_time is None:
+                    self.__condition.wait()
+                else:
+                    wait_time = end_time - time.time()
+                    if wait_time <= 0:
+                        break
+                    self.__condition.wait(wait_time)
+            return not (self.__heap or self.__executing)
+        finally:
+            self.__condition.release()
+
+    @staticmethod
+    def __alert(alarm_item, callback):
+        """
+        Executes the alert. Exceptions are reported and not propagated, as a
+        failing callback should not stop the rest of the queued alerts.
+        """
+        try:
+            AlarmThread.alarm_alert(alarm_item, callback)
+        except Exception as e:
+            print('ERROR: Alert callback for the Alarm %s failed: %s' %
+                  (alarm_item.id_, e), file=sys.stderr)
@@ -32,3 +32,31 @@ try:
     xrange
 except NameError:
     xrange = range
+
+# Monotonic clock only available in the time module from python 3.3, in python
+# 2 use the clock_gettime function from librt/libc if available (like on Linux)
+try:
+    from time import monotonic
+except ImportError:
+    try:
+        import ctypes
+        import ctypes.util
+
+        class _timespec(ctypes.Structure):
+            _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+        _clock_gettime = ctypes.CDLL(
+            ctypes.util.find_library('rt') or ctypes.util.find_library('c'),
+            use_errno=True).clock_gettime
+        _clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(_timespec)]
+
+        def monotonic():
+            timespec = _timespec()
+            if _clock_gettime(1, ctypes.byref(timespec)) != 0:  # MONOTONIC=1
+                raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+            return timespec.tv_sec + (timespec.tv_nsec * 1e-9)
+
+        monotonic()
+    except Exception:
+        # Not monotonic, so clock changes are not detected
+        from time import time as monotonic
@@ -0,0 +1,186 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Unit test for the AlarmCalendar class.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# The tests use a POSIX TZ rule for the US Eastern timezone, in 2016 the clocks
+# went forward from 02:00 to 03:00 on Sunday 13th of March, and back from 02:00
+# to 01:00 on Sunday 6th of November.
+#
+from __future__ import unicode_literals, absolute_import
+import os
+import time
+import mock
+import calendar
+import datetime
+import unittest
+try:
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmThread import AlarmThread
+    from LightUpAlarm.AlarmCalendar import AlarmCalendar
+    from LightUpAlarm.AlarmClock import VirtualClock
+except ImportError:
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmThread import AlarmThread
+    from LightUpAlarm.AlarmCalendar import AlarmCalendar
+    from LightUpAlarm.AlarmClock import VirtualClock
+
+
+def utc(*time_tuple):
+    """ :return: Seconds since 1970 of the UTC time (year, month, day...). """
+    return calendar.timegm(time_tuple + (0,) * (6 - len(time_tuple)))
+
+
+class AlarmCalendarTestCase(unittest.TestCase):
+    """ Tests for AlarmCalendar class. """
+
+    def setUp(self):
+        self.original_tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'EST+05EDT,M3.2.0,M11.1.0'
+        time.tzset()
+
+    def tearDown(self):
+        if self.original_tz is None:
+            del os.environ['TZ']
+        else:
+            os.environ['TZ'] = self.original_tz
+        time.tzset()
+        AlarmCalendar.nonexistent_policy = AlarmCalendar.SHIFT
+        AlarmCalendar.repeated_policy = AlarmCalendar.FIRST
+
+    def run_with_clock(self, alarm_item, start_time, end_time):
+        """
+        Runs an AlarmThread run method in the current thread, with a virtual
+        clock from the start to the end time.
+        :return: List of the virtual times at which the alarm alerted.
+        """
+        clock = VirtualClock(start_time)
+        alarm_thread = AlarmThread(alarm_item, clock=clock)
+        clock.run_until(end_time, alarm_thread.stop)
+        with mock.patch.object(AlarmThread, 'alarm_alert'):
+            alarm_thread.run()
+        return [alert['time'] for alert in clock.get_records('alert')]
+
+    def test_resolve(self):
+        """ Checks the local times are converted with the DST offsets. """
+        self.assertEqual(AlarmCalendar.resolve(2016, 1, 4, 7, 0),
+                         utc(2016, 1, 4, 12, 0))
+        self.assertEqual(AlarmCalendar.resolve(2016, 7, 4, 7, 0),
+                         utc(2016, 7, 4, 11, 0))
+
+        # Nonexistent time
+        self.assertEqual(AlarmCalendar.resolve(2016, 3, 13, 2, 30),
+                         utc(2016, 3, 13, 7, 30))
+        AlarmCalendar.nonexistent_policy = AlarmCalendar.SKIP
+        self.assertIsNone(AlarmCalendar.resolve(2016, 3, 13, 2, 30))
+        self.assertEqual(AlarmCalendar.resolve(2016, 3, 13, 3, 0),
+                         utc(2016, 3, 13, 7, 0))
+
+        # Repeated time
+        self.assertEqual(AlarmCalendar.resolve(2016, 11, 6, 1, 30),
+                         utc(2016, 11, 6, 5, 30))
+        AlarmCalendar.repeated_policy = AlarmCalendar.SECOND
+        self.assertEqual(AlarmCalendar.resolve(2016, 11, 6, 1, 30),
+                         utc(2016, 11, 6, 6, 30))
+
+    def test_next_alert_time(self):
+        """
+        Checks the next alert is found across the DST changes, including a
+        week in which the only alert is skipped.
+        """
+        alarm = AlarmItem(
+            7, 0, (False, False, False, False, False, False, True), True)
+        # Saturday at 12:00 EST, alert 18 hours later, not 19
+        from_time = utc(2016, 3, 12, 17, 0)
+        self.assertEqual(AlarmCalendar.next_alert_time(alarm, from_time),
+                         utc(2016, 3, 13, 11, 0))
+        self.assertEqual(
+            AlarmCalendar.next_alert_time(alarm, from_time) - from_time,
+            18 * 3600)
+
+        alarm.hour, alarm.minute = 2, 30
+        self.assertEqual(AlarmCalendar.next_alert_time(alarm, from_time),
+                         utc(2016, 3, 13, 7, 30))
+        AlarmCalendar.nonexistent_policy = AlarmCalendar.SKIP
+        self.assertEqual(AlarmCalendar.next_alert_time(alarm, from_time),
+                         utc(2016, 3, 20, 6, 30))
+
+        # Alerts resolved for a week are cached
+        with mock.patch('LightUpAlarm.AlarmCalendar.time.mktime') as mktime:
+            self.assertEqual(AlarmCalendar.next_alert_time(alarm, from_time),
+                             utc(2016, 3, 20, 6, 30))
+            self.assertFalse(mktime.called)
+
+    def test_week_cache(self):
+        """
+        Checks the alert times of more alarms than the previous cache size
+        limit (4096) stay cached, and that the least recently used week is
+        dropped when the cache is full.
+        """
+        AlarmCalendar.clear_cache()
+        alarms = [AlarmItem.from_trusted((i % 1440) // 60, i % 60,
+                                         1 << (i // 1440), True, '', None, i)
+                  for i in range(5000)]
+        week_start = datetime.date(2016, 1, 4)
+        first_alerts = [AlarmCalendar.week_alerts(alarm, week_start)
+                        for alarm in alarms]
+        with mock.patch('LightUpAlarm.AlarmCalendar.time.mktime') as mktime:
+            self.assertEqual([AlarmCalendar.week_alerts(alarm, week_start)
+                              for alarm in alarms], first_alerts)
+            self.assertFalse(mktime.called)
+
+        original_weeks = AlarmCalendar.max_cache_weeks
+        AlarmCalendar.max_cache_weeks = 2
+        try:
+            weeks = [week_start + datetime.timedelta(days=7 * week)
+                     for week in range(3)]
+            AlarmCalendar.week_alerts(alarms[0], weeks[1])
+            # The first week is used again, so the second one is dropped
+            AlarmCalendar.week_alerts(alarms[1], weeks[0])
+            AlarmCalendar.week_alerts(alarms[0], weeks[2])
+            with mock.patch('LightUpAlarm.AlarmCalendar.time.mktime',
+                            wraps=time.mktime) as mktime:
+                AlarmCalendar.week_alerts(alarms[0], weeks[0])
+                AlarmCalendar.week_alerts(alarms[0], weeks[2])
+                self.assertFalse(mktime.called)
+                AlarmCalendar.week_alerts(alarms[0], weeks[1])
+                self.assertTrue(mktime.called)
+        finally:
+            AlarmCalendar.max_cache_weeks = original_weeks
+            AlarmCalendar.clear_cache()
+
+    def test_virtual_clock(self):
+        """
+        Runs an AlarmThread with a virtual clock over the nights of the DST
+        changes, to check an alarm in a nonexistent time alerts once after the
+        gap, and an alarm in a repeated time alerts only once.
+        """
+        alarm = AlarmItem(
+            2, 30, (False, False, False, False, False, False, True), True,
+            alarm_id=1)
+        alerts = self.run_with_clock(
+            alarm, utc(2016, 3, 13, 4, 0), utc(2016, 3, 13, 10, 0))
+        self.assertEqual(alerts, [utc(2016, 3, 13, 7, 30)])
+
+        alarm = AlarmItem(
+            1, 30, (False, False, False, False, False, False, True), True,
+            alarm_id=1)
+        alerts = self.run_with_clock(
+            alarm, utc(2016, 11, 6, 4, 0), utc(2016, 11, 6, 10, 0))
+        self.assertEqual(alerts, [utc(2016, 11, 6, 5, 30)])
+
+        AlarmCalendar.repeated_policy = AlarmCalendar.SECOND
+        alerts = self.run_with_clock(
+            alarm, utc(2016, 11, 6, 4, 0), utc(2016, 11, 6, 10, 0))
+        self.assertEqual(alerts, [utc(2016, 11, 6, 6, 30)])
+
+
+if __name__ == '__main__':
+    unittest.main()
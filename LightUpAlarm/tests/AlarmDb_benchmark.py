@@ -0,0 +1,130 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Microbenchmark for the AlarmDb class database access.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# Measures the per-call latency of AlarmDb.get_alarm() and
+# AlarmDb.get_all_alarms() using the shared database connection, and compares
+# it against a copy of the AlarmDb code before the shared connection, which
+# connected with dataset on every call.
+#
+from __future__ import unicode_literals, absolute_import, print_function
+import os
+import timeit
+import dataset
+try:
+    from LightUpAlarm.AlarmDb import AlarmDb
+    from LightUpAlarm.AlarmItem import AlarmItem
+except ImportError:
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmDb import AlarmDb
+    from LightUpAlarm.AlarmItem import AlarmItem
+
+
+# Database name to be used for the benchmark
+db_name = 'AlarmDb_benchmark_db'
+
+# Number of calls to time per method
+iterations = 200
+
+
+class BaselineAlarmDb(object):
+    """
+    Copy of the AlarmDb code path before the shared connection (the baseline
+    commit cc5c908), which connects with dataset and rebuilds the table object
+    on every call, including the settings check in the constructor.
+    """
+
+    def __init__(self, db_name):
+        self.db_file = 'sqlite:///%s.db' % db_name
+        settings_table = self.__connect_settings()
+        rows = settings_table.all()
+        if rows.count == 0:
+            settings_table.insert(dict(snooze_time=3, offset_alert_time=-15))
+
+    def __connect_alarms(self):
+        alarms_table = dataset.connect(self.db_file)['alarms']
+        return alarms_table
+
+    def __connect_settings(self):
+        settings_table = dataset.connect(self.db_file)['settings']
+        return settings_table
+
+    def get_all_alarms(self):
+        alarms_table = self.__connect_alarms()
+        alarm_list = []
+        for alarm in alarms_table:
+            alarm_list.append(
+                AlarmItem(alarm['hour'], alarm['minute'],
+                          days=(alarm['monday'], alarm['tuesday'],
+                                alarm['wednesday'], alarm['thursday'],
+                                alarm['friday'], alarm['saturday'],
+                                alarm['sunday']),
+                          enabled=alarm['enabled'], label=alarm['label'],
+                          timestamp=alarm['timestamp'], alarm_id=alarm['id']))
+        return alarm_list
+
+    def get_alarm(self, alarm_id):
+        alarms_table = self.__connect_alarms()
+        alarm_dict = alarms_table.find_one(id=alarm_id)
+
+        if alarm_dict is None:
+            return None
+        else:
+            return AlarmItem(alarm_dict['hour'], alarm_dict['minute'],
+                             days=(alarm_dict['monday'], alarm_dict['tuesday'],
+                                   alarm_dict['wednesday'],
+                                   alarm_dict['thursday'],
+                                   alarm_dict['friday'], alarm_dict['saturday'],
+                                   alarm_dict['sunday']),
+                             enabled=alarm_dict['enabled'],
+                             label=alarm_dict['label'],
+                             timestamp=alarm_dict['timestamp'],
+                             alarm_id=alarm_dict['id'])
+
+
+def time_per_call(function):
+    """
+    :param function: Function to time.
+    :return: Average time, in milliseconds, of each call to the function.
+    """
+    function()  # warm up
+    return timeit.timeit(function, number=iterations) * 1000.0 / iterations
+
+
+def main():
+    alarm_db = AlarmDb(db_name)
+    alarm_db.delete_all_alarms()
+    days = (True, False, True, False, True, False, True)
+    alarm_id = None
+    for hour in range(24):
+        alarm_id = alarm_db.add_alarm(AlarmItem(hour, 30, days=days))
+
+    results = (
+        ('get_alarm', 'baseline connect per call',
+         lambda: BaselineAlarmDb(db_name).get_alarm(alarm_id)),
+        ('get_alarm', 'shared connection',
+         lambda: AlarmDb(db_name).get_alarm(alarm_id)),
+        ('get_all_alarms', 'baseline connect per call',
+         lambda: BaselineAlarmDb(db_name).get_all_alarms()),
+        ('get_all_alarms', 'shared connection',
+         lambda: AlarmDb(db_name).get_all_alarms()),
+    )
+    print('Average of %s calls, with %s alarms in the database:' %
+          (iterations, alarm_db.get_number_of_alarms()))
+    for method, mode, function in results:
+        print('  %-15s %-25s %8.3f ms' %
+              (method, mode, time_per_call(function)))
+
+    AlarmDb.close_all()
+    os.remove(alarm_db.db_path)
+
+
+if __name__ == '__main__':
+    main()
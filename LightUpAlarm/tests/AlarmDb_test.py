@@ -12,6 +12,7 @@ import mock
 import time
 import json
 import os
+import threading
 try:
     from LightUpAlarm.AlarmDb import AlarmDb
     from LightUpAlarm.AlarmItem import AlarmItem
@@ -298,6 +299,136 @@ class AlarmDbTestCase(unittest.TestCase):
         self.assertFalse(edited_alarm.enabled)
         self.assertEqual(edited_alarm.label, 'no')
 
+    def test_edit_alarm_single_update(self):
+        """
+        Checks an edit is applied with a single update, and that an invalid
+        input is skipped while the valid ones are still applied.
+        """
+        adh = AlarmDb(self.db_name)
+        alarm_test = AlarmItem(
+            13, 35, enabled=True, label='yes',
+            days=(True, False, True, False, True, False, True))
+        alarm_test.id_ = adh.add_alarm(alarm_test)
+
+        # An invalid minute fails the edit, but the valid hour and label are
+        # applied, without changing the timestamp
+        edit_success = adh.edit_alarm(
+            alarm_test.id_, hour=10, minute=60, label='no')
+        self.assertFalse(edit_success)
+        edited_alarm = adh.get_alarm(alarm_test.id_)
+        self.assertEqual(edited_alarm.hour, 10)
+        self.assertEqual(edited_alarm.minute, 35)
+        self.assertEqual(edited_alarm.label, 'no')
+        self.assertEqual(edited_alarm.timestamp, alarm_test.timestamp)
+
+        # Only invalid inputs do not update anything
+        table_class = type(adh._AlarmDb__connect_alarms())
+        with mock.patch.object(table_class, 'update',
+                               autospec=True) as mock_update:
+            self.assertFalse(adh.edit_alarm(alarm_test.id_, hour=24))
+            self.assertEqual(mock_update.call_count, 0)
+
+        # All the values and timestamp are written with a single update
+        with mock.patch.object(table_class, 'update',
+                               autospec=True, return_value=True) as mock_update:
+            edit_success = adh.edit_alarm(
+                alarm_test.id_, hour=10, minute=20, enabled=False,
+                days=(False, False, False, False, False, False, True))
+            self.assertTrue(edit_success)
+            self.assertEqual(mock_update.call_count, 1)
+            row = mock_update.call_args[0][1]
+            self.assertEqual(row['hour'], 10)
+            self.assertEqual(row['minute'], 20)
+            self.assertEqual(row['enabled'], False)
+            self.assertEqual(row['sunday'], True)
+            self.assertNotIn('label', row)
+            self.assertIn('timestamp', row)
+
+        # Non existent alarm
+        self.assertFalse(adh.edit_alarm(alarm_test.id_ + 1, hour=10))
+
+    def test_batch_alarms(self):
+        """ Adds, edits and deletes lists of alarms. """
+        adh = AlarmDb(self.db_name)
+        adh.delete_all_alarms()
+        ids = adh.add_alarms([
+            AlarmItem(13, 35, days=self.random_days, enabled=False),
+            'not an alarm',
+            AlarmItem(14, 36, days=self.random_days, enabled=True,
+                      timestamp=1234)])
+        self.assertIsNone(ids[1])
+        self.assertEqual(adh.get_number_of_alarms(), 2)
+        self.assertEqual(adh.get_alarm(ids[0]).minute, 35)
+        self.assertIsNotNone(adh.get_alarm(ids[0]).timestamp)
+        self.assertEqual(adh.get_alarm(ids[2]).timestamp, 1234)
+
+        results = adh.edit_alarms([
+            dict(alarm_id=ids[0], hour=1, label='one'),
+            dict(alarm_id=ids[2], hour=2, minute=61),
+            dict(alarm_id=ids[2] + 1, hour=3)])
+        self.assertEqual(results, [True, False, False])
+        self.assertEqual(adh.get_alarm(ids[0]).hour, 1)
+        self.assertEqual(adh.get_alarm(ids[0]).label, 'one')
+        self.assertEqual(adh.get_alarm(ids[2]).hour, 2)
+        self.assertEqual(adh.get_alarm(ids[2]).minute, 36)
+        self.assertEqual(adh.get_alarm(ids[2]).timestamp, 1234)
+
+        results = adh.delete_alarms([ids[0], ids[2] + 1, ids[2]])
+        self.assertEqual(results, [True, False, True])
+        self.assertEqual(adh.get_number_of_alarms(), 0)
+
+    def test_apply_batch(self):
+        """
+        Adds, edits and deletes alarms in a single transaction, checks that an
+        error in any of the operations discards all of them, and that it can
+        be used from a new thread, like the flask server request threads.
+        """
+        adh = AlarmDb(self.db_name)
+        adh.delete_all_alarms()
+        first_id = adh.add_alarm(AlarmItem(9, 0, days=self.random_days))
+        second_id = adh.add_alarm(AlarmItem(10, 0, days=self.random_days))
+
+        keys, edit_results, delete_results = adh.apply_batch(
+            add=[AlarmItem(11, 0, days=self.random_days), 'not an alarm'],
+            edit=[dict(alarm_id=first_id, hour=12),
+                  dict(alarm_id=second_id + 10, hour=12)],
+            delete=[second_id, second_id + 10])
+        self.assertIsNone(keys[1])
+        self.assertEqual(edit_results, [True, False])
+        self.assertEqual(delete_results, [True, False])
+        self.assertEqual(adh.get_alarm(keys[0]).hour, 11)
+        self.assertEqual(adh.get_alarm(first_id).hour, 12)
+        self.assertIsNone(adh.get_alarm(second_id))
+
+        # An invalid edit argument raises after the add, which is discarded
+        self.assertRaises(
+            TypeError, adh.apply_batch,
+            add=[AlarmItem(13, 0, days=self.random_days)],
+            edit=[dict(alarm_id=first_id, hour=14, not_an_argument=True)],
+            delete=[keys[0]])
+        self.assertEqual(adh.get_number_of_alarms(), 2)
+        self.assertEqual(adh.get_alarm(first_id).hour, 12)
+        self.assertEqual(adh.get_alarm(keys[0]).hour, 11)
+
+        # From a thread that has not used the database yet
+        thread_results = []
+
+        def apply_batch():
+            try:
+                thread_results.append(adh.apply_batch(
+                    edit=[dict(alarm_id=first_id, hour=15)],
+                    delete=[keys[0]]))
+            except Exception as error:
+                thread_results.append(error)
+
+        batch_thread = threading.Thread(target=apply_batch)
+        batch_thread.start()
+        batch_thread.join(10)
+        self.assertEqual(thread_results, [([], [True], [True])])
+        self.assertEqual(adh.get_alarm(first_id).hour, 15)
+        self.assertEqual(adh.get_number_of_alarms(), 1)
+        adh.delete_all_alarms()
+
     def test_update_alarm(self):
         """ Creates an alarm and update it. """
         adh = AlarmDb(self.db_name)
@@ -435,5 +566,60 @@ class AlarmDbTestCase(unittest.TestCase):
         self.assertNotEquals(adh.get_snooze_time(), 321)
         self.assertNotEquals(adh.get_offset_alert_time(), 123)
 
+    def test_shared_connection(self):
+        """
+        Checks that all the instances for the same database file share the
+        same connection, and that closing it reconnects on the next operation.
+        """
+        adh_one = AlarmDb(self.db_name)
+        adh_two = AlarmDb(self.db_name)
+        database = adh_one._AlarmDb__connect()
+        self.assertIs(database, adh_two._AlarmDb__connect())
+
+        self.only_five_entries(adh_one)
+        adh_one.close()
+        self.assertEqual(adh_two.get_number_of_alarms(), 5)
+        self.assertIsNot(adh_one._AlarmDb__connect(), database)
+
+        # Removing the database file also forces a new connection
+        adh_one.close()
+        os.remove(adh_one.db_path)
+        adh_three = AlarmDb(self.db_name)
+        self.assertEqual(adh_three.get_number_of_alarms(), 0)
+        self.assertEqual(adh_three.get_snooze_time(), 3)
+
+    def test_settings_single_row(self):
+        """ Checks new instances do not add extra rows to the settings. """
+        AlarmDb.close_all()
+        for _ in range(3):
+            adh = AlarmDb(self.db_name)
+        AlarmDb.close_all()
+        adh = AlarmDb(self.db_name)
+        self.assertEqual(len(list(adh._AlarmDb__connect_settings().all())), 1)
+
+    def test_threads(self):
+        """ Checks the shared connection can be used from several threads. """
+        adh = AlarmDb(self.db_name)
+        adh.delete_all_alarms()
+        errors = []
+
+        def add_and_read():
+            try:
+                for _ in range(10):
+                    alarm_id = AlarmDb(self.db_name).add_alarm(AlarmItem(
+                        13, 35, days=self.random_days, enabled=False))
+                    if AlarmDb(self.db_name).get_alarm(alarm_id) is None:
+                        errors.append(alarm_id)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=add_and_read) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+        self.assertEqual(adh.get_number_of_alarms(), 50)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Unit test for the AlarmEventFeed class.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+from __future__ import unicode_literals, absolute_import
+import time
+import unittest
+import threading
+try:
+    from LightUpAlarm.AlarmEventFeed import AlarmEventFeed
+except ImportError:
+    import os
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmEventFeed import AlarmEventFeed
+
+
+class AlarmEventFeedTestCase(unittest.TestCase):
+    """ Tests for AlarmEventFeed class. """
+
+    def test_publish(self):
+        """ Checks the events are retrieved in order from a given version. """
+        feed = AlarmEventFeed()
+        self.assertEqual(feed.get_version(), 0)
+        self.assertEqual(feed.get_events(), [])
+        self.assertEqual(feed.publish(AlarmEventFeed.ADD, 1), 1)
+        self.assertEqual(feed.publish(AlarmEventFeed.EDIT, 1), 2)
+        self.assertEqual(feed.publish(AlarmEventFeed.ALERT, 1, label='lbl'), 3)
+        self.assertEqual(feed.get_version(), 3)
+
+        events = feed.get_events()
+        self.assertEqual([event['version'] for event in events], [1, 2, 3])
+        self.assertEqual([event['type'] for event in events],
+                         ['add', 'edit', 'alert'])
+        self.assertEqual(events[2]['id'], 1)
+        self.assertEqual(events[2]['label'], 'lbl')
+        self.assertEqual(len(feed.get_events(since=2)), 1)
+        self.assertEqual(feed.get_events(since=3), [])
+
+        # Returned events are copies
+        events[0]['type'] = 'edited'
+        self.assertEqual(feed.get_events()[0]['type'], 'add')
+
+    def test_reset(self):
+        """
+        Checks a reset event is sent first when the requested events have been
+        discarded, or the version is unknown.
+        """
+        feed = AlarmEventFeed(max_events=3)
+        for alarm_id in range(5):
+            feed.publish(AlarmEventFeed.ADD, alarm_id)
+
+        events = feed.get_events(since=0)
+        self.assertEqual([event['type'] for event in events],
+                         ['reset', 'add', 'add', 'add'])
+        self.assertEqual(events[0]['version'], 5)
+        events = feed.get_events(since=1)
+        self.assertEqual(events[0]['type'], 'reset')
+        # The events from version 3 are still kept
+        events = feed.get_events(since=2)
+        self.assertEqual([event['version'] for event in events], [3, 4, 5])
+        events = feed.get_events(since=10, timeout=5)
+        self.assertEqual([event['type'] for event in events], ['reset'])
+        self.assertEqual(events[0]['version'], 5)
+
+    def test_wait(self):
+        """
+        Checks get_events waits for new events up to the timeout, and wakes up
+        as soon as an event is published from another thread.
+        """
+        feed = AlarmEventFeed()
+        start_time = time.time()
+        self.assertEqual(feed.get_events(since=0, timeout=0.1), [])
+        self.assertGreaterEqual(time.time() - start_time, 0.1)
+
+        timer = threading.Timer(0.1, feed.publish, args=('delete', 4))
+        timer.start()
+        start_time = time.time()
+        events = feed.get_events(since=0, timeout=5)
+        self.assertLess(time.time() - start_time, 5)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['type'], 'delete')
+        self.assertEqual(events[0]['id'], 4)
+        timer.join()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -10,6 +10,7 @@ from __future__ import unicode_literals, absolute_import
 import unittest
 import mock
 import io
+import random
 try:
     from LightUpAlarm.AlarmItem import AlarmItem
 except ImportError:
@@ -21,6 +22,57 @@ except ImportError:
     from LightUpAlarm.AlarmItem import AlarmItem
 
 
+def legacy_minutes_to_alert(alarm, hour, minute, weekday):
+    """ Previous implementation of AlarmItem.minutes_to_alert. """
+    alarm_day_minute = alarm.minute + (alarm.hour * 60)
+    ref_day_minute = minute + (hour * 60)
+    if alarm.repeat[weekday] is True and alarm_day_minute >= ref_day_minute:
+        return alarm_day_minute - ref_day_minute
+    day = (weekday + 1) % 7
+    day_count = 1
+    while day != weekday:
+        if alarm.repeat[day] is True:
+            return (day_count * 1440) + alarm_day_minute - ref_day_minute
+        day = (day + 1) % 7
+        day_count += 1
+    if alarm.repeat[weekday] is True:
+        return (1440 * 7) - ref_day_minute + alarm_day_minute
+    return None
+
+
+def legacy_diff_alarm(alarm, min_difference):
+    """
+    Previous implementation of AlarmItem.diff_alarm, for offsets from -59 to
+    59 minutes.
+    :return: Tuple with the new hour, minute and repeat days.
+    """
+    extra_hours = 0
+    extra_days = 0
+    new_minute = alarm.minute + min_difference
+    while new_minute >= 60:
+        new_minute %= 60
+        extra_hours += 1
+    while new_minute < 0:
+        new_minute += 60
+        extra_hours -= 1
+    new_hour = alarm.hour + extra_hours
+    while new_hour >= 24:
+        new_hour %= 24
+        extra_days += 1
+    while new_hour < 0:
+        new_hour += 24
+        extra_days -= 1
+    new_days = list(alarm.repeat)
+    if extra_days < 0:
+        while extra_days < 0:
+            new_days.append(new_days.pop(0))
+            extra_days += 1
+    elif extra_days > 0:
+        new_days = new_days[len(new_days) - extra_days:] + \
+            new_days[0:len(new_days) - extra_days]
+    return new_hour, new_minute, tuple(new_days)
+
+
 class AlarmItemTestCase(unittest.TestCase):
     """ Tests for AlarmItem class. """
 
@@ -467,6 +519,41 @@ class AlarmItemTestCase(unittest.TestCase):
               'Mon --- --- Thu --- --- Sun '
         self.assertEqual(str(test_alarm), out)
 
+    def test_days_mask(self):
+        """ Checks the repeat weekdays are kept as a mask, Monday as bit 0. """
+        days = (True, False, False, True, False, False, True)
+        test_alarm = AlarmItem(9, 30, days)
+        self.assertEqual(test_alarm.days_mask, 0b1001001)
+        test_alarm.tuesday = True
+        test_alarm.sunday = False
+        self.assertEqual(test_alarm.days_mask, 0b0001011)
+        self.assertEqual(AlarmItem.days_to_mask(days), 0b1001001)
+        self.assertEqual(AlarmItem.mask_to_days(0b1001001), days)
+
+    def test_from_trusted(self):
+        """
+        Checks the trusted constructor creates the same alarm as the default
+        constructor, and that equal alarms have the same hash.
+        """
+        days = (False, True, True, False, False, False, True)
+        test_alarm = AlarmItem(
+            7, 45, days, enabled=False, label='trusted', timestamp=1234,
+            alarm_id=3)
+        trusted_alarm = AlarmItem.from_trusted(
+            7, 45, AlarmItem.days_to_mask(days), False, 'trusted', 1234, 3)
+        self.assertEqual(trusted_alarm.repeat, days)
+        self.assertEqual(test_alarm, trusted_alarm)
+        self.assertFalse(test_alarm != trusted_alarm)
+        self.assertEqual(hash(test_alarm), hash(trusted_alarm))
+        self.assertEqual(len(set([test_alarm, trusted_alarm])), 1)
+
+        trusted_alarm.friday = True
+        self.assertNotEqual(test_alarm, trusted_alarm)
+        self.assertNotEqual(test_alarm, AlarmItem(7, 45, days))
+        self.assertNotEqual(test_alarm, None)
+        # Using slots, so no other attributes can be added
+        self.assertRaises(AttributeError, setattr, test_alarm, 'other', 1)
+
     def test_any_enabled_day(self):
         """ Test any_day_enabled() returns False if all repeats are false. """
         test_alarm = AlarmItem(
@@ -475,6 +562,46 @@ class AlarmItemTestCase(unittest.TestCase):
         test_alarm.repeat = (False, False, False, False, False, False, False)
         self.assertFalse(test_alarm.any_day_enabled())
 
+    def test_diff_alarm_days(self):
+        """ Tests the diff_alarm method with offsets longer than a day. """
+        test_alarm = AlarmItem(
+            23, 50, (True, False, False, True, True, False, True), True,
+            alarm_id=3)
+        # Moves to 00:10 two days later
+        diff_alarm = test_alarm.diff_alarm(1440 + 20)
+        self.assertEqual((diff_alarm.hour, diff_alarm.minute), (0, 10))
+        self.assertEqual(diff_alarm.repeat,
+                         (False, True, True, False, False, True, True))
+        diff_alarm = test_alarm.diff_alarm(-(7 * 1440) - 50)
+        self.assertEqual((diff_alarm.hour, diff_alarm.minute), (23, 0))
+        self.assertEqual(diff_alarm.repeat, test_alarm.repeat)
+        self.assertEqual(diff_alarm.label, ' (Alarm 3 -10130min)')
+        self.assertEqual(test_alarm.week_minutes(),
+                         [1430, (3 * 1440) + 1430, (4 * 1440) + 1430,
+                          (6 * 1440) + 1430])
+
+    def test_legacy_equivalence(self):
+        """
+        Checks minutes_to_alert and diff_alarm give the same results as the
+        previous day by day implementations, for random alarms.
+        """
+        rand = random.Random(1234)
+        for _ in range(2000):
+            days = tuple(rand.random() < 0.3 for _ in range(7))
+            test_alarm = AlarmItem(
+                rand.randint(0, 23), rand.randint(0, 59), days, alarm_id=1)
+            hour, minute = rand.randint(0, 23), rand.randint(0, 59)
+            weekday = rand.randint(0, 6)
+            self.assertEqual(
+                test_alarm.minutes_to_alert(hour, minute, weekday),
+                legacy_minutes_to_alert(test_alarm, hour, minute, weekday))
+
+            min_difference = rand.randint(-59, 59)
+            diff_alarm = test_alarm.diff_alarm(min_difference)
+            self.assertEqual(
+                (diff_alarm.hour, diff_alarm.minute, diff_alarm.repeat),
+                legacy_diff_alarm(test_alarm, min_difference))
+
     def test_diff_alarm(self):
         """ Tests the diff_alarm method returned Alarms. """
         # Helper function to assert the alarm properties, takes the outer scope
@@ -604,15 +731,10 @@ class AlarmItemTestCase(unittest.TestCase):
             test_alarm.diff_alarm(time_diff)
             self.assertEqual(test_srderr.getvalue(), '')
 
-            # Lower boundary
-            time_diff = -60
-            test_alarm.diff_alarm(time_diff)
-            self.assert_stderr(test_srderr)
-
-            # Upper boundary
-            time_diff = 60
-            test_alarm.diff_alarm(time_diff)
-            self.assert_stderr(test_srderr)
+            # There is no limit on the offset range
+            for time_diff in (-60, 60, -20000, 20000):
+                self.assertIsNotNone(test_alarm.diff_alarm(time_diff))
+            self.assertEqual(test_srderr.getvalue(), '')
 
             # other types instead of integer
             time_diff = 0.1
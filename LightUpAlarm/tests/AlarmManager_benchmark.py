@@ -0,0 +1,131 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Microbenchmark for the AlarmManager next alarms and upcoming alerts.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# Measures the per-call latency of AlarmManager.get_next_alarm() and of a one
+# week AlarmManager.upcoming() window, which slice the sorted alert index, and
+# compares them against resolving the alerts alarm by alarm with the
+# AlarmCalendar class.
+# The alarms database is created in a temporary directory, so the benchmark
+# does not modify the alarms of the current directory.
+#
+from __future__ import unicode_literals, absolute_import, print_function
+import os
+import time
+import random
+import shutil
+import timeit
+import datetime
+import tempfile
+try:
+    from LightUpAlarm.AlarmDb import AlarmDb
+    from LightUpAlarm.AlarmManager import AlarmManager
+    from LightUpAlarm.AlarmCalendar import AlarmCalendar
+except ImportError:
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmDb import AlarmDb
+    from LightUpAlarm.AlarmManager import AlarmManager
+    from LightUpAlarm.AlarmCalendar import AlarmCalendar
+
+
+# Number of alarms, repeating every day, for each run of the benchmark
+alarm_numbers = (1000, 10000)
+
+# Number of calls to time per method
+iterations = 20
+
+
+def per_alarm_next_alarm(alarms, from_time):
+    """
+    Finds the next alert by resolving the next alert time of every alarm with
+    the AlarmCalendar, as a reference for the alert index.
+    :return: Tuple with the next alert time and the alarm ID.
+    """
+    return min((AlarmCalendar.next_alert_time(alarm, from_time), alarm.id_)
+               for alarm in alarms)
+
+
+def per_alarm_upcoming(alarms, start, end):
+    """
+    Gets the alerts and offset alerts of a time window by resolving the week
+    alerts of every alarm with the AlarmCalendar, as a reference for the alert
+    index.
+    :return: List of (alarm ID, alert datetime, offset alert flag) tuples,
+             sorted by alert time.
+    """
+    start_time = time.mktime(start.timetuple())
+    end_time = time.mktime(end.timetuple())
+    week_start = start.date() - datetime.timedelta(days=start.weekday())
+    weeks = [week_start, week_start + datetime.timedelta(days=7)]
+    offset_alarm_time = AlarmManager.get_offset_alert_time()
+    alerts = []
+    for alarm in alarms:
+        for shift_alarm, offset_flag in (
+                (alarm, False), (alarm.diff_alarm(offset_alarm_time), True)):
+            for week in weeks:
+                alerts.extend(
+                    (alert_time, offset_flag, alarm.id_) for alert_time in
+                    AlarmCalendar.week_alerts(shift_alarm, week)
+                    if start_time <= alert_time < end_time)
+    alerts.sort()
+    return [(alarm_id, datetime.datetime.fromtimestamp(alert_time), offset_flag)
+            for alert_time, offset_flag, alarm_id in alerts]
+
+
+def time_per_call(function):
+    """
+    :param function: Function to time.
+    :return: Average time, in milliseconds, of each call to the function.
+    """
+    function()  # warm up
+    return timeit.timeit(function, number=iterations) * 1000.0 / iterations
+
+
+def main():
+    original_dir = os.getcwd()
+    temp_dir = tempfile.mkdtemp()
+    os.chdir(temp_dir)
+    try:
+        alarm_mgr = AlarmManager(use_scheduler=True)
+        random.seed(0)
+        for alarm_number in alarm_numbers:
+            alarm_mgr.delete_all_alarms()
+            alarm_mgr.add_alarms([
+                {'hour': random.randrange(24), 'minute': random.randrange(60),
+                 'days': (True, True, True, True, True, True, True)}
+                for _ in range(alarm_number)])
+            alarms = alarm_mgr.get_all_active_alarms()
+            start = datetime.datetime.now()
+            end = start + datetime.timedelta(days=7)
+
+            results = (
+                ('get_next_alarm', 'alert index',
+                 lambda: alarm_mgr.get_next_alarm()),
+                ('get_next_alarm', 'per alarm AlarmCalendar',
+                 lambda: per_alarm_next_alarm(alarms, time.time())),
+                ('upcoming week', 'alert index',
+                 lambda: alarm_mgr.upcoming(start, end)),
+                ('upcoming week', 'per alarm AlarmCalendar',
+                 lambda: per_alarm_upcoming(alarms, start, end)),
+            )
+            print('Average of %s calls, with %s active alarms:' %
+                  (iterations, alarm_number))
+            for method, mode, function in results:
+                print('  %-15s %-25s %10.3f ms' %
+                      (method, mode, time_per_call(function)))
+        alarm_mgr.delete_all_alarms()
+        AlarmDb.close_all()
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(temp_dir)
+
+
+if __name__ == '__main__':
+    main()
@@ -6,25 +6,31 @@
 # Copyright (c) 2015 carlosperate https://github.com/carlosperate/
 # Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
 #
-# The following methods are basically a call to the AlarmDb class and do not
-# need to be tested:
+# The following methods are basically a call to the AlarmDb class, or to the
+# alarm cache (tested in test_alarm_cache), and do not need to be tested:
 #  get_all_alarms, get_number_of_alarms, get_all_enabled_alarms, get_alarm,
 #  get_snooze_time, set_snooze_time, get_offset_alert_time,
 #  set_offset_alert_time
 #
 from __future__ import unicode_literals, absolute_import
 import io
+import os
 import mock
 import time
+import calendar
 import types
+import datetime
 import unittest
 import threading
 try:
     from LightUpAlarm.AlarmDb import AlarmDb
     from LightUpAlarm.AlarmItem import AlarmItem
     from LightUpAlarm.AlarmManager import AlarmManager
+    from LightUpAlarm.AlarmScheduler import AlarmScheduler
+    from LightUpAlarm.AlertDispatcher import AlertDispatcher
+    from LightUpAlarm.AlarmCalendar import AlarmCalendar
+    from LightUpAlarm.AlarmClock import VirtualClock
 except ImportError:
-    import os
     import sys
     file_dir = os.path.dirname(os.path.realpath(__file__))
     package_dir = os.path.dirname(os.path.dirname(file_dir))
@@ -32,6 +38,10 @@ except ImportError:
     from LightUpAlarm.AlarmDb import AlarmDb
     from LightUpAlarm.AlarmItem import AlarmItem
     from LightUpAlarm.AlarmManager import AlarmManager
+    from LightUpAlarm.AlarmScheduler import AlarmScheduler
+    from LightUpAlarm.AlertDispatcher import AlertDispatcher
+    from LightUpAlarm.AlarmCalendar import AlarmCalendar
+    from LightUpAlarm.AlarmClock import VirtualClock
 
 
 class AlarmManagerTestCase(unittest.TestCase):
@@ -54,6 +64,15 @@ class AlarmManagerTestCase(unittest.TestCase):
         self.assertEqual(alarm.enabled, enabled)
         self.assertEqual(alarm.label, label)
 
+    @staticmethod
+    def week_time(weekday, hour, minute):
+        """
+        :return: Time, in seconds since 1970, of the weekday (0 is Monday) at
+                 the hour and minute, in the week starting Monday 5th of
+                 January 2015.
+        """
+        return time.mktime((2015, 1, 5 + weekday, hour, minute, 0, 0, 0, -1))
+
     def create_alarms(self, alarm_mgr):
         """ Deletes all alarms and creates 5 with different data. """
         alarm_mgr.delete_all_alarms()
@@ -225,11 +244,10 @@ class AlarmManagerTestCase(unittest.TestCase):
         active_alarms = AlarmManager.get_all_active_alarms()
         self.assertEqual(len(active_alarms), 0)
 
-    @mock.patch('LightUpAlarm.AlarmManager.time.localtime')
-    def test_get_next_alarm(self, mock_time):
+    def test_get_next_alarm(self):
         """
-        Creates 5 alarms with different settings. It then mocks the current time
-        to get calculate the next alarm at different reference points.
+        Creates 5 alarms with different settings. It then calculates the next
+        alarm from different reference points.
         """
         alarm_mgr = AlarmManager()
         alarm_mgr.delete_all_alarms()
@@ -238,44 +256,297 @@ class AlarmManagerTestCase(unittest.TestCase):
         alarm_mgr.add_alarm(
             11, 15, (True, False, False, False, False, False, False), True)
 
-        #             year, mon, mday, hour, min, sec, wday, yday, isdst
-        time_tuple = (2015,  0,     0,   12,  30,  00,   0,    0,     0)
-        mock_time.return_value = time.struct_time(time_tuple)
-        next_alarm = AlarmManager.get_next_alarm()
+        # Monday at 12:30
+        from_time = self.week_time(0, 12, 30)
+        next_alarm = AlarmManager.get_next_alarm(from_time)
         self.assertEqual(next_alarm.id_, 2)
 
-        #             year, mon, mday, hour, min, sec, wday, yday, isdst
-        time_tuple = (2015,  0,     0,   11,  17,  00,   0,    0,     0)
-        mock_time.return_value = time.struct_time(time_tuple)
-        next_alarm = AlarmManager.get_next_alarm()
+        # Monday at 11:17
+        from_time = self.week_time(0, 11, 17)
+        next_alarm = AlarmManager.get_next_alarm(from_time)
         self.assertEqual(next_alarm.id_, 1)
 
         self.create_alarms(alarm_mgr)
 
-        #             year, mon, mday, hour, min, sec, wday, yday, isdst
-        time_tuple = (2015,  0,     0,   19,  30,  00,   1,    0,     0)
-        mock_time.return_value = time.struct_time(time_tuple)
-        next_alarm = AlarmManager.get_next_alarm()
+        # Tuesday at 19:30
+        from_time = self.week_time(1, 19, 30)
+        next_alarm = AlarmManager.get_next_alarm(from_time)
         self.assertEqual(next_alarm.id_, 2)
 
-        #             year, mon, mday, hour, min, sec, wday, yday, isdst
-        time_tuple = (2015,  0,     0,   13,  00,  00,   4,    0,     0)
-        mock_time.return_value = time.struct_time(time_tuple)
-        next_alarm = AlarmManager.get_next_alarm()
+        # Friday at 13:00
+        from_time = self.week_time(4, 13, 0)
+        next_alarm = AlarmManager.get_next_alarm(from_time)
         self.assertEqual(next_alarm.id_, 4)
 
-        #             year, mon, mday, hour, min, sec, wday, yday, isdst
-        time_tuple = (2015,  0,     0,   21,  45,  00,   5,    0,     0)
-        mock_time.return_value = time.struct_time(time_tuple)
-        next_alarm = AlarmManager.get_next_alarm()
+        # Saturday at 21:45
+        from_time = self.week_time(5, 21, 45)
+        next_alarm = AlarmManager.get_next_alarm(from_time)
         self.assertEqual(next_alarm.id_, 3)
 
-        #             year, mon, mday, hour, min, sec, wday, yday, isdst
-        time_tuple = (2015,  0,     0,   11,  15,  00,   6,    0,     0)
-        mock_time.return_value = time.struct_time(time_tuple)
-        next_alarm = AlarmManager.get_next_alarm()
+        # Sunday at 11:15
+        from_time = self.week_time(6, 11, 15)
+        next_alarm = AlarmManager.get_next_alarm(from_time)
         self.assertEqual(next_alarm.id_, 3)
 
+    def test_get_next_alarms(self):
+        """
+        Checks the next alarms are retrieved in order, wrapping around the end
+        of the week, and that they follow the alarms add, edit and delete.
+        """
+        alarm_mgr = AlarmManager()
+        self.create_alarms(alarm_mgr)
+        # Saturday at 19:30
+        from_time = self.week_time(5, 19, 30)
+
+        # Saturday 20:45 (id 5), Sunday 11:15 (id 3), Monday 11:15 (id 3),
+        # Tuesday 08:30 (id 1), Tuesday 13:35 (id 4), Wednesday 09:00 (id 2)
+        next_alarms = alarm_mgr.get_next_alarms(6, from_time)
+        self.assertEqual([alarm.id_ for alarm in next_alarms],
+                         [5, 3, 3, 1, 4, 2])
+        self.assertEqual(next_alarms[0].next_alert, 75)
+        self.assertEqual(next_alarms[1].next_alert, 945)
+        self.assertEqual(len(alarm_mgr.get_next_alarms(100, from_time)), 12)
+
+        # Alarm in the current minute is the next one
+        alarm_mgr.edit_alarm(5, hour=19, minute=30)
+        self.assertEqual(alarm_mgr.get_next_alarm(from_time).id_, 5)
+        self.assertEqual(alarm_mgr.get_next_alarm(from_time).next_alert, 0)
+        alarm_mgr.edit_alarm(5, enabled=False)
+        self.assertEqual(alarm_mgr.get_next_alarm(from_time).id_, 3)
+        alarm_mgr.delete_alarm(3)
+        self.assertEqual(alarm_mgr.get_next_alarm(from_time).id_, 1)
+        self.assertEqual(len(alarm_mgr.get_next_alarms(100, from_time)), 7)
+        new_id = alarm_mgr.add_alarm(
+            21, 0, (False, False, False, False, False, True, False), True)
+        self.assertEqual(alarm_mgr.get_next_alarm(from_time).id_, new_id)
+
+        # Results match the minutes_to_alert calculation for the whole week
+        for wday in range(7):
+            for hour in range(0, 24, 3):
+                from_time = self.week_time(wday, hour, 20)
+                next_alarm = alarm_mgr.get_next_alarm(from_time)
+                expected = min(alarm.minutes_to_alert(hour, 20, wday)
+                               for alarm in alarm_mgr.get_all_active_alarms())
+                self.assertEqual(next_alarm.next_alert, expected)
+
+        alarm_mgr.delete_all_alarms()
+        self.assertEqual(AlarmManager.get_next_alarms(5), [])
+        self.assertIsNone(alarm_mgr.get_next_alarm(from_time))
+
+    def test_alert_index(self):
+        """
+        Checks the sorted alert index is updated incrementally on every add,
+        edit and delete, without reloading the alarms from the database, and
+        that it always matches an index built from the active alarms.
+        """
+        alarm_mgr = AlarmManager()
+        self.create_alarms(alarm_mgr)
+
+        def assert_index():
+            expected = sorted((week_minute, alarm.id_) for alarm in
+                              AlarmManager.get_all_active_alarms()
+                              for week_minute in alarm.week_minutes())
+            self.assertEqual(AlarmManager._AlarmManager__alert_index, expected)
+
+        assert_index()
+        with mock.patch.object(AlarmDb, 'get_all_alarms') as get_all_alarms:
+            new_id = alarm_mgr.add_alarm(
+                11, 15, (True, True, False, False, False, False, False), True)
+            assert_index()
+            alarm_mgr.edit_alarm(new_id, minute=16, days=(
+                False, False, False, False, False, False, True))
+            assert_index()
+            alarm_mgr.edit_alarm(1, enabled=False)
+            assert_index()
+            alarm_mgr.edit_alarm(1, enabled=True)
+            assert_index()
+            alarm_mgr.delete_alarm(3)
+            assert_index()
+            alarm_mgr.delete_alarms([new_id, 4])
+            assert_index()
+            self.assertFalse(get_all_alarms.called)
+        alarm_mgr.delete_all_alarms()
+        self.assertEqual(AlarmManager._AlarmManager__alert_index, [])
+
+    def test_upcoming(self):
+        """
+        Checks the alerts and offset alerts in a time window, crossing the end
+        of the week, match the ones calculated alarm by alarm.
+        """
+        alarm_mgr = AlarmManager()
+        self.create_alarms(alarm_mgr)
+        original_offset = alarm_mgr.get_offset_alert_time()
+        alarm_mgr.set__offset_alert_time(-30)
+        try:
+            # Saturday 2 January 2016 at 20:15:30
+            start = datetime.datetime(2016, 1, 2, 20, 15, 30)
+            end = start + datetime.timedelta(days=9)
+            upcoming = alarm_mgr.upcoming(start, end)
+        finally:
+            alarm_mgr.set__offset_alert_time(original_offset)
+        self.assertEqual(upcoming[:3], [
+            (5, datetime.datetime(2016, 1, 2, 20, 45), False),
+            (3, datetime.datetime(2016, 1, 3, 10, 45), True),
+            (3, datetime.datetime(2016, 1, 3, 11, 15), False)])
+
+        expected = []
+        for alarm in alarm_mgr.get_all_active_alarms():
+            for offset_flag, minutes in ((False, 0), (True, -30)):
+                offset_alarm = alarm.diff_alarm(minutes)
+                for day in range(-1, 11):
+                    date_time = datetime.datetime(
+                        2016, 1, 2, offset_alarm.hour, offset_alarm.minute) + \
+                        datetime.timedelta(days=day)
+                    if offset_alarm.repeat[date_time.weekday()] and \
+                            start <= date_time < end:
+                        expected.append((alarm.id_, date_time, offset_flag))
+        self.assertEqual(sorted(upcoming, key=lambda x: (x[1], x[2], x[0])),
+                         upcoming)
+        self.assertEqual(sorted(expected), sorted(upcoming))
+
+        # End is exclusive, and an alert at the start minute is included
+        start = datetime.datetime(2016, 1, 4, 11, 15)
+        self.assertEqual(
+            alarm_mgr.upcoming(start, start + datetime.timedelta(minutes=1)),
+            [(3, start, False)])
+        self.assertEqual(
+            alarm_mgr.upcoming(start - datetime.timedelta(minutes=1), start),
+            [])
+
+        # The alerts are sliced from the alert index, and not resolved alarm by
+        # alarm, AlarmManager_benchmark.py measures the difference
+        with mock.patch.object(AlarmCalendar, 'week_alerts') as week, \
+                mock.patch.object(AlarmCalendar, 'next_alert_time') as alert:
+            self.assertEqual(len(alarm_mgr.upcoming(
+                start, start + datetime.timedelta(days=7))), 24)
+            self.assertEqual(len(alarm_mgr.get_next_alarms(10, time.mktime(
+                start.timetuple()))), 10)
+            self.assertFalse(week.called)
+            self.assertFalse(alert.called)
+
+    def test_next_alarms_dst(self):
+        """
+        Checks the next alarms and the upcoming alerts are resolved to absolute
+        times over the Europe/London daylight saving time changes of 2016, on
+        the 27th of March (01:00 GMT to 02:00 BST) and on the 30th of October
+        (02:00 BST to 01:00 GMT), following the AlarmCalendar policies.
+        """
+        original_tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'Europe/London'
+        time.tzset()
+        sundays = (False, False, False, False, False, False, True)
+        try:
+            alarm_mgr = AlarmManager()
+            alarm_mgr.delete_all_alarms()
+            gap_id = alarm_mgr.add_alarm(1, 30, sundays, True)
+            after_id = alarm_mgr.add_alarm(3, 0, sundays, True)
+
+            # Saturday 26th of March at 23:00 GMT, 01:30 is shifted to 02:30
+            # BST, and 03:00 BST is 3 hours away, not 4
+            from_time = calendar.timegm((2016, 3, 26, 23, 0, 0))
+            next_alarms = alarm_mgr.get_next_alarms(2, from_time)
+            self.assertEqual(
+                [(alarm.id_, alarm.next_alert) for alarm in next_alarms],
+                [(gap_id, 150), (after_id, 180)])
+            start = datetime.datetime(2016, 3, 26, 12, 0)
+            self.assertEqual(
+                [alert for alert in alarm_mgr.upcoming(
+                    start, start + datetime.timedelta(days=1))
+                 if alert[2] is False],
+                [(gap_id, datetime.datetime(2016, 3, 27, 2, 30), False),
+                 (after_id, datetime.datetime(2016, 3, 27, 3, 0), False)])
+
+            # The nonexistent alert is skipped, and the one of the next week is
+            # over 7 days away
+            AlarmCalendar.nonexistent_policy = AlarmCalendar.SKIP
+            next_alarms = alarm_mgr.get_next_alarms(2, from_time)
+            self.assertEqual(
+                [(alarm.id_, alarm.next_alert) for alarm in next_alarms],
+                [(after_id, 180)])
+            self.assertEqual(
+                [alert for alert in alarm_mgr.upcoming(
+                    start, start + datetime.timedelta(days=1))
+                 if alert[2] is False],
+                [(after_id, datetime.datetime(2016, 3, 27, 3, 0), False)])
+
+            # Saturday 29th of October at 23:00 BST, 01:30 is repeated, and
+            # 03:00 GMT is 5 hours away, not 4
+            from_time = calendar.timegm((2016, 10, 29, 22, 0, 0))
+            next_alarms = alarm_mgr.get_next_alarms(2, from_time)
+            self.assertEqual(
+                [(alarm.id_, alarm.next_alert) for alarm in next_alarms],
+                [(gap_id, 150), (after_id, 300)])
+            AlarmCalendar.repeated_policy = AlarmCalendar.SECOND
+            next_alarms = alarm_mgr.get_next_alarms(2, from_time)
+            self.assertEqual(
+                [(alarm.id_, alarm.next_alert) for alarm in next_alarms],
+                [(gap_id, 210), (after_id, 300)])
+            alarm_mgr.delete_all_alarms()
+        finally:
+            AlarmCalendar.nonexistent_policy = AlarmCalendar.SHIFT
+            AlarmCalendar.repeated_policy = AlarmCalendar.FIRST
+            if original_tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = original_tz
+            time.tzset()
+
+    def test_next_alarms_dst_index(self):
+        """
+        Checks the alerts sliced from the alert index around the Europe/London
+        daylight saving time changes of 2016 match the ones resolved alarm by
+        alarm by the AlarmCalendar, for every policy.
+        """
+        original_tz = os.environ.get('TZ')
+        os.environ['TZ'] = 'Europe/London'
+        time.tzset()
+        try:
+            alarm_mgr = AlarmManager()
+            alarm_mgr.delete_all_alarms()
+            alarm_mgr.add_alarms([
+                {'hour': minute // 60, 'minute': minute % 60,
+                 'days': (False, False, False, False, False, True, True)}
+                for minute in range(0, 240, 20)])
+            alarms = alarm_mgr.get_all_active_alarms()
+            policies = ((AlarmCalendar.SHIFT, AlarmCalendar.FIRST),
+                        (AlarmCalendar.SKIP, AlarmCalendar.SECOND))
+            for start in (datetime.datetime(2016, 3, 26, 23, 10),
+                          datetime.datetime(2016, 3, 27, 1, 50),
+                          datetime.datetime(2016, 10, 30, 0, 30)):
+                from_time = time.mktime(start.timetuple())
+                end = start + datetime.timedelta(days=2)
+                week_start = start.date() - \
+                    datetime.timedelta(days=start.weekday())
+                for nonexistent, repeated in policies:
+                    AlarmCalendar.nonexistent_policy = nonexistent
+                    AlarmCalendar.repeated_policy = repeated
+                    expected = sorted(
+                        (alert_time, alarm.id_) for alarm in alarms
+                        for alert_time in AlarmCalendar.week_alerts(
+                            alarm, week_start)
+                        if from_time <= alert_time <
+                        time.mktime(end.timetuple()))
+                    self.assertEqual(
+                        [(alarm_id, alert_time) for alarm_id, alert_time,
+                         offset_flag in alarm_mgr.upcoming(start, end)
+                         if offset_flag is False],
+                        [(alarm_id, datetime.datetime.fromtimestamp(alert))
+                         for alert, alarm_id in expected])
+                    self.assertEqual(
+                        [(alarm.id_, alarm.next_alert) for alarm in
+                         alarm_mgr.get_next_alarms(3, from_time)],
+                        [(alarm_id, (alert - int(from_time)) // 60)
+                         for alert, alarm_id in expected[:3]])
+            alarm_mgr.delete_all_alarms()
+        finally:
+            AlarmCalendar.nonexistent_policy = AlarmCalendar.SHIFT
+            AlarmCalendar.repeated_policy = AlarmCalendar.FIRST
+            if original_tz is None:
+                del os.environ['TZ']
+            else:
+                os.environ['TZ'] = original_tz
+            time.tzset()
+
     def test_edit_alarm(self):
         """
         Places 5 alarms into the database, it then retrieves one, edits it and
@@ -309,6 +580,90 @@ class AlarmManagerTestCase(unittest.TestCase):
             retrieved_alarm, 3, 23, 34,
             (False, True, False, True, False, True, False), False, 'edited')
 
+    def test_batch_alarms(self):
+        """ Adds, edits and deletes lists of alarms. """
+        alarm_mgr = AlarmManager()
+        alarm_mgr.delete_all_alarms()
+        days = (True, True, True, True, True, True, True)
+        ids = alarm_mgr.add_alarms([
+            dict(hour=8, minute=30, days=days, enabled=True),
+            dict(hour=25, minute=30),
+            dict(hour=9, minute=0, days=days, enabled=False, label='two'),
+            dict(hour=10, minute=0, wrong_key=True)])
+        self.assertIsNone(ids[1])
+        self.assertIsNone(ids[3])
+        self.assertEqual(alarm_mgr.get_number_of_alarms(), 2)
+        self.assert_alarm(alarm_mgr.get_alarm(ids[2]), ids[2], 9, 0, days,
+                          False, 'two')
+        self.assertTrue(alarm_mgr.is_alarm_running(ids[0]))
+        self.assertFalse(alarm_mgr.is_alarm_running(ids[2]))
+
+        # The valid values of a failed edit are applied and launched as well
+        results = alarm_mgr.edit_alarms([
+            dict(alarm_id=ids[0], enabled=False),
+            dict(alarm_id=ids[2], enabled=True, minute=60)])
+        self.assertEqual(results, [True, False])
+        self.assertTrue(alarm_mgr.get_alarm(ids[2]).enabled)
+        self.assertTrue(alarm_mgr.is_alarm_running(ids[2]))
+
+        results = alarm_mgr.edit_alarms([
+            dict(alarm_id=ids[2], enabled=True, label='edited')])
+        self.assertEqual(results, [True])
+        self.assertFalse(alarm_mgr.is_alarm_running(ids[0]))
+        self.assertTrue(alarm_mgr.is_alarm_running(ids[2]))
+        self.assert_alarm(alarm_mgr.get_alarm(ids[2]), ids[2], 9, 0, days,
+                          True, 'edited')
+
+        results = alarm_mgr.delete_alarms([ids[0], ids[2], ids[2] + 1])
+        self.assertEqual(results, [True, True, False])
+        self.assertFalse(alarm_mgr.is_alarm_running(ids[2]))
+        self.assertEqual(alarm_mgr.get_number_of_alarms(), 0)
+        self.assertEqual(AlarmDb().get_number_of_alarms(), 0)
+
+    def test_apply_batch(self):
+        """
+        Adds, edits and deletes alarms in a single transaction, and checks that
+        the alarms are rescheduled once, and that an invalid edit argument
+        discards the whole batch.
+        """
+        alarm_mgr = AlarmManager(use_scheduler=True)
+        alarm_mgr.delete_all_alarms()
+        days = (True, True, True, True, True, True, True)
+        first_id = alarm_mgr.add_alarm(8, 30, days=days, enabled=True)
+        second_id = alarm_mgr.add_alarm(9, 30, days=days, enabled=True)
+
+        set_alarms = AlarmScheduler.set_alarms
+        with mock.patch.object(AlarmScheduler, 'set_alarms', autospec=True,
+                               side_effect=set_alarms) as mock_set, \
+                mock.patch.object(AlarmScheduler, 'remove_alarms') as remove:
+            ids, edit_results, delete_results = alarm_mgr.apply_batch(
+                add=[dict(hour=10, minute=0, days=days, enabled=True),
+                     dict(hour=25, minute=0)],
+                edit=[dict(alarm_id=first_id, minute=45)],
+                delete=[second_id, second_id + 10])
+        self.assertEqual(mock_set.call_count, 1)
+        self.assertFalse(remove.called)
+        self.assertIsNone(ids[1])
+        self.assertEqual(edit_results, [True])
+        self.assertEqual(delete_results, [True, False])
+        self.assertEqual(
+            sorted(alarm.id_ for alarm in alarm_mgr.get_running_alarms()),
+            sorted([first_id, ids[0]]))
+        self.assertEqual(alarm_mgr.get_alarm(first_id).minute, 45)
+        self.assertIsNone(alarm_mgr.get_alarm(second_id))
+
+        # The add and delete are not applied with an invalid edit argument
+        results = alarm_mgr.apply_batch(
+            add=[dict(hour=11, minute=0, days=days, enabled=True)],
+            edit=[dict(alarm_id=first_id, minute=50, wrong_key=True)],
+            delete=[ids[0]])
+        self.assertEqual(results, ([None], [False], [False]))
+        self.assertEqual(alarm_mgr.get_number_of_alarms(), 2)
+        self.assertEqual(AlarmDb().get_number_of_alarms(), 2)
+        self.assertTrue(alarm_mgr.is_alarm_running(ids[0]))
+        self.assertEqual(alarm_mgr.get_alarm(first_id).minute, 45)
+        alarm_mgr.delete_all_alarms()
+
     def test_update_alarm(self):
         """
         Places 5 alarms into the database, it then retrieves one, updates it
@@ -566,6 +921,321 @@ class AlarmManagerTestCase(unittest.TestCase):
         # and then somehow stop the recovery of such thread. So for now, it is
         # not tested.
 
+    def test_scheduler_running_alarms(self):
+        """
+        Tests that with the scheduler mode all active alarms run on a single
+        thread, and that the running alarms API is maintained.
+        """
+        # The scheduler thread, the alert dispatcher thread can be shared
+        alarm_mgr = AlarmManager(use_scheduler=True)
+        numb_threads = threading.activeCount()
+        self.create_alarms(alarm_mgr)
+        self.assertEqual(threading.activeCount(), numb_threads)
+        self.assertTrue(alarm_mgr._AlarmManager__scheduler.isAlive())
+        self.assertEqual(len(alarm_mgr.get_running_alarms()), 5)
+        self.assertTrue(alarm_mgr.is_alarm_running(1))
+        self.assertTrue(alarm_mgr.check_threads_state())
+
+        # Deactivating and deleting alarms removes them from the scheduler
+        alarm_mgr.edit_alarm(1, enabled=False)
+        alarm_mgr.delete_alarm(3)
+        self.assertFalse(alarm_mgr.is_alarm_running(1))
+        self.assertFalse(alarm_mgr.is_alarm_running(3))
+        self.assertEqual(len(alarm_mgr.get_running_alarms()), 3)
+        self.assertEqual(threading.activeCount(), numb_threads)
+
+        # Editing the database bypassing AlarmManager is recovered
+        AlarmDb().edit_alarm(1, enabled=True)
+        self.assertFalse(alarm_mgr.check_threads_state())
+        self.assertTrue(alarm_mgr.check_threads_state())
+        self.assertTrue(alarm_mgr.is_alarm_running(1))
+
+        # Stopping the scheduler thread is recovered as well
+        alarm_mgr._AlarmManager__scheduler.stop()
+        alarm_mgr._AlarmManager__scheduler.join(5)
+        self.assertFalse(alarm_mgr.is_alarm_running(1))
+        self.assertFalse(alarm_mgr.check_threads_state())
+        self.assertTrue(alarm_mgr.check_threads_state())
+        self.assertEqual(len(alarm_mgr.get_running_alarms()), 4)
+
+        # And stopping the alert dispatcher thread
+        alarm_mgr._AlarmManager__dispatcher.stop()
+        alarm_mgr._AlarmManager__dispatcher.join(5)
+        self.assertFalse(alarm_mgr.check_threads_state())
+        self.assertTrue(alarm_mgr.check_threads_state())
+        self.assertEqual(len(alarm_mgr.get_running_alarms()), 4)
+        self.assertEqual(threading.activeCount(), numb_threads)
+
+        alarm_mgr.delete_all_alarms()
+        self.assertEqual(len(alarm_mgr.get_running_alarms()), 0)
+        alarm_mgr._AlarmManager__scheduler.stop()
+        alarm_mgr._AlarmManager__dispatcher.stop()
+        alarm_mgr._AlarmManager__scheduler.join(5)
+        alarm_mgr._AlarmManager__dispatcher.join(5)
+
+    def test_scheduler_alarm_trigger_callback(self):
+        """
+        Creates and alarm to trigger within a minute with the scheduler mode and
+        check it has done so correctly.
+        This test can take over 10 seconds in its worse case scenario.
+        """
+        alert_event = threading.Event()
+        time_now = time.localtime(time.time())
+        while time_now.tm_sec > 50:
+            time.sleep(1)
+            time_now = time.localtime(time.time())
+        alarm_mgr = AlarmManager(alert_callback=alert_event.set,
+                                 use_scheduler=True)
+        alarm_mgr.delete_all_alarms()
+        alarm_id = alarm_mgr.add_alarm(
+            time_now.tm_hour, time_now.tm_min,
+            days=(True, True, True, True, True, True, True), enabled=True)
+        self.assertTrue(alarm_mgr.is_alarm_running(alarm_id))
+        self.assertTrue(alert_event.wait(5))
+        # The alert has been executed by the dispatcher and published
+        self.assertEqual(alarm_mgr.get_alert_stats()['executed'], 1)
+        self.assertIn(('alert', alarm_id),
+                      [(event['type'], event['id'])
+                       for event in alarm_mgr.get_events(timeout=5)])
+        alarm_mgr._AlarmManager__scheduler.stop()
+        alarm_mgr._AlarmManager__scheduler.join(5)
+
+    def test_alert_dispatcher_options(self):
+        """
+        Checks the alert queue options are passed to the dispatcher when it is
+        restarted, and that they are reported if the running shared dispatcher
+        does not use them.
+        """
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+            AlarmManager()
+            alarm_mgr = AlarmManager(
+                alert_queue_size=1, alert_ordering=AlertDispatcher.PRIORITY,
+                alert_coalesce_time=10)
+            self.assertIn('alert queue options', test_srderr.getvalue())
+        alarm_mgr._AlarmManager__dispatcher.stop()
+        alarm_mgr._AlarmManager__dispatcher.join(5)
+        with mock.patch('LightUpAlarm.AlarmManager.AlertDispatcher') as \
+                mock_dispatcher:
+            mock_dispatcher.return_value.isAlive.return_value = False
+            alarm_mgr._AlarmManager__start_dispatcher()
+        mock_dispatcher.assert_called_once_with(
+            event_feed=mock.ANY, clock=mock.ANY, max_size=1,
+            ordering=AlertDispatcher.PRIORITY, coalesce_time=10)
+
+        # Queue alerts while the dispatcher is executing a blocking one
+        alarm_mgr._AlarmManager__start_dispatcher()
+        dispatcher = alarm_mgr._AlarmManager__dispatcher
+        release_event = threading.Event()
+        started_event = threading.Event()
+
+        def blocking_callback():
+            started_event.set()
+            release_event.wait(5)
+
+        alarm = AlarmItem(9, 30, enabled=True, alarm_id=96,
+                          days=(True, True, True, True, True, True, True))
+        callback = mock.Mock()
+        dispatcher.dispatch(alarm, blocking_callback)
+        self.assertTrue(started_event.wait(5))
+        with mock.patch('sys.stderr', new=io.StringIO()):
+            self.assertTrue(dispatcher.dispatch(alarm, callback))
+            self.assertTrue(dispatcher.dispatch(alarm, callback))
+            self.assertFalse(dispatcher.dispatch(alarm, mock.Mock()))
+        release_event.set()
+        self.assertTrue(dispatcher.wait_until_idle(5))
+        stats = alarm_mgr.get_alert_stats()
+        self.assertEqual(stats['coalesced'], 1)
+        self.assertEqual(stats['dropped'], 1)
+        self.assertEqual(callback.call_count, 1)
+        alarm_mgr.delete_all_alarms()
+        # Do not leave these options in the shared dispatcher
+        dispatcher.stop()
+        dispatcher.join(5)
+
+    def test_shared_dispatcher(self):
+        """
+        Checks all the instances share the same alert dispatcher thread, also
+        after it is restarted, except the ones with a VirtualClock.
+        """
+        first_mgr = AlarmManager()
+        first_mgr.delete_all_alarms()
+        numb_threads = threading.activeCount()
+        second_mgr = AlarmManager()
+        self.assertEqual(threading.activeCount(), numb_threads)
+        dispatcher = first_mgr._AlarmManager__dispatcher
+        self.assertIs(second_mgr._AlarmManager__dispatcher, dispatcher)
+
+        # A dead dispatcher is replaced once for all the instances
+        dispatcher.stop()
+        dispatcher.join(5)
+        self.assertFalse(second_mgr.check_threads_state())
+        self.assertFalse(first_mgr.check_threads_state())
+        self.assertTrue(first_mgr.check_threads_state())
+        self.assertIsNot(first_mgr._AlarmManager__dispatcher, dispatcher)
+        self.assertIs(first_mgr._AlarmManager__dispatcher,
+                      second_mgr._AlarmManager__dispatcher)
+        self.assertEqual(threading.activeCount(), numb_threads)
+
+        clock_mgr = AlarmManager(use_scheduler=True, clock=VirtualClock())
+        self.assertIsNot(clock_mgr._AlarmManager__dispatcher,
+                         first_mgr._AlarmManager__dispatcher)
+
+    def test_virtual_clock(self):
+        """
+        Adds, edits and deletes alarms in an AlarmManager with a VirtualClock,
+        which must not be blocked by the scheduler, and simulates the alerts.
+        """
+        # Monday 5th of January 2015 at 06:00:30
+        start_time = self.week_time(0, 6, 0) + 30
+        clock = VirtualClock(start_time)
+        callback = mock.Mock()
+        alarm_mgr = AlarmManager(alert_callback=callback,
+                                 offset_alert_callback=mock.Mock(),
+                                 use_scheduler=True, clock=clock)
+        every_day = (True, True, True, True, True, True, True)
+        # The scheduler is not started with a VirtualClock, so these calls
+        # cannot be blocked by it waiting for the next alert
+        alarm_mgr.delete_all_alarms()
+        alarm_ids = [
+            alarm_mgr.add_alarm(7, 0, every_day, True),
+            alarm_mgr.add_alarm(
+                8, 0, (True, False, False, False, False, False, False), True),
+            alarm_mgr.add_alarm(
+                9, 0, (False, True, False, False, False, False, False), True)]
+        alarm_mgr.edit_alarm(alarm_ids[0], minute=30)
+        alarm_mgr.delete_alarm(alarm_ids[1])
+        self.assertFalse(alarm_mgr._AlarmManager__scheduler.isAlive())
+        self.assertEqual(clock.time(), start_time)
+        self.assertTrue(alarm_mgr.is_alarm_running(alarm_ids[0]))
+        self.assertFalse(alarm_mgr.is_alarm_running(alarm_ids[1]))
+        self.assertTrue(alarm_mgr.check_threads_state())
+        # The next alarm is calculated from the virtual time
+        next_alarm = alarm_mgr.get_next_alarm(clock.time())
+        self.assertEqual((next_alarm.id_, next_alarm.next_alert),
+                         (alarm_ids[0], 90))
+
+        real_start = time.time()
+        self.assertTrue(alarm_mgr.simulate(start_time + (2 * 24 * 3600)))
+        self.assertTrue(
+            alarm_mgr._AlarmManager__dispatcher.wait_until_idle(5))
+        self.assertEqual(callback.call_count, 3)
+        # It can continue from where it stopped
+        self.assertTrue(alarm_mgr.simulate(start_time + (3 * 24 * 3600)))
+        self.assertTrue(
+            alarm_mgr._AlarmManager__dispatcher.wait_until_idle(5))
+        self.assertLess(time.time() - real_start, 10)
+        self.assertEqual(callback.call_count, 4)
+        self.assertEqual(
+            [(alert['id'], alert['time']) for alert in
+             clock.get_records('alert') if alert['offset'] is False],
+            [(alarm_ids[0], self.week_time(0, 7, 30)),
+             (alarm_ids[0], self.week_time(1, 7, 30)),
+             (alarm_ids[2], self.week_time(1, 9, 0)),
+             (alarm_ids[0], self.week_time(2, 7, 30))])
+        self.assertTrue(alarm_mgr.check_threads_state())
+        alarm_mgr.delete_all_alarms()
+
+        # Without a VirtualClock there is nothing to simulate
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+            self.assertFalse(AlarmManager().simulate(start_time))
+            self.assertNotEqual(test_srderr.getvalue(), '')
+
+    def test_alarm_cache(self):
+        """
+        Checks the alarms are read from the cache, which is kept in sync by the
+        AlarmManager edits, and optionally reloaded on database file changes.
+        """
+        alarm_mgr = AlarmManager()
+        self.create_alarms(alarm_mgr)
+        with mock.patch.object(AlarmDb, 'get_alarm') as mock_get_alarm, \
+                mock.patch.object(AlarmDb, 'get_all_alarms') as mock_get_all:
+            self.assertEqual(alarm_mgr.get_number_of_alarms(), 5)
+            self.assertEqual(len(alarm_mgr.get_all_enabled_alarms()), 5)
+            self.assertEqual(alarm_mgr.get_alarm(3).hour, 11)
+            self.assertIsNone(alarm_mgr.get_alarm(6))
+            self.assertEqual(alarm_mgr.get_next_alarm().enabled, True)
+            self.assertFalse(mock_get_alarm.called)
+            self.assertFalse(mock_get_all.called)
+
+        # Returned alarms are copies
+        alarm_mgr.get_alarm(3).hour = 12
+        self.assertEqual(alarm_mgr.get_alarm(3).hour, 11)
+
+        # Write through
+        alarm_mgr.edit_alarm(3, hour=12, label='edited')
+        self.assertEqual(alarm_mgr.get_alarm(3).hour, 12)
+        self.assertEqual(alarm_mgr.get_alarm(3).label, 'edited')
+        alarm = alarm_mgr.get_alarm(4)
+        alarm.minute = 0
+        self.assertTrue(AlarmManager.update_alarm(alarm))
+        self.assertEqual(alarm_mgr.get_alarm(4).minute, 0)
+        self.assertEqual(alarm_mgr.get_alarm(4).timestamp, alarm.timestamp)
+        alarm_mgr.delete_alarm(5)
+        self.assertIsNone(alarm_mgr.get_alarm(5))
+        self.assertEqual(alarm_mgr.get_number_of_alarms(), 4)
+        for alarm in alarm_mgr.get_all_alarms():
+            self.assertEqual(str(alarm), str(AlarmDb().get_alarm(alarm.id_)))
+
+        # Changes in the database file reload the cache, unless disabled, and
+        # creating a new instance does not change the class setting
+        AlarmDb().edit_alarm(1, label='bypass')
+        self.assertEqual(alarm_mgr.get_alarm(1).label, 'bypass')
+        with mock.patch.object(AlarmManager, 'reload_on_change', False):
+            other_mgr = AlarmManager()
+            self.assertFalse(AlarmManager.reload_on_change)
+            AlarmDb().edit_alarm(1, label='bypass again')
+            self.assertEqual(alarm_mgr.get_alarm(1).label, 'bypass')
+            self.assertEqual(other_mgr.get_alarm(1).label, 'bypass')
+        self.assertTrue(AlarmManager.reload_on_change)
+        self.assertEqual(alarm_mgr.get_alarm(1).label, 'bypass again')
+        alarm_mgr.delete_all_alarms()
+
+    def test_alarms_version(self):
+        """
+        Checks the alarms version changes on every alarm change, including
+        changes to the database file done outside of the AlarmManager.
+        """
+        alarm_mgr = AlarmManager()
+        self.create_alarms(alarm_mgr)
+        version = alarm_mgr.get_alarms_version()
+        alarm_mgr.get_all_alarms()
+        alarm_mgr.get_next_alarm()
+        self.assertEqual(alarm_mgr.get_alarms_version(), version)
+
+        for change in (lambda: alarm_mgr.add_alarm(9, 0),
+                       lambda: alarm_mgr.edit_alarm(1, label='edited'),
+                       lambda: alarm_mgr.delete_alarm(2),
+                       lambda: AlarmDb().edit_alarm(3, label='bypass')):
+            change()
+            self.assertNotEqual(alarm_mgr.get_alarms_version(), version)
+            version = alarm_mgr.get_alarms_version()
+        alarm_mgr.delete_all_alarms()
+
+    def test_events(self):
+        """
+        Checks the alarm changes are published as events, including changes
+        to the database file done outside of the AlarmManager.
+        """
+        alarm_mgr = AlarmManager()
+        self.create_alarms(alarm_mgr)
+        version = alarm_mgr.get_events_version()
+        self.assertEqual(alarm_mgr.get_events(version), [])
+
+        new_id = alarm_mgr.add_alarm(9, 0)
+        alarm_mgr.edit_alarm(1, label='edited')
+        alarm_mgr.delete_alarm(2)
+        alarm_mgr.delete_alarm(2)
+        events = alarm_mgr.get_events(version)
+        self.assertEqual([(event['type'], event['id']) for event in events],
+                         [('add', new_id), ('edit', 1), ('delete', 2)])
+
+        version = alarm_mgr.get_events_version()
+        AlarmDb().edit_alarm(3, label='bypass')
+        alarm_mgr.get_all_alarms()
+        events = alarm_mgr.get_events(version, timeout=5)
+        self.assertEqual([event['type'] for event in events], ['reload'])
+        alarm_mgr.delete_all_alarms()
+
 
 if __name__ == '__main__':
     unittest.main()
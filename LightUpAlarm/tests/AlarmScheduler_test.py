@@ -0,0 +1,259 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Unit test for the AlarmScheduler class.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+from __future__ import unicode_literals, absolute_import
+import io
+import time
+import mock
+import random
+import unittest
+import threading
+try:
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmScheduler import AlarmScheduler
+    from LightUpAlarm.AlarmClock import VirtualClock
+except ImportError:
+    import os
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlarmScheduler import AlarmScheduler
+    from LightUpAlarm.AlarmClock import VirtualClock
+
+
+class AlarmSchedulerTestCase(unittest.TestCase):
+    """ Tests for AlarmScheduler class. """
+
+    def setUp(self):
+        """
+        Sets the member variable hour to be far away enough so that we can
+        easily set up alarms without them triggering during test.
+        """
+        time_now = time.localtime(time.time())
+        self.hour = time_now.tm_hour - 1
+        if self.hour < 0:
+            self.hour = 23
+
+    def test_set_remove_alarm(self):
+        """ Tests the set_alarm, remove_alarm and is_scheduled methods. """
+        scheduler = AlarmScheduler()
+        alarm = AlarmItem(self.hour, 34, enabled=False, alarm_id=96,
+                          days=(True, True, True, True, True, True, True))
+
+        # Inactive alarms are not scheduled
+        self.assertFalse(scheduler.set_alarm(alarm))
+        self.assertFalse(scheduler.is_scheduled(alarm.id_))
+        self.assertIsNone(scheduler.get_next_alert_time())
+
+        # Active alarms are scheduled
+        alarm.enabled = True
+        self.assertTrue(scheduler.set_alarm(alarm, offset_alarm_time=-15))
+        self.assertTrue(scheduler.is_scheduled(alarm.id_))
+        self.assertEqual(scheduler.get_alarm_ids(), [96])
+        self.assertIsNotNone(scheduler.get_next_alert_time())
+
+        # Deactivating the alarm removes it
+        alarm.enabled = False
+        self.assertFalse(scheduler.set_alarm(alarm))
+        self.assertFalse(scheduler.is_scheduled(alarm.id_))
+        self.assertIsNone(scheduler.get_next_alert_time())
+
+        # Removing
+        alarm.enabled = True
+        scheduler.set_alarm(alarm)
+        self.assertTrue(scheduler.remove_alarm(alarm.id_))
+        self.assertFalse(scheduler.remove_alarm(alarm.id_))
+        self.assertEqual(scheduler.get_alarm_ids(), [])
+
+        # Remove all
+        scheduler.set_alarm(alarm)
+        scheduler.set_alarm(AlarmItem(
+            self.hour, 20, enabled=True, alarm_id=97,
+            days=(True, False, False, False, False, False, False)))
+        self.assertEqual(scheduler.get_alarm_ids(), [96, 97])
+        scheduler.remove_all_alarms()
+        self.assertEqual(scheduler.get_alarm_ids(), [])
+        self.assertIsNone(scheduler.get_next_alert_time())
+
+    def test_set_remove_alarms(self):
+        """ Tests the set_alarms and remove_alarms methods. """
+        scheduler = AlarmScheduler()
+        days = (True, True, True, True, True, True, True)
+        results = scheduler.set_alarms([
+            AlarmItem(self.hour, 10, enabled=True, alarm_id=1, days=days),
+            AlarmItem(self.hour, 20, enabled=False, alarm_id=2, days=days),
+            AlarmItem(self.hour, 30, enabled=True, alarm_id=3, days=days)],
+            offset_alarm_time=-5)
+        self.assertEqual(results, [True, False, True])
+        self.assertEqual(scheduler.get_alarm_ids(), [1, 3])
+
+        results = scheduler.remove_alarms([1, 2])
+        self.assertEqual(results, [True, False])
+        self.assertEqual(scheduler.get_alarm_ids(), [3])
+
+        # Setting and removing alarms in the same wake up
+        results = scheduler.set_alarms(
+            [AlarmItem(self.hour, 40, enabled=True, alarm_id=4, days=days)],
+            removed_ids=[3, 5])
+        self.assertEqual(results, [True])
+        self.assertEqual(scheduler.get_alarm_ids(), [4])
+
+    def test_next_alert_time(self):
+        """ Tests the next alert time is the start of the alarm minute. """
+        alarm = AlarmItem(11, 15, enabled=True, alarm_id=96,
+                          days=(True, False, False, False, False, False, False))
+        # Monday 5th of January 2015 at 10:30:45
+        from_time = time.mktime((2015, 1, 5, 10, 30, 45, 0, 5, -1))
+        expected = time.mktime((2015, 1, 5, 11, 15, 0, 0, 5, -1))
+        self.assertEqual(
+            AlarmScheduler.next_alert_time(alarm, from_time), expected)
+        # Within the alarm minute is still the same alert
+        from_time = time.mktime((2015, 1, 5, 11, 15, 59, 0, 5, -1))
+        self.assertEqual(
+            AlarmScheduler.next_alert_time(alarm, from_time), expected)
+        # The next minute goes to the following week
+        from_time = time.mktime((2015, 1, 5, 11, 16, 0, 0, 5, -1))
+        expected = time.mktime((2015, 1, 12, 11, 15, 0, 0, 12, -1))
+        self.assertEqual(
+            AlarmScheduler.next_alert_time(alarm, from_time), expected)
+        # No repeat days
+        alarm.monday = False
+        self.assertIsNone(AlarmScheduler.next_alert_time(alarm, from_time))
+
+    def test_alert(self):
+        """
+        Creates an alarm for the current minute and checks the scheduler thread
+        executes the callback. It then sets an offset alert for the current
+        minute, to check the offset callback is executed.
+        This test can take over 10 seconds in its worse case scenario.
+        """
+        alert_event = threading.Event()
+        offset_event = threading.Event()
+
+        # Set alarm for current minute, but only if there is at least 10 seconds
+        # left for this minute. Better than setting it for the next minute.
+        time_now = time.localtime(time.time())
+        while time_now.tm_sec > 50:
+            time.sleep(1)
+            time_now = time.localtime(time.time())
+
+        scheduler = AlarmScheduler(alarm_callback=alert_event.set,
+                                   offset_callback=offset_event.set)
+        scheduler.start()
+        scheduler.set_alarm(AlarmItem(
+            time_now.tm_hour, time_now.tm_min, enabled=True, alarm_id=96,
+            days=(True, True, True, True, True, True, True)))
+        self.assertTrue(alert_event.wait(5))
+        self.assertFalse(offset_event.is_set())
+
+        # Move the alarm a minute ahead with an offset alert for this minute
+        alert_event.clear()
+        alarm_time = time.localtime(time.time() + 60)
+        scheduler.set_alarm(
+            AlarmItem(alarm_time.tm_hour, alarm_time.tm_min, enabled=True,
+                      alarm_id=96,
+                      days=(True, True, True, True, True, True, True)),
+            offset_alarm_time=-1)
+        self.assertTrue(offset_event.wait(5))
+        self.assertFalse(alert_event.is_set())
+        scheduler.stop()
+        scheduler.join(5)
+        self.assertFalse(scheduler.isAlive())
+
+    def test_alert_callback_error(self):
+        """
+        Checks an exception in the callback is reported to stderr and does not
+        stop the scheduler thread.
+        """
+        def bad_callback(one, two, three):
+            pass
+
+        time_now = time.localtime(time.time())
+        while time_now.tm_sec > 50:
+            time.sleep(1)
+            time_now = time.localtime(time.time())
+
+        scheduler = AlarmScheduler(alarm_callback=bad_callback)
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+            scheduler.start()
+            scheduler.set_alarm(AlarmItem(
+                time_now.tm_hour, time_now.tm_min, enabled=True, alarm_id=96,
+                days=(True, True, True, True, True, True, True)))
+            time_passed = 0
+            while test_srderr.getvalue() == '' and time_passed < 5:
+                time.sleep(0.01)
+                time_passed += 0.01
+            self.assertNotEqual(test_srderr.getvalue(), '')
+        self.assertTrue(scheduler.isAlive())
+        # The alarm is scheduled again for the following week
+        self.assertTrue(scheduler.is_scheduled(96))
+        self.assertGreater(scheduler.get_next_alert_time(), time.time() + 60)
+        scheduler.stop()
+        scheduler.join(5)
+
+    def test_dispatch_offset_alert(self):
+        """
+        Checks the alerts are queued into the dispatcher with the ID of their
+        alarm and the offset flag.
+        """
+        # Monday 5th of January 2015 at 09:00:30
+        start_time = time.mktime((2015, 1, 5, 9, 0, 30, 0, 5, -1))
+        clock = VirtualClock(start_time)
+        dispatcher = mock.Mock()
+        scheduler = AlarmScheduler(dispatcher=dispatcher, clock=clock)
+        scheduler.set_alarm(
+            AlarmItem(10, 0, enabled=True, alarm_id=96,
+                      days=(True, False, False, False, False, False, False)),
+            offset_alarm_time=-15)
+        clock.run_until(start_time + 3600, scheduler.stop)
+        scheduler.run()
+        self.assertEqual(
+            [(call[1]['alarm_id'], call[1]['offset_flag'])
+             for call in dispatcher.dispatch.call_args_list],
+            [(96, True), (96, False)])
+
+    def test_virtual_clock_week(self):
+        """
+        Simulates a week of a large number of random alarms with a virtual
+        clock, and checks every alert is triggered once at its alarm minute.
+        """
+        rand = random.Random(1234)
+        alarms = []
+        for alarm_id in range(1, 3001):
+            days = tuple(rand.random() < 0.5 for _ in range(7))
+            alarms.append(AlarmItem(
+                rand.randint(1, 23), rand.randint(0, 59), days, enabled=True,
+                alarm_id=alarm_id))
+        # Monday 5th of January 2015 at 00:00:30
+        start_time = time.mktime((2015, 1, 5, 0, 0, 30, 0, 5, -1))
+        clock = VirtualClock(start_time)
+        callback = mock.Mock()
+        scheduler = AlarmScheduler(alarm_callback=callback, clock=clock)
+        scheduler.set_alarms(alarms)
+        clock.run_until(start_time + (7 * 24 * 3600), scheduler.stop)
+
+        real_start = time.time()
+        scheduler.run()
+        self.assertLess(time.time() - real_start, 30)
+
+        alerts = clock.get_records('alert')
+        expected_alerts = sum(sum(alarm.repeat) for alarm in alarms)
+        self.assertEqual(len(alerts), expected_alerts)
+        self.assertEqual(callback.call_count, expected_alerts)
+        for alert in alerts:
+            alert_time = time.localtime(alert['time'])
+            alarm = alarms[alert['id'] - 1]
+            self.assertEqual((alert_time.tm_hour, alert_time.tm_min,
+                              alert_time.tm_sec), (alarm.hour, alarm.minute, 0))
+            self.assertTrue(alarm.repeat[alert_time.tm_wday])
+
+
+if __name__ == '__main__':
+    unittest.main()
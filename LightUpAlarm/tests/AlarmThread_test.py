@@ -15,10 +15,10 @@ import io
 import time
 import mock
 import unittest
-from datetime import datetime, timedelta
 try:
     from LightUpAlarm.AlarmItem import AlarmItem
     from LightUpAlarm.AlarmThread import AlarmThread
+    from LightUpAlarm.AlarmClock import SystemClock, VirtualClock
 except ImportError:
     import os
     import sys
@@ -27,6 +27,7 @@ except ImportError:
     sys.path.insert(0, package_dir)
     from LightUpAlarm.AlarmItem import AlarmItem
     from LightUpAlarm.AlarmThread import AlarmThread
+    from LightUpAlarm.AlarmClock import SystemClock, VirtualClock
 
 
 class AlarmThreadTestCase(unittest.TestCase):
@@ -136,6 +137,89 @@ class AlarmThreadTestCase(unittest.TestCase):
             self.assertEqual(alarm_thread._AlarmThread__offset_alarm.minute,
                              new_minute + offset_minutes)
 
+    def run_with_clock(self, steps, *args, **kwargs):
+        """
+        Creates an AlarmThread with the input arguments and a clock following
+        the input steps, one per loop iteration, and runs its run method in the
+        current thread. The thread is stopped at the last step.
+        :param steps: List of (wall clock time, monotonic clock time) tuples.
+        :return: The AlarmThread instance, after running.
+        """
+        step = [0]
+        alarm_thread = []
+
+        def wall_clock():
+            return steps[min(step[0], len(steps) - 1)][0]
+
+        def monotonic_clock():
+            value = steps[step[0]][1]
+            step[0] += 1
+            if step[0] >= len(steps):
+                alarm_thread[0].stop()
+            return value
+
+        clock = mock.Mock(spec=SystemClock)
+        clock.time.side_effect = wall_clock
+        clock.monotonic.side_effect = monotonic_clock
+        alarm_thread.append(AlarmThread(*args, clock=clock, **kwargs))
+        alarm_thread[0].run()
+        return alarm_thread[0]
+
+    def test_missed_alert_policy(self):
+        """
+        Jumps the wall clock forward past an alert to check the missed alert
+        is triggered late with the CATCH_UP policy, and not with SKIP.
+        """
+        # Monday 5th of January 2015 at 09:59:30, alarm at 10:00 on Mondays
+        start_time = time.mktime((2015, 1, 5, 9, 59, 30, 0, 5, -1))
+        alarm_time = start_time + 30
+        steps = [(start_time, 0), (start_time + 330, 1)]
+
+        callback = mock.Mock()
+        alarm_thread = self.run_with_clock(
+            steps,
+            AlarmItem(10, 0, enabled=True, alarm_id=96,
+                      days=(True, False, False, False, False, False, False)),
+            alarm_callback=callback, missed_alert_policy=AlarmThread.CATCH_UP)
+        self.assertEqual(callback.call_count, 1)
+        stats = alarm_thread.get_alert_stats()
+        self.assertEqual(stats['alerts'], 1)
+        self.assertEqual(stats['caught_up'], 1)
+        self.assertEqual(stats['skipped'], 0)
+        self.assertEqual(stats['clock_jumps'], 1)
+        self.assertEqual(stats['lateness'], [start_time + 330 - alarm_time])
+
+        callback = mock.Mock()
+        alarm_thread = self.run_with_clock(
+            steps,
+            AlarmItem(10, 0, enabled=True, alarm_id=96,
+                      days=(True, False, False, False, False, False, False)),
+            alarm_callback=callback)
+        self.assertEqual(callback.call_count, 0)
+        stats = alarm_thread.get_alert_stats()
+        self.assertEqual(stats['alerts'], 0)
+        self.assertEqual(stats['skipped'], 1)
+        self.assertEqual(stats['lateness'], [])
+
+    def test_clock_jump_backwards(self):
+        """
+        Triggers an alert and then jumps the wall clock back before the alert,
+        which should trigger again as the alerts are recalculated.
+        """
+        # Monday 5th of January 2015 at 10:00:10, alarm at 10:00 on Mondays
+        start_time = time.mktime((2015, 1, 5, 10, 0, 10, 0, 5, -1))
+        callback = mock.Mock()
+        alarm_thread = self.run_with_clock(
+            [(start_time, 0), (start_time - 20, 1), (start_time - 5, 16)],
+            AlarmItem(10, 0, enabled=True, alarm_id=96,
+                      days=(True, False, False, False, False, False, False)),
+            alarm_callback=callback)
+        self.assertEqual(callback.call_count, 2)
+        stats = alarm_thread.get_alert_stats()
+        self.assertEqual(stats['alerts'], 2)
+        self.assertEqual(stats['clock_jumps'], 1)
+        self.assertEqual(stats['lateness'], [10, 5])
+
     def test_run(self):
         """
         Creates and alarm to trigger within a minute to instate AlarmThread,
@@ -156,39 +240,56 @@ class AlarmThreadTestCase(unittest.TestCase):
             """
             pass
 
-        # Set alarm for current minute, but only if there is at least 10seconds
-        # left for this minute. Better than setting it for the next minute.
-        time_now = time.localtime(time.time())
-        while time_now.tm_sec > 50:
-            time.sleep(1)
-            time_now = time.localtime(time.time())
-
+        # Monday 5th of January 2015 at 10:00:30, alarm at 10:00
+        start_time = time.mktime((2015, 1, 5, 10, 0, 30, 0, 5, -1))
         alarm_thread = AlarmThread(
             AlarmItem(
-                time_now.tm_hour, time_now.tm_min, enabled=True, alarm_id=96,
+                10, 0, enabled=True, alarm_id=96,
                 days=(True, True, True, True, True, True, True)),
             alarm_callback=bad_callback,
             offset_alarm_time=-1,
-            offset_callback=good_callback)
+            offset_callback=good_callback,
+            clock=VirtualClock(start_time))
         self.assertRaises(TypeError, alarm_thread.run)
         alarm_thread.stop()
 
         # This time test the pre/post alert
-        time_now = time.localtime(time.time())
-        while time_now.tm_sec > 50:
-            time.sleep(1)
-            time_now = time.localtime(time.time())
-
-        alarm_time = datetime.now() + timedelta(minutes=1)
         alarm_thread = AlarmThread(
             AlarmItem(
-                alarm_time.hour, alarm_time.minute, enabled=True, alarm_id=97,
+                10, 1, enabled=True, alarm_id=97,
                 days=(True, True, True, True, True, True, True)),
             alarm_callback=good_callback,
             offset_alarm_time=-1,
-            offset_callback=bad_callback)
+            offset_callback=bad_callback,
+            clock=VirtualClock(start_time))
         self.assertRaises(TypeError, alarm_thread.run)
 
+    def test_virtual_clock(self):
+        """
+        Runs an alarm, with an offset alert, for a simulated week and checks
+        all the alerts are recorded at their virtual time.
+        """
+        # Monday 5th of January 2015 at 09:00
+        start_time = time.mktime((2015, 1, 5, 9, 0, 0, 0, 5, -1))
+        clock = VirtualClock(start_time)
+        callback = mock.Mock()
+        alarm_thread = AlarmThread(
+            AlarmItem(10, 0, enabled=True, alarm_id=96,
+                      days=(True, False, True, False, True, False, False)),
+            alarm_callback=callback, offset_alarm_time=-15,
+            offset_callback=callback, clock=clock)
+        clock.run_until(start_time + (7 * 24 * 3600), alarm_thread.stop)
+        with mock.patch('sys.stdout', new=io.StringIO()):
+            alarm_thread.run()
+
+        self.assertEqual(callback.call_count, 6)
+        alerts = clock.get_records('alert')
+        self.assertEqual([alert['offset'] for alert in alerts],
+                         [True, False] * 3)
+        self.assertEqual([alert['time'] - start_time for alert in alerts],
+                         [2700, 3600, 2700 + 172800, 3600 + 172800,
+                          2700 + 345600, 3600 + 345600])
+        self.assertEqual(alarm_thread.get_alert_stats()['lateness'], [0] * 6)
 
 if __name__ == '__main__':
     unittest.main()
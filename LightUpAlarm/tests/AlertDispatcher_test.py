@@ -0,0 +1,177 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Unit test for the AlertDispatcher class.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+from __future__ import unicode_literals, absolute_import
+import io
+import time
+import mock
+import unittest
+import threading
+try:
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlertDispatcher import AlertDispatcher
+    from LightUpAlarm.AlarmEventFeed import AlarmEventFeed
+except ImportError:
+    import os
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpAlarm.AlarmItem import AlarmItem
+    from LightUpAlarm.AlertDispatcher import AlertDispatcher
+    from LightUpAlarm.AlarmEventFeed import AlarmEventFeed
+
+
+class AlertDispatcherTestCase(unittest.TestCase):
+    """ Tests for AlertDispatcher class. """
+
+    @staticmethod
+    def create_alarm(alarm_id):
+        return AlarmItem(9, 30, enabled=True, alarm_id=alarm_id,
+                         days=(True, True, True, True, True, True, True))
+
+    def dispatch_blocked(self, dispatcher, alerts):
+        """
+        Dispatches the alerts while the dispatcher thread is blocked executing a
+        first alert, so that they are all queued at the same time.
+        :param dispatcher: AlertDispatcher instance, not started.
+        :param alerts: List of (alarm ID, callback, priority) tuples.
+        """
+        release_event = threading.Event()
+        started_event = threading.Event()
+
+        def blocking_callback():
+            started_event.set()
+            release_event.wait(5)
+
+        dispatcher.start()
+        dispatcher.dispatch(self.create_alarm(1), blocking_callback)
+        self.assertTrue(started_event.wait(5))
+        for alarm_id, callback, priority in alerts:
+            dispatcher.dispatch(
+                self.create_alarm(alarm_id), callback, priority=priority)
+        release_event.set()
+        self.assertTrue(dispatcher.wait_until_idle(5))
+        dispatcher.stop()
+        dispatcher.join(5)
+
+    def test_order(self):
+        """ Checks the alerts are executed in FIFO and in priority order. """
+        for ordering, expected in ((AlertDispatcher.FIFO, [2, 3, 4]),
+                                   (AlertDispatcher.PRIORITY, [4, 2, 3])):
+            executed = []
+            alerts = [(2, lambda: executed.append(2), 1),
+                      (3, lambda: executed.append(3), 1),
+                      (4, lambda: executed.append(4), 0)]
+            self.dispatch_blocked(AlertDispatcher(ordering=ordering), alerts)
+            self.assertEqual(executed, expected)
+
+        # Invalid ordering defaults to FIFO
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+            AlertDispatcher(ordering='random')
+            self.assertNotEqual(test_srderr.getvalue(), '')
+
+    def test_coalesce(self):
+        """
+        Checks the alerts with the same callback queued together are merged,
+        and that the alerts are dropped when the queue is full.
+        """
+        callback = mock.Mock()
+        other_callback = mock.Mock()
+        dispatcher = AlertDispatcher(coalesce_time=60)
+        self.dispatch_blocked(dispatcher, [(2, callback, 0),
+                                           (3, callback, 0),
+                                           (4, other_callback, 0)])
+        self.assertEqual(callback.call_count, 1)
+        self.assertEqual(other_callback.call_count, 1)
+        stats = dispatcher.get_stats()
+        self.assertEqual(stats['dispatched'], 4)
+        self.assertEqual(stats['executed'], 3)
+        self.assertEqual(stats['coalesced'], 1)
+        self.assertEqual(stats['queue_depth'], 0)
+        self.assertEqual(stats['max_queue_depth'], 2)
+
+        # Without the dispatcher thread running nothing is executed
+        dispatcher = AlertDispatcher(max_size=2)
+        self.assertTrue(dispatcher.dispatch(self.create_alarm(2), callback))
+        self.assertTrue(dispatcher.dispatch(self.create_alarm(3), callback))
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+            self.assertFalse(
+                dispatcher.dispatch(self.create_alarm(4), callback))
+            self.assertNotEqual(test_srderr.getvalue(), '')
+        self.assertEqual(dispatcher.get_queue_depth(), 2)
+        self.assertEqual(dispatcher.get_stats()['dropped'], 1)
+
+    def test_event_feed(self):
+        """
+        Checks the executed alerts are published with the ID of their alarm,
+        including the offset alerts, which AlarmItem has no ID.
+        """
+        event_feed = AlarmEventFeed()
+        dispatcher = AlertDispatcher(event_feed=event_feed)
+        alarm = self.create_alarm(5)
+        offset_alarm = alarm.diff_alarm(-15)
+        self.assertIsNone(offset_alarm.id_)
+        callback = mock.Mock()
+        dispatcher.dispatch(offset_alarm, callback, priority=1, alarm_id=5,
+                            offset_flag=True)
+        dispatcher.dispatch(alarm, callback)
+        dispatcher.start()
+        self.assertTrue(dispatcher.wait_until_idle(5))
+        dispatcher.stop()
+        dispatcher.join(5)
+        self.assertEqual(
+            [(event['type'], event['id'], event['offset'])
+             for event in event_feed.get_events(0)],
+            [('alert', 5, True), ('alert', 5, False)])
+
+    def test_no_concurrent_callbacks(self):
+        """
+        Dispatches alerts from several threads at the same time and checks the
+        callbacks never overlap, and that a failing callback is reported and
+        does not stop the dispatcher.
+        """
+        running = []
+        overlaps = []
+
+        def callback():
+            running.append(1)
+            if len(running) > 1:
+                overlaps.append(1)
+            time.sleep(0.005)
+            running.pop()
+
+        def bad_callback(one, two, three):
+            pass
+
+        dispatcher = AlertDispatcher()
+        dispatcher.start()
+        threads = [threading.Thread(
+            target=dispatcher.dispatch, args=(self.create_alarm(i), callback))
+            for i in range(10)]
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+            dispatcher.dispatch(self.create_alarm(96), bad_callback)
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join(5)
+            self.assertTrue(dispatcher.wait_until_idle(5))
+            self.assertNotEqual(test_srderr.getvalue(), '')
+        self.assertEqual(overlaps, [])
+        self.assertTrue(dispatcher.isAlive())
+        stats = dispatcher.get_stats()
+        self.assertEqual(stats['executed'], 11)
+        self.assertGreaterEqual(stats['max_wait_time'], 0)
+        self.assertIsNotNone(stats['average_wait_time'])
+        dispatcher.stop()
+        dispatcher.join(5)
+        self.assertFalse(dispatcher.isAlive())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+#
+# Graph of hardware actions to run during an alarm alert, and the worker pool
+# that runs them.
+#
+# Copyright (c) 2015 carlosperate http://carlosperate.github.io
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# Each action is launched once its start offset has passed, all the actions it
+# depends on have finished, and its device is not already running as many
+# actions as its concurrency limit allows. Actions run on a bounded pool of
+# worker threads, reused across runs.
+#
+# The time can be read from a clock object instead of the system time, like
+# the LightUpAlarm AlarmClock classes, to simulate the runs in virtual time.
+#
+from __future__ import (unicode_literals, absolute_import, print_function,
+    division)
+import sys
+import time
+import threading
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+
+class HardwareAction(object):
+    """ Definition of a hardware action in an ActionGraph. """
+
+    def __init__(self, name, function, start, duration=None, depends_on=(),
+                 device=None):
+        """
+        HardwareAction initialiser.
+        :param name: Unique string to identify the action.
+        :param function: Function to run the action. It is called with the
+                         duration as its only argument, or without arguments
+                         if the duration is None.
+        :param start: Number of seconds from the start of the run to launch the
+                      action.
+        :param duration: Number of seconds the action should take, or None.
+        :param depends_on: Names of the actions that have to finish
+                           successfully before this one is launched.
+        :param device: String with the device the action controls, to apply
+                       its concurrency limit. Defaults to the action name.
+        """
+        self.name = name
+        self.function = function
+        self.start = start
+        self.duration = duration
+        self.depends_on = tuple(depends_on)
+        self.device = device if device is not None else name
+
+    def __repr__(self):
+        return '<HardwareAction %s, start %ss, duration %ss, depends on %s>' % \
+            (self.name, self.start, self.duration, list(self.depends_on))
+
+    def run(self):
+        if self.duration is None:
+            self.function()
+        else:
+            self.function(self.duration)
+
+
+class WorkerPool(object):
+    """
+    Bounded pool of daemon threads that run the submitted functions in order.
+    Threads are only created when all the existing ones are busy, and are kept
+    to be reused.
+    """
+
+    def __init__(self, max_workers=4):
+        """
+        WorkerPool initialiser.
+        :param max_workers: Maximum number of worker threads.
+        """
+        self.max_workers = max(max_workers, 1)
+        self.__queue = queue.Queue()
+        self.__lock = threading.Lock()
+        self.__workers = []
+        self.__idle_workers = 0
+
+    def submit(self, function, *args):
+        """
+        Queues a function to run in a worker thread.
+        :param function: Function to run.
+        :param args: Arguments for the function.
+        """
+        with self.__lock:
+            if self.__idle_workers > 0:
+                self.__idle_workers -= 1
+            elif len(self.__workers) < self.max_workers:
+                worker = threading.Thread(
+                    name='HardwareWorker-%s' % (len(self.__workers) + 1),
+                    target=self.__work)
+                worker.daemon = True
+                self.__workers.append(worker)
+                worker.start()
+            self.__queue.put((function, args))
+
+    def get_number_of_workers(self):
+        """ :return: Integer with the number of worker threads created. """
+        with self.__lock:
+            return len(self.__workers)
+
+    def __work(self):
+        while True:
+            function, args = self.__queue.get()
+            try:
+                function(*args)
+            except Exception as e:
+                print('ERROR: Hardware worker function failed: %s' % e,
+                      file=sys.stderr)
+            with self.__lock:
+                self.__idle_workers += 1
+
+
+class ActionGraph(object):
+    """
+    Set of HardwareActions, with their dependencies and the concurrency limit
+    of each device, that is run once.
+    """
+
+    def __init__(self, device_limits=None, default_device_limit=1,
+                 clock=None):
+        """
+        ActionGraph initialiser.
+        :param device_limits: Dictionary of device name -> maximum number of
+                              actions of that device running at the same time.
+        :param default_device_limit: Limit for the devices not in
+                                     device_limits.
+        :param clock: Optional clock object with the time, wait, hold, release
+                      and record methods of the LightUpAlarm AlarmClock
+                      classes. Defaults to the system time. The clock is held
+                      while each action runs, and the action launches and
+                      finishes are recorded in it as 'hardware' events.
+        """
+        self.__clock = clock
+        self.__actions = []
+        self.__device_limits = dict(device_limits or {})
+        self.__default_device_limit = default_device_limit
+        self.__condition = threading.Condition()
+        self.__cancelled = False
+        self.__running = {}
+        self.__finished = {}
+        self.__failed = set()
+        self.__lateness = {}
+
+    def add_action(self, action):
+        """
+        Adds an action to the graph.
+        :param action: HardwareAction instance.
+        :return: Boolean indicating if the action was added.
+        """
+        if action.name in [added.name for added in self.__actions]:
+            print('ERROR: Hardware action %s already exists.' % action.name,
+                  file=sys.stderr)
+            return False
+        self.__actions.append(action)
+        return True
+
+    def get_actions(self):
+        """ :return: List of the HardwareActions, in the order added. """
+        return list(self.__actions)
+
+    def validate(self):
+        """
+        Checks all dependencies exist and that they do not form a cycle.
+        :return: Boolean indicating if the graph can be run.
+        """
+        actions = dict((action.name, action) for action in self.__actions)
+        for action in self.__actions:
+            for dependency in action.depends_on:
+                if dependency not in actions:
+                    print('ERROR: Hardware action %s depends on unknown '
+                          'action %s.' % (action.name, dependency),
+                          file=sys.stderr)
+                    return False
+
+        # Depth first search, marking the actions visited in the current path
+        visited = {}
+
+        def has_cycle(name):
+            if visited.get(name) == 'path':
+                return True
+            if visited.get(name) == 'done':
+                return False
+            visited[name] = 'path'
+            if any(has_cycle(dependency)
+                   for dependency in actions[name].depends_on):
+                return True
+            visited[name] = 'done'
+            return False
+
+        for name in actions:
+            if has_cycle(name):
+                print('ERROR: Hardware action %s is in a dependency cycle.' %
+                      name, file=sys.stderr)
+                return False
+        return True
+
+    def cancel(self):
+        """
+        Stops the run from launching any more actions. The actions already
+        running are not stopped.
+        """
+        with self.__condition:
+            self.__cancelled = True
+            self.__condition.notify_all()
+
+    def is_cancelled(self):
+        with self.__condition:
+            return self.__cancelled
+
+    def get_lateness(self):
+        """
+        :return: Dictionary with the name of each action launched and the
+                 seconds it started after it was ready to (its start offset
+                 passed and its dependencies finished).
+        """
+        with self.__condition:
+            return dict(self.__lateness)
+
+    def run(self, start_time, end_time, pool):
+        """
+        Launches the actions as they become ready until the end time, or until
+        the run is cancelled. Actions not launched by the end time are skipped.
+        :param start_time: Time, in seconds since the epoch, the run started.
+        :param end_time: Time, in seconds since the epoch, to finish the run.
+        :param pool: WorkerPool to run the actions.
+        """
+        pending = sorted(self.__actions, key=lambda action: action.start)
+        with self.__condition:
+            while not self.__cancelled:
+                now = self.__time()
+                if now >= end_time:
+                    break
+                next_time = end_time
+                for action in list(pending):
+                    ready_time = self.__ready_time(action, start_time)
+                    if ready_time is None:
+                        continue
+                    if ready_time > now:
+                        next_time = min(next_time, ready_time)
+                        continue
+                    limit = self.__device_limits.get(
+                        action.device, self.__default_device_limit)
+                    if self.__running.get(action.device, 0) >= limit:
+                        continue
+                    pending.remove(action)
+                    self.__lateness[action.name] = now - ready_time
+                    self.__running[action.device] = \
+                        self.__running.get(action.device, 0) + 1
+                    if self.__clock is not None:
+                        self.__clock.record('hardware', action=action.name,
+                                            state='launched')
+                        self.__clock.hold()
+                    pool.submit(self.__run_action, action)
+                if self.__clock is not None:
+                    self.__clock.wait(self.__condition,
+                                      max(next_time - now, 0))
+                else:
+                    self.__condition.wait(max(next_time - now, 0))
+
+    def __time(self):
+        """ :return: Current time from the clock, or the system time. """
+        if self.__clock is not None:
+            return self.__clock.time()
+        return time.time()
+
+    def __ready_time(self, action, start_time):
+        """
+        :return: Time the action is ready to launch, or None if any of its
+                 dependencies has not finished or has failed.
+        """
+        ready_time = start_time + action.start
+        for dependency in action.depends_on:
+            if dependency not in self.__finished or \
+                    dependency in self.__failed:
+                return None
+            ready_time = max(ready_time, self.__finished[dependency])
+        return ready_time
+
+    def __run_action(self, action):
+        failed = False
+        try:
+            action.run()
+        except Exception as e:
+            failed = True
+            print('ERROR: Hardware action %s failed: %s' % (action.name, e),
+                  file=sys.stderr)
+        with self.__condition:
+            self.__running[action.device] -= 1
+            self.__finished[action.name] = self.__time()
+            if failed:
+                self.__failed.add(action.name)
+            if self.__clock is not None:
+                self.__clock.record('hardware', action=action.name,
+                                    state='failed' if failed else 'finished')
+                self.__clock.release()
+            self.__condition.notify_all()
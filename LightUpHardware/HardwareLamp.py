@@ -6,9 +6,17 @@
 #
 # Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
 #
+# The sunrise is rendered as a sequence of frames, each with the brightness and
+# the 8x8 pixel colours, computed before it starts and then shown at a fixed
+# frame rate. If numpy is installed the frames are computed as a single array.
+#
 from __future__ import unicode_literals, absolute_import, division
 import time
 import colorsys
+try:
+    import numpy
+except ImportError:
+    numpy = None
 try:
     import unicornhat
 except ImportError:
@@ -25,26 +33,156 @@ except ImportError:
 brightness_start = 0.1
 brightness_end = 0.9
 
+# Colours, as HSV, at the start and end of the sunrise, from a deep orange to
+# the yellowish colour
+hsv_start = (0.02, 0.9, 1.0)
+hsv_end = (0.108, 0.6, 1.0)
 
-def gradual_light_on(seconds):
-    sleep_time = seconds / 200.0
-    brightness_step = (brightness_end - brightness_start) / 200.0
-    brightness_level = brightness_start
-
-    # Set all the pixels to the yellowish colour
-    r, g, b = colorsys.hsv_to_rgb(0.108, 0.6, 1.0)
-    r = int(r * 255)
-    g = int(g * 255)
-    b = int(b * 255)
-    for y in range(8):
-        for x in range(8):
-            unicornhat.set_pixel(x, y, r, g, b)
-    unicornhat.brightness(brightness_start)
+# The bottom row leads the top row of the sunrise by this fraction of the time
+row_lead = 0.3
+
+# Target frames per second, and maximum number of frames of a sunrise
+frame_rate = 20
+max_frames = 600
+
+# Number of colours between the start and end colours
+palette_size = 256
+
+# Timing statistics of the last sunrise shown
+_frame_stats = {}
+
+
+def __palette():
+    """
+    :return: List of palette_size (r, g, b) tuples, from the start to the end
+             colour.
+    """
+    palette = []
+    for i in range(palette_size):
+        step = i / (palette_size - 1)
+        h, s, v = [start + (end - start) * step
+                   for start, end in zip(hsv_start, hsv_end)]
+        r, g, b = colorsys.hsv_to_rgb(h, s, v)
+        palette.append((int(r * 255), int(g * 255), int(b * 255)))
+    return palette
+
+
+def sunrise_frames(frame_count):
+    """
+    Computes the frames of a sunrise, the brightness increases linearly while
+    the colour of each row shifts from the start to the end colour, starting
+    from the bottom row.
+    :param frame_count: Number of frames, at least 2.
+    :return: Tuple with the list of brightness levels of each frame, and the
+             pixels of all the frames, indexed as [frame][y][x] -> (r, g, b).
+             The pixels are a numpy uint8 array if numpy is installed.
+    """
+    frame_count = max(frame_count, 2)
+    brightness = [brightness_start +
+                  (brightness_end - brightness_start) * i / (frame_count - 1)
+                  for i in range(frame_count)]
+    # Row 0 is the top row, so the lead grows towards the bottom row 7
+    leads = [row_lead * y / 7 for y in range(8)]
+
+    if numpy is not None:
+        progress = numpy.linspace(0.0, 1.0, frame_count)
+        row_progress = numpy.clip(
+            (progress[:, None] * (1 + row_lead) - row_lead) +
+            numpy.array(leads)[None, :], 0.0, 1.0)
+        indexes = numpy.rint(row_progress * (palette_size - 1)).astype(int)
+        colours = numpy.array(__palette(), dtype=numpy.uint8)[indexes]
+        pixels = numpy.repeat(colours[:, :, None, :], 8, axis=2)
+        return brightness, pixels
+
+    palette = __palette()
+    pixels = []
+    for i in range(frame_count):
+        progress = i / (frame_count - 1)
+        frame = []
+        for y in range(8):
+            row_progress = min(max(
+                progress * (1 + row_lead) - row_lead + leads[y], 0.0), 1.0)
+            colour = palette[int(round(row_progress * (palette_size - 1)))]
+            frame.append([colour] * 8)
+        pixels.append(frame)
+    return brightness, pixels
+
+
+def show_frame(brightness, pixels):
+    """
+    Shows a frame in the Unicorn Hat.
+    :param brightness: Float with the brightness level, 0 to 1.
+    :param pixels: Pixels of the frame, indexed as [y][x] -> (r, g, b).
+    """
+    unicornhat.brightness(brightness)
+    if hasattr(unicornhat, 'set_pixels'):
+        unicornhat.set_pixels(pixels)
+    else:
+        for y in range(8):
+            for x in range(8):
+                r, g, b = pixels[y][x]
+                unicornhat.set_pixel(x, y, int(r), int(g), int(b))
     unicornhat.show()
 
-    # Increase brightness gradually
-    while brightness_level < brightness_end:
-        unicornhat.brightness(brightness_level)
-        unicornhat.show()
-        brightness_level += brightness_step
-        time.sleep(sleep_time)
+
+def render(brightness, pixels, seconds):
+    """
+    Shows the frames evenly spread over the given time, the last frame is shown
+    at the end. If a frame is late by a whole frame interval or more it is
+    dropped, and the latest frame due is shown instead.
+    Its timing statistics can be retrieved with get_frame_stats.
+    :param brightness: List with the brightness level of each frame.
+    :param pixels: Pixels of each frame, indexed as [frame][y][x] -> (r, g, b).
+    :param seconds: Time in seconds for all the frames to be shown.
+    """
+    global _frame_stats
+    frame_count = len(brightness)
+    interval = seconds / max(frame_count - 1, 1)
+    stats = {'frames': frame_count, 'shown': 0, 'dropped': 0,
+             'max_lateness': 0.0, 'average_lateness': 0.0}
+    total_lateness = 0.0
+
+    start_time = time.time()
+    frame = 0
+    while frame < frame_count:
+        frame_time = start_time + frame * interval
+        sleep_time = frame_time - time.time()
+        if sleep_time > 0:
+            time.sleep(sleep_time)
+        # Skip to the latest frame due if behind schedule
+        due_frame = min(int((time.time() - start_time) / interval)
+                        if interval > 0 else frame_count - 1,
+                        frame_count - 1)
+        if due_frame > frame:
+            stats['dropped'] += due_frame - frame
+            frame = due_frame
+            frame_time = start_time + frame * interval
+        lateness = max(time.time() - frame_time, 0.0)
+        show_frame(brightness[frame], pixels[frame])
+        stats['shown'] += 1
+        stats['max_lateness'] = max(stats['max_lateness'], lateness)
+        total_lateness += lateness
+        frame += 1
+    stats['average_lateness'] = total_lateness / max(stats['shown'], 1)
+    _frame_stats = stats
+
+
+def get_frame_stats():
+    """
+    :return: Dictionary with the timing statistics of the last sunrise: the
+             number of 'frames', how many were 'shown' and 'dropped', and the
+             'max_lateness' and 'average_lateness' in seconds of the frames
+             shown.
+    """
+    return dict(_frame_stats)
+
+
+def gradual_light_on(seconds):
+    """
+    Gradually increases the lamp brightness and shifts its colour, like a
+    sunrise, in inputted amount of time.
+    :param seconds: Time in seconds for the entire procedure to take.
+    """
+    frame_count = int(min(max(seconds * frame_rate, 2), max_frames))
+    brightness, pixels = sunrise_frames(frame_count)
+    render(brightness, pixels, seconds)
@@ -19,25 +19,75 @@ BRIDGE_IP = '192.168.0.10'
 ROOM_LIGHT_BULB_ID = 4
 
 
+# Brightness range of the ramp, the bridge accepts values from 0 to 254
+RAMP_START_BRIGHTNESS = 0
+RAMP_END_BRIGHTNESS = 253
+
+# The bridge transitiontime is an unsigned 16 bit number of deciseconds
+MAX_TRANSITION_TIME = 65535
+
+# Longest time, in seconds, a single ramp transition is left to the bridge
+KEYFRAME_INTERVAL = 600
+
+
+def ramp_keyframes(seconds, start=RAMP_START_BRIGHTNESS,
+                   end=RAMP_END_BRIGHTNESS,
+                   keyframe_interval=KEYFRAME_INTERVAL):
+    """
+    Splits a brightness ramp into the transitions sent to the bridge. The
+    bridge fades linearly between keyframes, so the ramp has the same shape as
+    a brightness step every (seconds / (end - start)) seconds.
+    Ramps longer than the keyframe interval, or the bridge transition time
+    limit, are chained as several transitions of the same length.
+    :param seconds: Time in seconds for the entire ramp to take.
+    :param start: Brightness at the start of the ramp.
+    :param end: Brightness at the end of the ramp.
+    :param keyframe_interval: Maximum time in seconds for each transition.
+    :return: List of (brightness, transition time in deciseconds, end time in
+             seconds from the start of the ramp) tuples.
+    """
+    total_time = max(int(round(seconds * 10)), 0)
+    max_transition = min(max(int(keyframe_interval * 10), 1),
+                         MAX_TRANSITION_TIME)
+    keyframe_count = max(-(-total_time // max_transition), 1)
+    keyframes = []
+    previous_time = 0
+    for i in range(1, keyframe_count + 1):
+        keyframe_time = (total_time * i) // keyframe_count
+        brightness = start + int(round((end - start) * i / keyframe_count))
+        keyframes.append((brightness, keyframe_time - previous_time,
+                          keyframe_time / 10.0))
+        previous_time = keyframe_time
+    return keyframes
+
+
 def gradual_light_on(seconds):
     """
     Gradually increases the light brightness from minimum to maximum in inputted
     amount of time.
+    The fade is carried out by the bridge using the transitiontime of each
+    request, so only a handful of requests are sent instead of one per
+    brightness step. This function still blocks until the ramp is finished.
     :param seconds: Time in seconds for the entire procedure to take.
     """
-    sleep_time = seconds / 255.0
-
-    light_bulb = Light(__connected_bridge(), ROOM_LIGHT_BULB_ID)
-    if light_bulb.reachable is False:
+    bridge = __connected_bridge()
+    state = bridge.get_light(ROOM_LIGHT_BULB_ID)
+    if state['state'].get('reachable') is False:
         print('Light %s switch is OFF' % ROOM_LIGHT_BULB_ID)
     else:
-        light_bulb.brightness = 0
-        if light_bulb.on is False:
-            light_bulb.on = True
+        bridge.set_light(ROOM_LIGHT_BULB_ID,
+                         {'on': True, 'bri': RAMP_START_BRIGHTNESS},
+                         transitiontime=0)
         print('Increasing the light brightness for %s seconds.' % seconds)
-        for x in range(1, 254):
-            time.sleep(sleep_time)
-            light_bulb.brightness = x
+        start_time = time.time()
+        for brightness, transition_time, end_time in ramp_keyframes(seconds):
+            bridge.set_light(ROOM_LIGHT_BULB_ID, {'bri': brightness},
+                             transitiontime=transition_time)
+            # Wait until the bridge finishes this transition before chaining
+            # the next one, based on the ramp start time to not drift
+            sleep_time = start_time + end_time - time.time()
+            if sleep_time > 0:
+                time.sleep(sleep_time)
 
 
 def __connected_bridge():
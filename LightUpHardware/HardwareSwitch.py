@@ -15,6 +15,7 @@
 #
 from __future__ import unicode_literals, absolute_import, print_function
 import sys
+import threading
 from time import sleep
 try:
     from LightUpHardware.pywemoswitch.WemoSwitch import WemoSwitch
@@ -25,20 +26,140 @@ except ImportError:
 # The Belkin Wemo Switch ip
 _coffee_switch_ip = '192.168.0.16'
 
+# Connected switch sessions, kept to reuse their keep-alive connection, and
+# the threads still connecting them, as dictionaries with the switch IP as key
+_sessions = {}
+_discovery_threads = {}
+_sessions_lock = threading.Lock()
+
+# The sessions are checked in the background every health_check_interval
+# seconds, and dropped if the switch does not answer, to reconnect on next use
+health_check_interval = 60
+_health_check_thread = None
+
+
+def discover_switch(input_switch_ip=None):
+    """
+    Connects to the switch in a background thread, so that it is ready by the
+    time it is needed. If there is already a session for the switch it is
+    checked instead, and replaced if the switch does not answer.
+    The next _get_switch call for the same IP waits for the discovery to finish
+    if it is still running.
+    :param input_switch_ip: String with the IP of the switch to connect. If
+                            none given it will use global default.
+    :return: The discovery Thread.
+    """
+    switch_ip = input_switch_ip or _coffee_switch_ip
+    with _sessions_lock:
+        discovery_thread = _discovery_threads.get(switch_ip)
+        if discovery_thread is None or not discovery_thread.is_alive():
+            discovery_thread = threading.Thread(
+                name='SwitchDiscoveryThread', target=__discover,
+                args=(switch_ip,))
+            discovery_thread.daemon = True
+            _discovery_threads[switch_ip] = discovery_thread
+            discovery_thread.start()
+    return discovery_thread
+
+
+def __discover(switch_ip):
+    with _sessions_lock:
+        switch = _sessions.get(switch_ip)
+    if switch is not None and _check_session(switch_ip, switch):
+        return
+    switch = _connect_switch(switch_ip)
+    if switch is not None:
+        __add_session(switch_ip, switch)
+
 
 def _get_switch(input_switch_ip=None):
     """
-    Connects to a network connected switch at the given IP, if an IP is not
-    given it uses the default defined as a global.
-    It connects to the switch and returns the Switch instance.
+    Gets the session of the network connected switch at the given IP, if an IP
+    is not given it uses the default defined as a global.
+    If there is no session yet it connects to the switch and keeps it, so that
+    next calls reuse the same instance and connection.
     :param input_switch_ip: String with the IP of the switch to connect. If
                             none given it will use global default.
+    :return: Connected WemoSwitch instance, or None if it could not connect.
     """
-    if input_switch_ip is not None:
-        switch_ip = input_switch_ip
-    else:
-        switch_ip = _coffee_switch_ip
+    switch_ip = input_switch_ip or _coffee_switch_ip
+
+    with _sessions_lock:
+        discovery_thread = _discovery_threads.pop(switch_ip, None)
+    if discovery_thread is not None:
+        discovery_thread.join()
+    with _sessions_lock:
+        switch = _sessions.get(switch_ip)
+    if switch is None:
+        switch = _connect_switch(switch_ip)
+        if switch is not None:
+            __add_session(switch_ip, switch)
+    return switch
+
+
+def __add_session(switch_ip, switch):
+    """ Keeps the switch session and starts the health check thread. """
+    global _health_check_thread
+    with _sessions_lock:
+        old_switch = _sessions.get(switch_ip)
+        if old_switch is not None and old_switch is not switch:
+            old_switch.close()
+        _sessions[switch_ip] = switch
+        if _health_check_thread is None:
+            _health_check_thread = threading.Thread(
+                name='SwitchHealthCheckThread', target=__health_check)
+            _health_check_thread.daemon = True
+            _health_check_thread.start()
+
 
+def __health_check():
+    """ Checks all the sessions periodically, until there are none left. """
+    global _health_check_thread
+    while True:
+        sleep(health_check_interval)
+        with _sessions_lock:
+            if not _sessions:
+                _health_check_thread = None
+                return
+            sessions = list(_sessions.items())
+        for switch_ip, switch in sessions:
+            _check_session(switch_ip, switch)
+
+
+def _check_session(switch_ip, switch):
+    """
+    Checks the switch answers a state request, if it does not the session is
+    dropped, so a new one is created the next time the switch is needed.
+    :param switch_ip: String with the IP of the switch.
+    :param switch: WemoSwitch instance of the session.
+    :return: Boolean indicating if the switch answered.
+    """
+    try:
+        alive = switch.get_state() != WemoSwitch.ERROR_STATE
+    except Exception:
+        alive = False
+    if alive is False:
+        switch.close()
+        with _sessions_lock:
+            if _sessions.get(switch_ip) is switch:
+                del _sessions[switch_ip]
+    return alive
+
+
+def _close_sessions():
+    """ Closes and drops all the switch sessions. """
+    with _sessions_lock:
+        for switch in _sessions.values():
+            switch.close()
+        _sessions.clear()
+
+
+def _connect_switch(switch_ip):
+    """
+    Connects to the switch at the given IP, retrying a few times.
+    :param switch_ip: String with the IP of the switch to connect.
+    :return: Connected WemoSwitch instance, or None if it could not connect.
+    """
     switch = WemoSwitch(switch_ip)
     counter = 0
     while (switch.connected is False) and (counter < 3):
@@ -88,15 +209,22 @@ def switch_off(input_switch=None):
 
 
 def safe_on():
-    """ Checks the state of the switch and only turns it ON if necessary. """
+    """
+    Checks the state of the switch and only turns it ON if it is OFF. If the
+    state cannot be read the switch is not changed.
+    """
     switch = _get_switch()
-    switch_is_on = switch.get_state()
-    if switch_is_on is False:
+    if switch is None:
+        return
+    switch_was_on, switch_is_on = switch.exchange_state(True)
+    if switch_was_on is False:
         print('Turning ON Switch.')
-        switch.turn_on()
-    else:
+    elif switch_was_on is True:
         print('WARNING: The Switch is already ON, state unchanged !',
               file=sys.stderr)
+    else:
+        print('ERROR: Could not read the Switch state, state unchanged !',
+              file=sys.stderr)
 
 
 def test_switch():
@@ -11,16 +11,18 @@ from __future__ import (unicode_literals, absolute_import, print_function,
 import sys
 import time
 import types
-import random
 import threading
 try:
     from LightUpHardware import HardwareLightBulb
     from LightUpHardware import HardwareSwitch
     from LightUpHardware import HardwareLamp
+    from LightUpHardware.HardwareActionGraph import \
+        ActionGraph, HardwareAction, WorkerPool
 except ImportError:
     import HardwareLightBulb
     import HardwareSwitch
     import HardwareLamp
+    from HardwareActionGraph import ActionGraph, HardwareAction, WorkerPool
 
 
 class HardwareThread(object):
@@ -42,9 +44,24 @@ class HardwareThread(object):
     __room_light_duration = None
     __coffee_time = None
     __total_time = None
-    __running = False
+    __running_lock = threading.Lock()
     __thread = None
-    __threads = []
+    __graph = None
+    __pool = None
+    __actions = []
+
+    # Seconds before the coffee time to start connecting to the switch
+    coffee_discovery_time = 60
+
+    # Maximum number of hardware actions running at the same time, and the
+    # dictionary of device -> maximum actions running at the same time on it,
+    # any other device runs one action at a time
+    max_workers = 4
+    device_limits = {}
+
+    # Optional clock object for the runs, like the LightUpAlarm AlarmClock
+    # classes, to simulate them in virtual time. None uses the system time
+    clock = None
 
     #
     # metaclass methods to apply singleton pattern and set accessors
@@ -174,9 +191,10 @@ class HardwareThread(object):
         cls.__room_light_duration = None
         cls.__coffee_time = None
         cls.__total_time = None
-        cls.__running = False
+        cls.__running_lock = threading.Lock()
         cls.__thread = None
-        cls.__threads = []
+        cls.__graph = None
+        cls.__actions = []
 
     #
     # Accesors
@@ -347,73 +365,134 @@ class HardwareThread(object):
     #
     @classmethod
     def _launch_lamp(cls):
-        """ Creates and starts the thread to gradually turn on lamp. """
-        t = threading.Thread(
-            name='LampThread',
-            target=HardwareLamp.gradual_light_on,
-            args=(cls.lamp_duration,))
-        t.daemon = True
-        cls.__threads.append(t)
-        t.start()
+        """ Gradually turns on the lamp, runs in a worker thread. """
+        HardwareLamp.gradual_light_on(cls.lamp_duration)
 
     @classmethod
     def _launch_room_light(cls):
+        """ Gradually turns on the room light, runs in a worker thread. """
+        HardwareLightBulb.gradual_light_on(cls.room_light_duration)
+
+    @classmethod
+    def _launch_coffee(cls):
+        """ Turns on the coffee machine, runs in a worker thread. """
+        HardwareSwitch.safe_on()
+
+    @classmethod
+    def _prepare_coffee(cls):
         """
-        Creates and starts the thread to gradually turn on the room light.
+        Starts connecting to the coffee machine switch in the background, so
+        that it is ready by the coffee time.
         """
-        t = threading.Thread(
-            name='LightThread',
-            target=HardwareLightBulb.gradual_light_on,
-            args=(cls.room_light_duration,))
-        t.daemon = True
-        cls.__threads.append(t)
-        t.start()
+        HardwareSwitch.discover_switch()
 
     @classmethod
-    def _launch_coffee(cls):
-        """ Creates and starts the thread to turn on the coffee machine. """
-        t = threading.Thread(
-            name='SwitchThread',
-            target=HardwareSwitch.safe_on)
-        t.daemon = True
-        cls.__threads.append(t)
-        t.start()
+    def add_action(cls, name, function, start, duration=None, depends_on=(),
+                   device=None):
+        """
+        Adds a hardware action to run in every HardwareThread run, on top of
+        the lamp, room light and coffee ones ('lamp', 'room_light',
+        'coffee_discovery' and 'coffee'), which it can depend on.
+        :param name: Unique string to identify the action.
+        :param function: Function to run the action. It is called with the
+                         duration as its only argument, or without arguments
+                         if the duration is None.
+        :param start: Number of seconds from the start of the run to launch the
+                      action.
+        :param duration: Number of seconds the action should take, or None.
+        :param depends_on: Names of the actions that have to finish before this
+                           one is launched.
+        :param device: String with the device the action controls, to apply
+                       its limit in device_limits. Defaults to the name.
+        :return: Boolean indicating if the action was added.
+        """
+        if name in [action.name for action in cls.__default_actions()] or \
+                name in [action.name for action in cls.__actions]:
+            print('ERROR: Hardware action %s already exists.' % name,
+                  file=sys.stderr)
+            return False
+        cls.__actions = cls.__actions + [HardwareAction(
+            name, function, start, duration, depends_on, device)]
+        return True
+
+    @classmethod
+    def remove_action(cls, name):
+        """
+        Removes a hardware action added with add_action.
+        :param name: String with the name of the action.
+        :return: Boolean indicating if the action was found.
+        """
+        actions = [action for action in cls.__actions if action.name != name]
+        found = len(actions) != len(cls.__actions)
+        cls.__actions = actions
+        return found
+
+    @classmethod
+    def __default_actions(cls):
+        """ :return: List of the lamp, room light and coffee actions. """
+        return [
+            HardwareAction('lamp', cls._launch_lamp, cls.lamp_time),
+            HardwareAction('room_light', cls._launch_room_light,
+                           cls.room_light_time),
+            HardwareAction('coffee_discovery', cls._prepare_coffee,
+                           max((cls.coffee_time or 0) -
+                               cls.coffee_discovery_time, 0)),
+            HardwareAction('coffee', cls._launch_coffee, cls.coffee_time)]
+
+    @classmethod
+    def __create_graph(cls):
+        """
+        Creates the graph of hardware actions for a run.
+        :return: ActionGraph instance, or None if the actions are not valid.
+        """
+        graph = ActionGraph(cls.device_limits, clock=cls.clock)
+        for action in cls.__default_actions() + cls.__actions:
+            graph.add_action(action)
+        if graph.validate() is False:
+            return None
+        return graph
 
     @classmethod
     def __run(cls):
         """
-        Loop function to run as long as total_time indicates, in seconds.
-        It launches the individual hardware threads at the times indicated by
-        their variables.
+        Runs as long as total_time indicates, in seconds.
+        It launches the hardware actions in the worker pool as they become
+        ready, sleeping in between. It finishes early if the run is cancelled.
         """
-        start_time = time.time()
-        time_lamp = start_time + cls.lamp_time
-        time_room = start_time + cls.room_light_time
-        time_coffee = start_time + cls.coffee_time
+        start_time = cls.clock.time() if cls.clock is not None else \
+            time.time()
         end_time = start_time + cls.total_time
-        lamp_launched = False
-        room_launched = False
-        coffee_launched = False
-
-        # Time controlled loop to launch the required hardware functions
-        current_time = time.time()
-        while current_time < end_time:
-            if time_lamp < current_time and lamp_launched is False:
-                lamp_launched = True
-                cls._launch_lamp()
-            if time_room < current_time and room_launched is False:
-                room_launched = True
-                cls._launch_room_light()
-            if time_coffee < current_time and coffee_launched is False:
-                coffee_launched = True
-                cls._launch_coffee()
-            time.sleep(0.01)
-            current_time = time.time()
-
-        # Don't wait for the threads to join, as it would overrun the requested
-        # runtime. Ending this thread will kill its children (daemon=True).
-        print('HardwareThread run finished.')
-        cls.__running = False
+        if cls.__pool is None:
+            cls.__pool = WorkerPool(cls.max_workers)
+        cls.__pool.max_workers = cls.max_workers
+        cls.__graph.run(start_time, end_time, cls.__pool)
+
+        # Don't wait for the actions to finish, as it would overrun the
+        # requested runtime. The workers are daemon threads.
+        if cls.__graph.is_cancelled():
+            print('HardwareThread run cancelled.')
+        else:
+            print('HardwareThread run finished.')
+        cls.__running_lock.release()
+
+    @classmethod
+    def cancel(cls):
+        """
+        Cancels the current run, if any, so that the hardware actions not yet
+        launched are skipped. The actions already running are not stopped.
+        """
+        if cls.__graph is not None:
+            cls.__graph.cancel()
+
+    @classmethod
+    def get_lateness(cls):
+        """
+        :return: Dictionary with the name of each hardware action launched in
+                 the current or last run, and the seconds it started late.
+        """
+        if cls.__graph is None:
+            return {}
+        return cls.__graph.get_lateness()
 
     @classmethod
     def start(cls):
@@ -427,15 +506,18 @@ class HardwareThread(object):
         variables_ok = cls.check_variables()
         if variables_ok is False:
             return
+        graph = cls.__create_graph()
+        if graph is None:
+            return
 
-        # Setting a lock for safe reentry, not unlocked here, as it will exit as
-        # soon as the thread is launched, so unlocked at the end of cls.__run()
-        if cls.__running is True:
+        # Acquiring a lock for safe reentry, not released here, as it will exit
+        # as soon as the thread is launched, so released at the end of
+        # cls.__run()
+        if cls.__running_lock.acquire(False) is False:
             print("WARNING: LightUp Hardware already running, thread waiting.",
                   file=sys.stderr)
-            while cls.__running is True:
-                time.sleep(float(random.randint(1, 100)) / 1000.0)
-        cls.__running = True
+            cls.__running_lock.acquire()
+        cls.__graph = graph
 
         # Launch thread
         print('Running the Hardware Thread:\n\t'
@@ -14,11 +14,15 @@ I am in no way affiliated with the Philips organization.
 
 '''
 
+import collections
+import copy
 import json
 import os
 import platform
 import sys
 import socket
+import threading
+import time
 if sys.version_info[0] > 2:
     PY3K = True
 else:
@@ -81,6 +85,9 @@ class Light(object):
         self._reset_bri_after_on = None
         self._reachable = None
         self._type = None
+        # If True the state writes are queued and sent in the background,
+        # merged with any other pending write for this light
+        self.write_behind = False
 
     def __repr__(self):
         # like default python repr function, but add light name
@@ -105,6 +112,8 @@ class Light(object):
             if (args[0] == 'on' and args[1] is False) or (
                     kwargs.get('on', True) is False):
                 self._reset_bri_after_on = True
+        if self.write_behind:
+            kwargs['wait'] = False
         return self.bridge.set_light(self.light_id, *args, **kwargs)
 
     @property
@@ -396,6 +405,123 @@ class AllLights(Group):
         Group.__init__(self, bridge, 0)
 
 
+class _LightWriter(object):
+
+    """ Rate limiter and write-behind queue for the commands sent to a bridge
+
+    All the Bridge objects with the same ip share a _LightWriter. Commands are
+    spaced to stay within Bridge.commands_per_second. Queued light state
+    writes are sent from a background thread, and a write to a light that
+    still has a queued write is merged into it, so only the latest values are
+    sent. The thread finishes after connection_idle_timeout seconds without
+    writes, and is started again with the next one.
+
+    """
+    def __init__(self):
+        self.condition = threading.Condition()
+        # Ordered dictionary of state address -> [Bridge, state data]
+        self.pending = collections.OrderedDict()
+        self.sending = 0
+        self.next_slot = 0
+        self.thread = None
+        self.stats = {'sent': 0, 'failed': 0, 'queued': 0, 'merged': 0,
+                      'dropped': 0, 'throttled_time': 0.0}
+
+    def wait_for_slot(self):
+        """ Block until a command can be sent within the rate budget """
+        with self.condition:
+            rate = Bridge.commands_per_second
+            if not rate:
+                return
+            now = time.time()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + 1.0 / rate
+            wait_time = slot - now
+            self.stats['throttled_time'] += wait_time
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    def send(self, bridge, address, data):
+        """ Send a command right away, waiting for its slot first """
+        self.wait_for_slot()
+        try:
+            result = bridge.request('PUT', address, data)
+        except Exception:
+            with self.condition:
+                self.stats['failed'] += 1
+            raise
+        with self.condition:
+            self.stats['sent'] += 1
+        return result
+
+    def queue(self, bridge, address, data):
+        """ Queue a light state write, merging it with a pending one """
+        with self.condition:
+            self.stats['queued'] += 1
+            if address in self.pending:
+                pending = self.pending[address]
+                pending_data = pending[1]
+                # The transition time only applies to the latest write
+                if 'transitiontime' not in data:
+                    pending_data.pop('transitiontime', None)
+                superseded = all(key in data for key in pending_data
+                                 if key != 'transitiontime')
+                pending_data.update(data)
+                pending[0] = bridge
+                self.stats['dropped' if superseded else 'merged'] += 1
+            else:
+                self.pending[address] = [bridge, dict(data)]
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run)
+                self.thread.daemon = True
+                self.thread.start()
+            self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                if not self.pending:
+                    self.condition.wait(Bridge.connection_idle_timeout)
+                    if not self.pending:
+                        self.thread = None
+                        return
+            # Writes arriving while waiting for the slot are still merged
+            self.wait_for_slot()
+            with self.condition:
+                address, (bridge, data) = self.pending.popitem(last=False)
+                self.sending += 1
+            try:
+                bridge.request('PUT', address, json.dumps(data))
+                sent = True
+            except Exception:
+                logger.exception('Queued write to {} failed.'.format(address))
+                sent = False
+            with self.condition:
+                self.stats['sent' if sent else 'failed'] += 1
+                self.sending -= 1
+                self.condition.notify_all()
+
+    def flush(self, timeout=None):
+        """ Wait until all the queued writes have been sent """
+        end_time = None if timeout is None else time.time() + timeout
+        with self.condition:
+            while self.pending or self.sending:
+                if end_time is None:
+                    self.condition.wait(1)
+                else:
+                    wait_time = end_time - time.time()
+                    if wait_time <= 0:
+                        return False
+                    self.condition.wait(wait_time)
+            return True
+
+    def get_stats(self):
+        with self.condition:
+            stats = dict(self.stats)
+            stats['pending'] = len(self.pending) + self.sending
+            return stats
+
+
 class Bridge(object):
 
     """ Interface to the Hue ZigBee bridge
@@ -416,7 +542,48 @@ class Bridge(object):
 
 
 
+    HTTP connections to the bridge are kept alive and shared by all the Bridge
+    objects with the same ip, so consecutive requests (like a brightness ramp)
+    do not open a new connection each time. Idle connections are closed after
+    connection_idle_timeout seconds.
+
+    Commands sent with set_light are limited to commands_per_second for each
+    bridge (the bridge itself throttles at around 10 per second). With
+    set_light(..., wait=False), or a Light with write_behind set, the state
+    writes are queued instead, and pending writes to the same light are merged
+    so only the latest values are sent. get_write_stats reports how many
+    writes were sent, merged, or dropped as fully replaced by a later one.
+
+    The lights state is read with a single request for all the lights, and
+    cached for state_cache_ttl seconds or until a command is sent, so the Light
+    property getters do not send a request each. Pass fresh=True to get_light
+    to skip the cache. Light names are resolved to ids from the names in the
+    last state read, and only fetched again when a name is not found.
+
     """
+    # Dictionary of ip -> list of idle (HTTPConnection, last used time)
+    _connection_pools = {}
+    _connection_pools_lock = threading.Lock()
+    # Number of HTTP connections opened, for statistics
+    connections_opened = 0
+    connection_idle_timeout = 30
+    max_idle_connections = 4
+    # Dictionary of ip -> _LightWriter
+    _writers = {}
+    _writers_lock = threading.Lock()
+    # Maximum number of set_light commands per second to each bridge, the
+    # limit is disabled if set to 0 or None
+    commands_per_second = 10
+    # Dictionary of ip -> [read time, dictionary of all the lights state]
+    _state_caches = {}
+    # Dictionary of ip -> dictionary of light name -> light id
+    _light_ids_by_name = {}
+    # Dictionary of ip -> number of times the state cache has been invalidated
+    _state_invalidations = {}
+    _state_caches_lock = threading.Lock()
+    # Seconds the lights state is cached, disabled if set to 0 or None
+    state_cache_ttl = 2
+
     def __init__(self, ip=None, username=None, config_file_path=None):
         """ Initialization function.
 
@@ -462,30 +629,142 @@ class Bridge(object):
         self.request(
             'PUT', '/api/' + self.username + '/config', json.dumps(data))
 
-    def request(self, mode='GET', address=None, data=None):
-        """ Utility function for HTTP GET/PUT requests for the API"""
-        connection = httplib.HTTPConnection(self.ip, timeout=10)
+    def _get_connection(self):
+        """ Get an idle pooled connection to the bridge, or a new one.
 
-        try:
-            if mode == 'GET' or mode == 'DELETE':
-                connection.request(mode, address)
-            if mode == 'PUT' or mode == 'POST':
-                connection.request(mode, address, data)
+        Returns a tuple with the connection and a flag indicating if it has
+        been reused, as reused connections could have been closed by the bridge.
+        """
+        now = time.time()
+        with Bridge._connection_pools_lock:
+            pool = Bridge._connection_pools.setdefault(self.ip, [])
+            while pool:
+                connection, last_used = pool.pop()
+                if now - last_used < Bridge.connection_idle_timeout:
+                    return connection, True
+                connection.close()
+            Bridge.connections_opened += 1
+        return httplib.HTTPConnection(self.ip, timeout=10), False
+
+    def _release_connection(self, connection):
+        """ Return a connection to the pool, or close it if the pool is full """
+        with Bridge._connection_pools_lock:
+            pool = Bridge._connection_pools.setdefault(self.ip, [])
+            if len(pool) < Bridge.max_idle_connections:
+                pool.append((connection, time.time()))
+                return
+        connection.close()
 
-            logger.debug("{0} {1} {2}".format(mode, address, str(data)))
+    @classmethod
+    def close_connections(cls):
+        """ Close all the idle pooled connections """
+        with cls._connection_pools_lock:
+            for pool in cls._connection_pools.values():
+                for connection, last_used in pool:
+                    connection.close()
+            cls._connection_pools = {}
+
+    def _get_writer(self):
+        """ Get the _LightWriter shared by all the bridges with this ip """
+        with Bridge._writers_lock:
+            writer = Bridge._writers.get(self.ip)
+            if writer is None:
+                writer = Bridge._writers[self.ip] = _LightWriter()
+            return writer
+
+    def flush_light_writes(self, timeout=None):
+        """ Wait until the queued light state writes have been sent.
+
+        Returns False if the timeout, in seconds, expired before that.
+        """
+        return self._get_writer().flush(timeout)
 
-        except socket.timeout:
-            error = "{} Request to {}{} timed out.".format(mode, self.ip, address)
+    def get_write_stats(self):
+        """ Returns a dictionary with the statistics of the set_light commands
 
-            logger.exception(error)
-            raise PhueRequestTimeout(None, error)
+        sent, failed: commands sent to the bridge, or failed to send
+        queued: write-behind writes requested
+        merged: queued writes merged with a pending write to the same light
+        dropped: queued writes fully replaced by a later write before sending
+        pending: queued writes not sent yet
+        throttled_time: total seconds commands have waited for the rate limit
+        """
+        return self._get_writer().get_stats()
 
-        result = connection.getresponse()
-        connection.close()
+    def _get_lights_state(self, fresh=False):
+        """ Get the state of all the lights from the cache, or the bridge if it
+        is older than state_cache_ttl or fresh is True.
+
+        The returned dictionary is shared, it must not be modified.
+        """
+        with Bridge._state_caches_lock:
+            if not fresh and Bridge.state_cache_ttl:
+                cache = Bridge._state_caches.get(self.ip)
+                if cache is not None and \
+                        time.time() - cache[0] < Bridge.state_cache_ttl:
+                    return cache[1]
+            invalidations = Bridge._state_invalidations.get(self.ip, 0)
+        read_time = time.time()
+        lights = self.request('GET', '/api/' + self.username + '/lights/')
+        # Errors are returned as a list instead of a dictionary
+        if isinstance(lights, dict):
+            with Bridge._state_caches_lock:
+                Bridge._light_ids_by_name[self.ip] = dict(
+                    (light['name'], light_id)
+                    for light_id, light in lights.items())
+                # Do not cache a state read before a command was sent
+                if invalidations == \
+                        Bridge._state_invalidations.get(self.ip, 0):
+                    Bridge._state_caches[self.ip] = [read_time, lights]
+        return lights
+
+    def _invalidate_state_cache(self):
+        """ Discard the cached lights state, after a command has been sent """
+        with Bridge._state_caches_lock:
+            Bridge._state_caches.pop(self.ip, None)
+            Bridge._state_invalidations[self.ip] = \
+                Bridge._state_invalidations.get(self.ip, 0) + 1
+
+    def request(self, mode='GET', address=None, data=None):
+        """ Utility function for HTTP GET/PUT requests for the API"""
+        while True:
+            connection, reused = self._get_connection()
+            try:
+                if mode == 'GET' or mode == 'DELETE':
+                    connection.request(mode, address)
+                if mode == 'PUT' or mode == 'POST':
+                    connection.request(mode, address, data)
+
+                logger.debug("{0} {1} {2}".format(mode, address, str(data)))
+
+                result = connection.getresponse()
+                result_str = result.read()
+            except socket.timeout:
+                connection.close()
+                error = "{} Request to {}{} timed out.".format(mode, self.ip, address)
+
+                logger.exception(error)
+                raise PhueRequestTimeout(None, error)
+            except (socket.error, httplib.HTTPException):
+                connection.close()
+                # The bridge might have closed an idle connection, so try
+                # again once with a new one
+                if reused:
+                    logger.debug('Pooled connection to {} broken, '
+                                 'reconnecting.'.format(self.ip))
+                    continue
+                raise
+            break
+
+        if result.will_close:
+            connection.close()
+        else:
+            self._release_connection(connection)
+        if mode != 'GET':
+            self._invalidate_state_cache()
         if PY3K:
-            return json.loads(str(result.read(), encoding='utf-8'))
+            return json.loads(str(result_str, encoding='utf-8'))
         else:
-            result_str = result.read()
             logger.debug(result_str)
             return json.loads(result_str)
 
@@ -572,24 +851,31 @@ class Bridge(object):
                     'Error opening config file, will attempt bridge registration')
                 self.register_app()
 
-    def get_light_id_by_name(self, name):
-        """ Lookup a light id based on string name. Case-sensitive. """
-        lights = self.get_light()
-        for light_id in lights:
-            if PY3K:
-                if name == lights[light_id]['name']:
-                    return light_id
-            else:
-                if unicode(name, encoding='utf-8') == lights[light_id]['name']:
-                    return light_id
-        return False
+    def get_light_id_by_name(self, name, fresh=False):
+        """ Lookup a light id based on string name. Case-sensitive.
+
+        The names from the last lights state read are used, they are only
+        read again if the name is not found or fresh is True.
+        """
+        if not PY3K and isinstance(name, str):
+            name = unicode(name, encoding='utf-8')
+        if not fresh:
+            with Bridge._state_caches_lock:
+                light_id = Bridge._light_ids_by_name.get(
+                    self.ip, {}).get(name)
+            if light_id is not None:
+                return light_id
+        # The lights might have changed since the names were read
+        self._get_lights_state(fresh=True)
+        with Bridge._state_caches_lock:
+            return Bridge._light_ids_by_name.get(self.ip, {}).get(name, False)
 
     def get_light_objects(self, mode='list'):
         """Returns a collection containing the lights, either by name or id (use 'id' or 'name' as the mode)
         The returned collection can be either a list (default), or a dict.
         Set mode='id' for a dict by light ID, or mode='name' for a dict by light name.   """
         if self.lights_by_id == {}:
-            lights = self.request('GET', '/api/' + self.username + '/lights/')
+            lights = self._get_lights_state()
             for light in lights:
                 self.lights_by_id[int(light)] = Light(self, int(light))
                 self.lights_by_name[lights[light][
@@ -628,19 +914,27 @@ class Bridge(object):
         """ Returns the full api dictionary """
         return self.request('GET', '/api/' + self.username)
 
-    def get_light(self, light_id=None, parameter=None):
-        """ Gets state by light_id and parameter"""
+    def get_light(self, light_id=None, parameter=None, fresh=False):
+        """ Gets state by light_id and parameter
+
+        The state is read from the cached state of all the lights, unless it
+        is older than state_cache_ttl or fresh is True.
+        """
 
         if PY3K:
             if isinstance(light_id, str):
-                light_id = self.get_light_id_by_name(light_id)
+                light_id = self.get_light_id_by_name(light_id, fresh)
         else:
             if isinstance(light_id, str) or isinstance(light_id, unicode):
-                light_id = self.get_light_id_by_name(light_id)
+                light_id = self.get_light_id_by_name(light_id, fresh)
+        lights = self._get_lights_state(fresh)
         if light_id is None:
-            return self.request('GET', '/api/' + self.username + '/lights/')
-        state = self.request(
-            'GET', '/api/' + self.username + '/lights/' + str(light_id))
+            return copy.deepcopy(lights)
+        if isinstance(lights, dict) and str(light_id) in lights:
+            state = copy.deepcopy(lights[str(light_id)])
+        else:
+            state = self.request(
+                'GET', '/api/' + self.username + '/lights/' + str(light_id))
         if parameter is None:
             return state
         if parameter == 'name':
@@ -653,7 +947,8 @@ class Bridge(object):
                     'Not a valid key, parameter %s is not associated with light %s)'
                     % (parameter, light_id))
 
-    def set_light(self, light_id, parameter, value=None, transitiontime=None):
+    def set_light(self, light_id, parameter, value=None, transitiontime=None,
+                  wait=True):
         """ Adjust properties of one or more lights.
 
         light_id can be a single lamp or an array of lamps
@@ -665,6 +960,9 @@ class Bridge(object):
                          Use the Light class' transitiontime attribute if you want
                          persistent time settings.
 
+        wait : if False the state changes are queued and merged with any pending
+               change to the same light, returns an empty list
+
         """
         if isinstance(parameter, dict):
             data = parameter
@@ -682,11 +980,14 @@ class Bridge(object):
         else:
             if isinstance(light_id, int) or isinstance(light_id, str) or isinstance(light_id, unicode):
                 light_id_array = [light_id]
+        writer = self._get_writer()
         result = []
         for light in light_id_array:
             logger.debug(str(data))
             if parameter == 'name':
-                result.append(self.request('PUT', '/api/' + self.username + '/lights/' + str(
+                with Bridge._state_caches_lock:
+                    Bridge._light_ids_by_name.pop(self.ip, None)
+                result.append(writer.send(self, '/api/' + self.username + '/lights/' + str(
                     light_id), json.dumps(data)))
             else:
                 if PY3K:
@@ -699,8 +1000,12 @@ class Bridge(object):
                             converted_light = self.get_light_id_by_name(light)
                     else:
                         converted_light = light
-                result.append(self.request('PUT', '/api/' + self.username + '/lights/' + str(
-                    converted_light) + '/state', json.dumps(data)))
+                address = '/api/' + self.username + '/lights/' + str(
+                    converted_light) + '/state'
+                if not wait:
+                    writer.queue(self, address, data)
+                    continue
+                result.append(writer.send(self, address, json.dumps(data)))
             if 'error' in list(result[-1][0].keys()):
                 logger.warn("ERROR: {0} for light {1}".format(
                     result[-1][0]['error']['description'], light))
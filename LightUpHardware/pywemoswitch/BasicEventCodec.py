@@ -0,0 +1,131 @@
+#!/usr/bin/python2
+#
+# Encoder and decoder of the Belkin Wemo basicevent1 UPnP SOAP messages.
+#
+# Copyright (c) 2015 carlosperate http://carlosperate.github.io
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# The switch only needs two SOAP calls, GetBinaryState and SetBinaryState, so
+# the HTTP requests are composed once as bytes, and the responses are read
+# directly from the socket, only looking for the BinaryState element instead
+# of parsing the whole XML document.
+# As each request is complete bytes, several of them can be written together
+# to the same connection and their responses read in order (HTTP pipelining).
+#
+try:
+    from httplib import HTTPException
+except ImportError:
+    from http.client import HTTPException
+
+
+ERROR_STATE = -1
+
+SOAP_PATH = b'/upnp/control/basicevent1'
+
+SOAP_ENVELOPE = (
+    b'<?xml version="1.0" encoding="utf-8"?>'
+    b'<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+    b's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">'
+    b'<s:Body>%s</s:Body></s:Envelope>')
+
+BODY_GET = SOAP_ENVELOPE % (
+    b'<u:GetBinaryState xmlns:u="urn:Belkin:service:basicevent:1">'
+    b'</u:GetBinaryState>')
+
+BODY_SET = SOAP_ENVELOPE % (
+    b'<u:SetBinaryState xmlns:u="urn:Belkin:service:basicevent:1">'
+    b'<BinaryState>%s</BinaryState><Duration></Duration>'
+    b'<EndAction></EndAction><UDN></UDN></u:SetBinaryState>')
+
+BODY_ON = BODY_SET % b'1'
+BODY_OFF = BODY_SET % b'0'
+
+ACTION_GET = b'"urn:Belkin:service:basicevent:1#GetBinaryState"'
+ACTION_SET = b'"urn:Belkin:service:basicevent:1#SetBinaryState"'
+
+REQUEST_TEMPLATE = (
+    b'POST ' + SOAP_PATH + b' HTTP/1.1\r\n'
+    b'Host: %s\r\n'
+    b'Content-Type: text/xml; charset="utf-8"\r\n'
+    b'SOAPAction: %s\r\n'
+    b'Content-Length: %d\r\n'
+    b'Connection: keep-alive\r\n'
+    b'\r\n'
+    b'%s')
+
+STATE_TAG = b'<BinaryState>'
+
+
+def build_requests(server, port):
+    """
+    Composes the requests to the switch at the given address.
+    :param server: String with the IP of the switch.
+    :param port: Integer with the port of the switch.
+    :return: Dictionary with the 'get', 'on' and 'off' requests as bytes.
+    """
+    host = ('%s:%s' % (server, port)).encode('ascii')
+    return {
+        'get': REQUEST_TEMPLATE % (host, ACTION_GET, len(BODY_GET), BODY_GET),
+        'on': REQUEST_TEMPLATE % (host, ACTION_SET, len(BODY_ON), BODY_ON),
+        'off': REQUEST_TEMPLATE % (host, ACTION_SET, len(BODY_OFF), BODY_OFF)
+    }
+
+
+def read_response(stream):
+    """
+    Reads an HTTP response from a file-like object of the connection socket.
+    :param stream: File-like object to read the response from.
+    :return: Tuple with the integer status code, the body bytes, and a boolean
+             indicating if the switch will close the connection.
+    """
+    status_line = stream.readline()
+    parts = status_line.split(None, 2)
+    if len(parts) < 2 or not parts[0].startswith(b'HTTP/'):
+        raise HTTPException('Invalid status line: %r' % status_line)
+    status = int(parts[1])
+    will_close = parts[0] == b'HTTP/1.0'
+    content_length = None
+    while True:
+        line = stream.readline()
+        if not line:
+            raise HTTPException('Connection closed reading the headers')
+        if line in (b'\r\n', b'\n'):
+            break
+        name, _, value = line.partition(b':')
+        name = name.strip().lower()
+        if name == b'content-length':
+            content_length = int(value.strip())
+        elif name == b'connection':
+            will_close = value.strip().lower() == b'close'
+    if content_length is None:
+        body = stream.read()
+        will_close = True
+    else:
+        body = stream.read(content_length)
+        if len(body) < content_length:
+            raise HTTPException('Connection closed reading the body')
+    return status, body, will_close
+
+
+def parse_binary_state(body):
+    """
+    Finds the value of the first BinaryState element in the response body.
+    Wemo Insight switches add more values separated by '|' after the state.
+    :param body: Bytes of the response body.
+    :return: Boolean ON state of the switch, or ERROR_STATE (-1) if it is not
+             found or not valid.
+    """
+    start = body.find(STATE_TAG)
+    if start == -1:
+        return ERROR_STATE
+    start += len(STATE_TAG)
+    end = body.find(b'<', start)
+    if end == -1:
+        return ERROR_STATE
+    value = body[start:end].split(b'|', 1)[0].strip()
+    if value == b'1':
+        return True
+    elif value == b'0':
+        return False
+    return ERROR_STATE
@@ -11,72 +11,37 @@
 # A useful resource for the UPnP SOAP XML data:
 #   https://objectpartners.com/2014/03/25/a-groovy-time-with-upnp-and-wemo/
 #
+import os
+import json
 import socket
-from xml.dom import minidom
-import xml.etree.ElementTree as et
+import threading
 try:
-    from httplib import HTTPConnection
+    from httplib import HTTPConnection, HTTPException
 except ImportError:
-    from http.client import HTTPConnection
+    from http.client import HTTPConnection, HTTPException
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+try:
+    from LightUpHardware.pywemoswitch import BasicEventCodec
+except ImportError:
+    from pywemoswitch import BasicEventCodec
 
 
 class WemoSwitch(object):
     """ Sends and receives UPnP messages to a Belkin Wemo. """
 
-    ERROR_STATE = -1
+    ERROR_STATE = BasicEventCodec.ERROR_STATE
 
-    #
-    # UPnP SOAP XML strings to compose messages
-    #
-    body_top = """
-    <?xml version="1.0" encoding="utf-8"?>
-    <s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/">
-       <s:Body>
-    """
-
-    body_bottom = """
-       </s:Body>
-    </s:Envelope>
-    """
-
-    body_status = body_top + """
-          <u:GetBinaryState xmlns:u="urn:Belkin:service:basicevent:1"></u:GetBinaryState>
-    """ + body_bottom
-
-    body_on = body_top + """
-          <u:SetBinaryState xmlns:u="urn:Belkin:service:basicevent:1">
-             <BinaryState>1</BinaryState>
-             <Duration></Duration>
-             <EndAction></EndAction>
-             <UDN></UDN>
-          </u:SetBinaryState>
-    """ + body_bottom
-
-    body_off = body_top + """
-          <u:SetBinaryState xmlns:u="urn:Belkin:service:basicevent:1">
-             <BinaryState>0</BinaryState>
-             <Duration></Duration>
-             <EndAction></EndAction>
-             <UDN></UDN>
-          </u:SetBinaryState>
-    """ + body_bottom
-
-    headers_bot = {
-        "Content-Type": "text/xml; charset=\"utf-8\"",
-        "Accept": "",
-        "User-Agent": "",
-        "Connection": "close"
-    }
-
-    headers_get = dict(
-        list({"SOAPAction":
-                  "\"urn:Belkin:service:basicevent:1#GetBinaryState\""}.items())
-        + list(headers_bot.items()))
-
-    headers_set = dict(
-        list({"SOAPAction":
-                  "\"urn:Belkin:service:basicevent:1#SetBinaryState\""}.items())
-        + list(headers_bot.items()))
+    # Wemo ports can change, most users list ports in the range 49152-49155
+    ports = (49152, 49153, 49154, 49155)
+    probe_timeout = 0.5
+    request_timeout = 10
+
+    # File to remember the last working port of each switch IP
+    port_cache_path = os.path.join(os.path.expanduser('~'), '.wemo_ports')
+    __port_cache_lock = threading.Lock()
 
     #
     # metaclass methods
@@ -89,59 +54,146 @@ class WemoSwitch(object):
         """
         self.server = server
         self.connected = False
-        self.port = 49151
-
-        # Wemo ports can change, most user list ports in the range 49152-49155,
-        # so do a quick connection check and rotate if it fails
-        response_status = 0
-        while response_status != 200 and self.port < 49156:
-            self.port += 1
-            conn = HTTPConnection(self.server, self.port, timeout=0.5)
+        self.port = WemoSwitch.ERROR_STATE
+        # The SOAP requests share a keep-alive connection, opened when needed
+        self.__socket = None
+        self.__stream = None
+        self.__connection_lock = threading.Lock()
+        self.__requests = None
+
+        # The port that worked last time is checked first, if it fails all the
+        # other ports are checked at the same time
+        ports = list(WemoSwitch.ports)
+        cached_port = WemoSwitch.__read_port_cache().get(self.server)
+        if cached_port is not None:
+            if WemoSwitch.probe_port(self.server, cached_port):
+                self.port = cached_port
+            elif cached_port in ports:
+                ports.remove(cached_port)
+        if self.port == WemoSwitch.ERROR_STATE:
+            self.port = WemoSwitch.__probe_ports(self.server, ports)
+            if self.port != WemoSwitch.ERROR_STATE:
+                WemoSwitch.__write_port_cache(self.server, self.port)
+
+        # Check if the connection was successful and set it into self.connected
+        self.connected = self.port != WemoSwitch.ERROR_STATE
+        if self.connected:
+            self.__requests = BasicEventCodec.build_requests(
+                self.server, self.port)
+
+    #
+    # Port discovery methods
+    #
+    @staticmethod
+    def probe_port(server, port):
+        """
+        Checks if the Switch answers on the given port.
+        :param server: String with the IP of the Belkin Wemo Switch.
+        :param port: Integer with the port to check.
+        :return: Boolean indicating if the switch answered.
+        """
+        conn = HTTPConnection(server, port, timeout=WemoSwitch.probe_timeout)
+        try:
+            conn.request('GET', '/setup.xml')
+            return conn.getresponse().status == 200
+        except (socket.error, socket.timeout):
+            return False
+        finally:
+            conn.close()
+
+    @staticmethod
+    def __probe_ports(server, ports):
+        """
+        Checks all the given ports at the same time.
+        :return: Integer with the first port to answer, or ERROR_STATE if none
+                 of them did.
+        """
+        results = queue.Queue()
+        for port in ports:
+            probe = threading.Thread(
+                target=lambda p: results.put(
+                    (p, WemoSwitch.probe_port(server, p))),
+                args=(port,))
+            probe.daemon = True
+            probe.start()
+        for _ in ports:
+            port, answered = results.get()
+            if answered:
+                return port
+        return WemoSwitch.ERROR_STATE
+
+    @classmethod
+    def __read_port_cache(cls):
+        """ :return: Dictionary of switch IP -> last working port. """
+        with cls.__port_cache_lock:
+            try:
+                with open(cls.port_cache_path) as cache_file:
+                    return json.load(cache_file)
+            except (IOError, OSError, ValueError):
+                return {}
+
+    @classmethod
+    def __write_port_cache(cls, server, port):
+        """ Saves the working port of the switch, failures are ignored. """
+        cache = cls.__read_port_cache()
+        if cache.get(server) == port:
+            return
+        cache[server] = port
+        with cls.__port_cache_lock:
             try:
-                conn.request('GET', '/setup.xml')
-                response = conn.getresponse()
-                response_status = response.status
-            except socket.timeout:
-                #print('timeout port %s' % self.port)
+                with open(cls.port_cache_path, 'w') as cache_file:
+                    json.dump(cache, cache_file)
+            except (IOError, OSError):
                 pass
-        conn.close()
 
-        # Check if the connection was successful and set it into self.connected
-        if response_status == 200:
-            self.connected = True
-        else:
-            self.connected = False
-            self.port = WemoSwitch.ERROR_STATE
-
-    def __request(self, body, headers):
-        """
-        Creates an HTTP post request to the Switch with the given body and
-        headers.
-        :param body: POST message body
-        :param headers: POST message headers
-        :return: Boolean ON state of the switch. Returns -1 for Error state.
-        """
-        conn = HTTPConnection(self.server, self.port)
-        conn.request("POST", "/upnp/control/basicevent1", body, headers)
-        response = conn.getresponse()
-        state = WemoSwitch.ERROR_STATE
-        if response.status == 200:
-            # Parse the received XML and search for 'BinaryState' element
-            tree = et.fromstring(response.read().decode("utf-8"))
-            binary_state = tree.find('.//BinaryState')
-            if binary_state is not None:
-                state = binary_state.text
-            else:
-                state = WemoSwitch.ERROR_STATE
-        conn.close()
+    def __request(self, *request_names):
+        """
+        Sends the given requests to the Switch together on the same connection,
+        and reads their responses in order.
+        :param request_names: Names of the requests to send, 'get', 'on' or
+                              'off'.
+        :return: List with the Boolean ON state of the switch returned by each
+                 request. Contains -1 for Error state.
+        """
+        with self.__connection_lock:
+            while True:
+                reused = self.__socket is not None
+                if not reused:
+                    self.__socket = socket.create_connection(
+                        (self.server, self.port), WemoSwitch.request_timeout)
+                    self.__stream = self.__socket.makefile('rb')
+                try:
+                    self.__socket.sendall(b''.join(
+                        self.__requests[name] for name in request_names))
+                    responses = [BasicEventCodec.read_response(self.__stream)
+                                 for _ in request_names]
+                except (socket.error, HTTPException):
+                    self.__close_connection()
+                    # The switch might have closed an idle connection, so try
+                    # again once with a new one
+                    if reused:
+                        continue
+                    raise
+                break
+            if any(will_close for _, _, will_close in responses):
+                self.__close_connection()
+
         # 0 = off, 1 = on, -1 or Error = error
-        if state == '1':
-            state = True
-        elif state == '0':
-            state = False
-        else:
-            state = WemoSwitch.ERROR_STATE
-        return state
+        return [BasicEventCodec.parse_binary_state(body) if status == 200
+                else WemoSwitch.ERROR_STATE
+                for status, body, _ in responses]
+
+    def __close_connection(self):
+        if self.__socket is not None:
+            self.__stream.close()
+            self.__socket.close()
+            self.__socket = None
+            self.__stream = None
+
+    def close(self):
+        """ Closes the connection to the Switch, it is reopened if needed. """
+        with self.__connection_lock:
+            self.__close_connection()
 
     def get_state(self):
         """
@@ -150,8 +202,7 @@ class WemoSwitch(object):
                  occurred it returns WemoSwitch.ERROR_STATE (-1).
         """
         if self.connected is True:
-            return self.__request(
-                WemoSwitch.body_status, WemoSwitch.headers_get)
+            return self.__request('get')[0]
         else:
             return WemoSwitch.ERROR_STATE
 
@@ -162,7 +213,7 @@ class WemoSwitch(object):
                  occurred it returns WemoSwitch.ERROR_STATE (-1).
         """
         if self.connected is True:
-            return self.__request(WemoSwitch.body_on, WemoSwitch.headers_set)
+            return self.__request('on')[0]
         else:
             return WemoSwitch.ERROR_STATE
 
@@ -173,6 +224,23 @@ class WemoSwitch(object):
                  occurred it returns WemoSwitch.ERROR_STATE (-1).
         """
         if self.connected is True:
-            return self.__request(WemoSwitch.body_off, WemoSwitch.headers_set)
+            return self.__request('off')[0]
         else:
             return WemoSwitch.ERROR_STATE
+
+    def exchange_state(self, turn_on):
+        """
+        Gets the state of the Switch and only if it is the opposite to the
+        requested one it sets the new state, reusing the same connection. If
+        the state cannot be read the Switch is left unchanged.
+        :param turn_on: Boolean indicating if the switch should be turned ON or
+                        OFF.
+        :return: Tuple with the previous and new ON states of the switch, as
+                 Booleans, or WemoSwitch.ERROR_STATE (-1) for errors.
+        """
+        if self.connected is not True:
+            return WemoSwitch.ERROR_STATE, WemoSwitch.ERROR_STATE
+        previous_state = self.__request('get')[0]
+        if previous_state is (not turn_on):
+            return previous_state, self.__request('on' if turn_on else 'off')[0]
+        return previous_state, previous_state
@@ -0,0 +1,89 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Microbenchmark for the Wemo switch SOAP response parsing.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# Measures the per-call cost of reading the BinaryState of captured switch
+# responses with BasicEventCodec, and compares it against decoding the body and
+# parsing it with ElementTree (how WemoSwitch used to work).
+#
+from __future__ import unicode_literals, absolute_import, print_function
+import io
+import timeit
+import xml.etree.ElementTree as et
+try:
+    from LightUpHardware.pywemoswitch import BasicEventCodec
+except ImportError:
+    import os
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpHardware.pywemoswitch import BasicEventCodec
+
+
+# Number of calls to time per method
+iterations = 20000
+
+# Response bodies captured from a Wemo switch and a Wemo Insight switch
+captured_bodies = (
+    ('switch', b'<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/'
+               b'envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/'
+               b'encoding/"><s:Body>\n<u:GetBinaryStateResponse xmlns:u="urn:'
+               b'Belkin:service:basicevent:1">\r\n<BinaryState>1</BinaryState>'
+               b'\r\n</u:GetBinaryStateResponse>\r\n</s:Body> </s:Envelope>'),
+    ('insight', b'<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/'
+                b'envelope/" s:encodingStyle="http://schemas.xmlsoap.org/soap/'
+                b'encoding/"><s:Body>\n<u:SetBinaryStateResponse xmlns:u="urn'
+                b':Belkin:service:basicevent:1">\r\n<BinaryState>1|1446887411'
+                b'|0|0</BinaryState>\r\n<CountdownEndTime>0</CountdownEndTime>'
+                b'\r\n<deviceCurrentTime>1446887411</deviceCurrentTime>\r\n'
+                b'</u:SetBinaryStateResponse>\r\n</s:Body> </s:Envelope>'),
+)
+
+
+def etree_binary_state(body):
+    """ Reads the state building the ElementTree of the response. """
+    tree = et.fromstring(body.decode('utf-8'))
+    binary_state = tree.find('.//BinaryState')
+    return binary_state.text if binary_state is not None else None
+
+
+def read_and_parse(response):
+    """ Reads a full HTTP response and parses its state with the codec. """
+    status, body, will_close = BasicEventCodec.read_response(
+        io.BytesIO(response))
+    return BasicEventCodec.parse_binary_state(body)
+
+
+def time_per_call(function):
+    """
+    :param function: Function to time.
+    :return: Average time, in microseconds, of each call to the function.
+    """
+    function()  # warm up
+    return timeit.timeit(function, number=iterations) * 1e6 / iterations
+
+
+def main():
+    print('Average of %s calls:' % iterations)
+    for name, body in captured_bodies:
+        response = (b'HTTP/1.1 200 OK\r\nCONTENT-LENGTH: %d\r\n'
+                    b'CONTENT-TYPE: text/xml; charset="utf-8"\r\n\r\n' %
+                    len(body)) + body
+        results = (
+            ('ElementTree', lambda: etree_binary_state(body)),
+            ('BasicEventCodec', lambda: BasicEventCodec.parse_binary_state(
+                body)),
+            ('BasicEventCodec + HTTP', lambda: read_and_parse(response)),
+        )
+        for mode, function in results:
+            print('  %-8s %-25s %8.2f us' %
+                  (name, mode, time_per_call(function)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Unit test for the BasicEventCodec module.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+from __future__ import unicode_literals, absolute_import
+import io
+import unittest
+try:
+    from LightUpHardware.pywemoswitch import BasicEventCodec
+except ImportError:
+    import os
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpHardware.pywemoswitch import BasicEventCodec
+
+
+# Response captured from a Wemo switch
+GET_RESPONSE = (
+    b'HTTP/1.1 200 OK\r\n'
+    b'CONTENT-LENGTH: 285\r\n'
+    b'CONTENT-TYPE: text/xml; charset="utf-8"\r\n'
+    b'DATE: Sat, 07 Nov 2015 09:10:11 GMT\r\n'
+    b'EXT:\r\n'
+    b'SERVER: Unspecified, UPnP/1.0, Unspecified\r\n'
+    b'X-User-Agent: redsonic\r\n'
+    b'\r\n'
+    b'<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/" '
+    b's:encodingStyle="http://schemas.xmlsoap.org/soap/encoding/"><s:Body>\n'
+    b'<u:GetBinaryStateResponse xmlns:u="urn:Belkin:service:basicevent:1">\r\n'
+    b'<BinaryState>1</BinaryState>\r\n'
+    b'</u:GetBinaryStateResponse>\r\n'
+    b'</s:Body> </s:Envelope>')
+
+
+class BasicEventCodecTestCase(unittest.TestCase):
+    """ Tests for BasicEventCodec functions. """
+
+    def test_build_requests(self):
+        """ Checks the requests have the right headers and body length. """
+        requests = BasicEventCodec.build_requests('192.168.0.16', 49153)
+        for name, action, state in (('get', b'GetBinaryState', None),
+                                    ('on', b'SetBinaryState', b'1'),
+                                    ('off', b'SetBinaryState', b'0')):
+            head, body = requests[name].split(b'\r\n\r\n', 1)
+            self.assertIn(b'Host: 192.168.0.16:49153\r\n', head)
+            self.assertIn(b'#' + action + b'"', head)
+            self.assertIn(b'Content-Length: %d\r\n' % len(body), head)
+            if state is not None:
+                self.assertIn(b'<BinaryState>' + state + b'</BinaryState>',
+                              body)
+
+    def test_read_response(self):
+        """ Checks pipelined responses are read in order from the stream. """
+        off_response = GET_RESPONSE.replace(
+            b'<BinaryState>1', b'<BinaryState>0')
+        stream = io.BytesIO(GET_RESPONSE + off_response)
+        status, body, will_close = BasicEventCodec.read_response(stream)
+        self.assertEqual(status, 200)
+        self.assertEqual(len(body), 285)
+        self.assertFalse(will_close)
+        self.assertIs(BasicEventCodec.parse_binary_state(body), True)
+        status, body, will_close = BasicEventCodec.read_response(stream)
+        self.assertIs(BasicEventCodec.parse_binary_state(body), False)
+
+        # Without content length the body is read until the connection closes
+        stream = io.BytesIO(b'HTTP/1.1 500 Error\r\nConnection: close\r\n\r\n'
+                            b'<BinaryState>Error</BinaryState>')
+        status, body, will_close = BasicEventCodec.read_response(stream)
+        self.assertEqual(status, 500)
+        self.assertTrue(will_close)
+        self.assertEqual(BasicEventCodec.parse_binary_state(body),
+                         BasicEventCodec.ERROR_STATE)
+
+        for truncated in (b'', b'HTTP/1.1 200 OK\r\n', GET_RESPONSE[:-10]):
+            self.assertRaises(Exception, BasicEventCodec.read_response,
+                              io.BytesIO(truncated))
+
+    def test_parse_binary_state(self):
+        """ Checks the state values, including the Insight format. """
+        parse = BasicEventCodec.parse_binary_state
+        self.assertIs(parse(b'<BinaryState>1</BinaryState>'), True)
+        self.assertIs(parse(b'<BinaryState>0</BinaryState>'), False)
+        self.assertIs(parse(b'<BinaryState>1|1446887|0|0</BinaryState>'),
+                      True)
+        self.assertEqual(parse(b'<BinaryState>8</BinaryState>'), -1)
+        self.assertEqual(parse(b'<BinaryState>1'), -1)
+        self.assertEqual(parse(b'<s:Fault></s:Fault>'), -1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,201 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Unit test for the HardwareActionGraph module.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+from __future__ import unicode_literals, absolute_import
+import io
+import time
+import mock
+import unittest
+import threading
+try:
+    from LightUpHardware.HardwareActionGraph import \
+        ActionGraph, HardwareAction, WorkerPool
+    from LightUpAlarm.AlarmClock import VirtualClock
+except ImportError:
+    import os
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpHardware.HardwareActionGraph import \
+        ActionGraph, HardwareAction, WorkerPool
+    from LightUpAlarm.AlarmClock import VirtualClock
+
+
+class HardwareActionGraphTestCase(unittest.TestCase):
+    """ Tests for the ActionGraph and WorkerPool classes. """
+
+    def setUp(self):
+        self.lock = threading.Lock()
+        self.events = []
+
+    def recorder(self, name, sleep_time=0):
+        """ :return: Function that records its start and end times. """
+        def record(*args):
+            with self.lock:
+                self.events.append(('start', name, time.time(), args))
+            time.sleep(sleep_time)
+            with self.lock:
+                self.events.append(('end', name, time.time(), args))
+        return record
+
+    def event_time(self, kind, name):
+        for event_kind, event_name, event_time, _ in self.events:
+            if event_kind == kind and event_name == name:
+                return event_time
+        return None
+
+    def test_validate(self):
+        """ Checks unknown dependencies, cycles and duplicates are errors. """
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+            graph = ActionGraph()
+            self.assertTrue(graph.add_action(HardwareAction('a', None, 0)))
+            self.assertFalse(graph.add_action(HardwareAction('a', None, 1)))
+            graph.add_action(HardwareAction('b', None, 0, depends_on=['c']))
+            self.assertFalse(graph.validate())
+
+            graph.add_action(HardwareAction('c', None, 0, depends_on=['d']))
+            graph.add_action(HardwareAction('d', None, 0, depends_on=['b']))
+            self.assertFalse(graph.validate())
+            self.assertNotEqual(test_srderr.getvalue(), '')
+
+        graph = ActionGraph()
+        graph.add_action(HardwareAction('a', None, 0))
+        graph.add_action(HardwareAction('b', None, 0, depends_on=['a']))
+        graph.add_action(HardwareAction('c', None, 0, depends_on=['a', 'b']))
+        self.assertTrue(graph.validate())
+        self.assertEqual([action.name for action in graph.get_actions()],
+                         ['a', 'b', 'c'])
+
+    def test_run(self):
+        """
+        Checks the actions start at their offsets, after their dependencies,
+        with their durations, and that the device limits are applied.
+        """
+        graph = ActionGraph(device_limits={'lights': 2})
+        graph.add_action(HardwareAction(
+            'lamp', self.recorder('lamp', 0.3), 0, duration=5))
+        graph.add_action(HardwareAction(
+            'after_lamp', self.recorder('after_lamp'), 0,
+            depends_on=['lamp']))
+        graph.add_action(HardwareAction(
+            'late', self.recorder('late'), 0.2))
+        for name in ('light_1', 'light_2', 'light_3'):
+            graph.add_action(HardwareAction(
+                name, self.recorder(name, 0.2), 0, device='lights'))
+        graph.add_action(HardwareAction(
+            'never', self.recorder('never'), 2))
+        pool = WorkerPool(max_workers=6)
+
+        start_time = time.time()
+        graph.run(start_time, start_time + 1, pool)
+        self.assertAlmostEqual(time.time() - start_time, 1, delta=0.1)
+        self.assertEqual([e[3] for e in self.events if e[1] == 'lamp'],
+                         [(5,), (5,)])
+        self.assertGreaterEqual(self.event_time('start', 'after_lamp'),
+                                self.event_time('end', 'lamp'))
+        self.assertGreaterEqual(self.event_time('start', 'late'),
+                                start_time + 0.2)
+        self.assertEqual([e[3] for e in self.events if e[1] == 'late'],
+                         [(), ()])
+        # Only two lights at the same time
+        self.assertGreaterEqual(self.event_time('start', 'light_3'),
+                                min(self.event_time('end', 'light_1'),
+                                    self.event_time('end', 'light_2')))
+        self.assertIsNone(self.event_time('start', 'never'))
+
+        lateness = graph.get_lateness()
+        self.assertNotIn('never', lateness)
+        self.assertLess(lateness['lamp'], 0.1)
+        self.assertLess(lateness['after_lamp'], 0.1)
+        self.assertGreater(lateness['light_3'], 0.1)
+
+    def test_cancel_and_failure(self):
+        """
+        Checks a cancelled graph stops launching actions, and that the actions
+        depending on a failed action are not launched.
+        """
+        def fail():
+            raise Exception('Test failure')
+
+        graph = ActionGraph()
+        graph.add_action(HardwareAction('fail', fail, 0))
+        graph.add_action(HardwareAction(
+            'dependant', self.recorder('dependant'), 0, depends_on=['fail']))
+        graph.add_action(HardwareAction('late', self.recorder('late'), 0.5))
+        threading.Timer(0.2, graph.cancel).start()
+        start_time = time.time()
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+            graph.run(start_time, start_time + 5, WorkerPool())
+            self.assertIn('Test failure', test_srderr.getvalue())
+        self.assertLess(time.time() - start_time, 0.4)
+        self.assertTrue(graph.is_cancelled())
+        self.assertEqual(self.events, [])
+
+    def test_virtual_clock(self):
+        """
+        Runs an hour long graph with a virtual clock and checks the actions are
+        launched, and recorded, at their virtual times.
+        """
+        start_time = 1420416000
+        clock = VirtualClock(start_time)
+        graph = ActionGraph(clock=clock)
+        graph.add_action(HardwareAction(
+            'lamp', self.recorder('lamp'), 600, duration=300))
+        graph.add_action(HardwareAction(
+            'after_lamp', self.recorder('after_lamp'), 0,
+            depends_on=['lamp']))
+        graph.add_action(HardwareAction(
+            'light_1', self.recorder('light_1'), 1200, device='lights'))
+        graph.add_action(HardwareAction(
+            'light_2', self.recorder('light_2'), 1200, device='lights'))
+        graph.add_action(HardwareAction(
+            'never', self.recorder('never'), 3600))
+
+        real_start = time.time()
+        graph.run(start_time, start_time + 3600, WorkerPool())
+        self.assertLess(time.time() - real_start, 2)
+        self.assertEqual(clock.time(), start_time + 3600)
+        self.assertIsNone(self.event_time('start', 'never'))
+
+        records = clock.get_records('hardware')
+        self.assertEqual(
+            [(r['action'], r['state'], r['time'] - start_time)
+             for r in records if r['state'] == 'launched'],
+            [('lamp', 'launched', 600), ('after_lamp', 'launched', 600),
+             ('light_1', 'launched', 1200), ('light_2', 'launched', 1200)])
+        self.assertEqual(
+            sorted(r['action'] for r in records if r['state'] == 'finished'),
+            ['after_lamp', 'lamp', 'light_1', 'light_2'])
+        # The second light waits for the first one to finish
+        light_records = [r['action'] for r in records
+                         if r['action'].startswith('light')]
+        self.assertEqual(light_records,
+                         ['light_1', 'light_1', 'light_2', 'light_2'])
+
+    def test_worker_pool(self):
+        """ Checks the pool does not create more threads than needed. """
+        pool = WorkerPool(max_workers=2)
+        done = threading.Event()
+        for i in range(4):
+            pool.submit(self.recorder(i, 0.1))
+        pool.submit(done.set)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(pool.get_number_of_workers(), 2)
+        self.assertEqual(len(self.events), 8)
+
+        # Idle workers are reused
+        done.clear()
+        pool.submit(done.set)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(pool.get_number_of_workers(), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -11,8 +11,10 @@ from __future__ import unicode_literals, absolute_import
 import sys
 import unittest
 import time
+import mock
 try:
     from LightUpHardware.HardwareLamp import *
+    from LightUpHardware import HardwareLamp
 except ImportError:
     import os
     import sys
@@ -20,6 +22,7 @@ except ImportError:
     package_dir = os.path.dirname(os.path.dirname(file_dir))
     sys.path.insert(0, package_dir)
     from LightUpHardware.HardwareLamp import *
+    from LightUpHardware import HardwareLamp
 
 
 class HardwareSwitchTestCase(unittest.TestCase):
@@ -37,6 +40,61 @@ class HardwareSwitchTestCase(unittest.TestCase):
         gradual_light_on(run_time)
         end_time = time.time()
         self.assertAlmostEqual(start_time + run_time, end_time, delta=0.5)
+        stats = get_frame_stats()
+        self.assertEqual(stats['frames'], run_time * HardwareLamp.frame_rate)
+        self.assertEqual(stats['shown'] + stats['dropped'], stats['frames'])
+
+    def test_sunrise_frames(self):
+        """
+        Checks the frames brightness increases, and that the colour shifts
+        from the bottom row up to the end colour.
+        """
+        brightness, pixels = sunrise_frames(50)
+        self.assertEqual(len(brightness), 50)
+        self.assertEqual(len(pixels), 50)
+        self.assertAlmostEqual(brightness[0], HardwareLamp.brightness_start)
+        self.assertAlmostEqual(brightness[-1], HardwareLamp.brightness_end)
+        self.assertEqual(sorted(brightness), list(brightness))
+
+        def rgb(frame, y, x):
+            return tuple(int(c) for c in pixels[frame][y][x])
+        start_colour, end_colour = rgb(0, 0, 0), rgb(-1, 0, 0)
+        self.assertNotEqual(start_colour, end_colour)
+        for y in range(8):
+            for x in range(8):
+                self.assertEqual(rgb(0, y, x), start_colour)
+                self.assertEqual(rgb(-1, y, x), end_colour)
+        # Halfway the bottom row is further into the sunrise than the top
+        self.assertGreater(rgb(25, 7, 0)[1], rgb(25, 0, 0)[1])
+        self.assertEqual(rgb(25, 3, 0), rgb(25, 3, 7))
+
+    def test_render(self):
+        """
+        Checks the frames are shown in the given time, and that frames are
+        dropped when showing them takes longer than the frame interval.
+        """
+        brightness, pixels = sunrise_frames(21)
+        start_time = time.time()
+        render(brightness, pixels, 1)
+        self.assertAlmostEqual(time.time() - start_time, 1, delta=0.1)
+        stats = get_frame_stats()
+        self.assertEqual(stats['shown'], 21)
+        self.assertEqual(stats['dropped'], 0)
+        self.assertLess(stats['max_lateness'], 0.05)
+        self.assertEqual(unicornhat.brightness_level, brightness[-1])
+        self.assertEqual(unicornhat.pixels[0][0],
+                         tuple(int(c) for c in pixels[-1][0][0]))
+
+        def slow_show():
+            time.sleep(0.12)
+        with mock.patch.object(unicornhat, 'show', side_effect=slow_show):
+            start_time = time.time()
+            render(brightness, pixels, 1)
+            # Only the time to show the last frame is added at the end
+            self.assertAlmostEqual(time.time() - start_time, 1.12, delta=0.1)
+        stats = get_frame_stats()
+        self.assertGreater(stats['dropped'], 0)
+        self.assertEqual(stats['shown'] + stats['dropped'], 21)
 
 
 if __name__ == '__main__':
@@ -11,8 +11,10 @@ from __future__ import unicode_literals, absolute_import
 import sys
 import unittest
 import time
+import mock
 try:
     from LightUpHardware.HardwareLightBulb import *
+    from LightUpHardware import HardwareLightBulb
 except ImportError:
     import os
     import sys
@@ -20,6 +22,7 @@ except ImportError:
     package_dir = os.path.dirname(os.path.dirname(file_dir))
     sys.path.insert(0, package_dir)
     from LightUpHardware.HardwareLightBulb import *
+    from LightUpHardware import HardwareLightBulb
 
 
 class HardwareSwitchTestCase(unittest.TestCase):
@@ -39,6 +42,54 @@ class HardwareSwitchTestCase(unittest.TestCase):
         # Large delta due to the initial time required to connect
         self.assertAlmostEqual(start_time + run_time, end_time, delta=10)
 
+    def test_ramp_keyframes(self):
+        """
+        Checks the ramp is split into transitions no longer than the keyframe
+        interval or the bridge limit, adding up to the ramp time and brightness.
+        """
+        self.assertEqual(ramp_keyframes(60), [(253, 600, 60.0)])
+        self.assertEqual(ramp_keyframes(0), [(253, 0, 0.0)])
+        keyframes = ramp_keyframes(1500, start=0, end=100)
+        self.assertEqual(keyframes, [(33, 5000, 500.0), (67, 5000, 1000.0),
+                                     (100, 5000, 1500.0)])
+        # 10 hours ramp with no keyframe interval limit is chained
+        keyframes = ramp_keyframes(36000, keyframe_interval=10 ** 6)
+        self.assertEqual(len(keyframes), 6)
+        self.assertTrue(all(transition <= MAX_TRANSITION_TIME
+                            for _, transition, _ in keyframes))
+        self.assertEqual(sum(t for _, t, _ in keyframes), 360000)
+        self.assertEqual(keyframes[-1][0], RAMP_END_BRIGHTNESS)
+
+    def test_gradual_light_on_requests(self):
+        """
+        Checks the ramp is carried out with a few bridge requests, using a mock
+        bridge and sleep.
+        """
+        bridge = mock.MagicMock()
+        bridge.get_light.return_value = {'state': {'reachable': True}}
+        with mock.patch.object(HardwareLightBulb, 'Bridge',
+                               return_value=bridge), \
+                mock.patch.object(HardwareLightBulb.time, 'sleep') as sleep:
+            gradual_light_on(1800)
+        self.assertEqual(bridge.get_light.call_count, 1)
+        self.assertEqual(bridge.set_light.call_count, 4)
+        self.assertEqual(
+            bridge.set_light.call_args_list[0],
+            mock.call(ROOM_LIGHT_BULB_ID, {'on': True, 'bri': 0},
+                      transitiontime=0))
+        self.assertEqual(
+            bridge.set_light.call_args_list[-1],
+            mock.call(ROOM_LIGHT_BULB_ID, {'bri': 253}, transitiontime=6000))
+        self.assertEqual(sleep.call_count, 3)
+
+        # Nothing is sent if the light is not reachable
+        bridge.reset_mock()
+        bridge.get_light.return_value = {'state': {'reachable': False}}
+        with mock.patch.object(HardwareLightBulb, 'Bridge',
+                               return_value=bridge):
+            gradual_light_on(1800)
+        self.assertEqual(bridge.set_light.call_count, 0)
+
 
 if __name__ == '__main__':
     unittest.main()
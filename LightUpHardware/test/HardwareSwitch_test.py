@@ -12,9 +12,22 @@
 #
 from __future__ import unicode_literals, absolute_import
 import io
+import os
+import json
+import time
 import mock
+import socket
+import shutil
+import tempfile
 import unittest
+import threading
 from time import sleep
+try:
+    import BaseHTTPServer
+    import SocketServer
+except ImportError:
+    import http.server as BaseHTTPServer
+    import socketserver as SocketServer
 try:
     import LightUpHardware.HardwareSwitch as HardwareSwitch
     from LightUpHardware.pywemoswitch.WemoSwitch import WemoSwitch
@@ -114,5 +127,192 @@ class HardwareSwitchTestCase(unittest.TestCase):
         switch.turn_off()
 
 
+class SwitchRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """
+    Keep-alive handler that replies to the switch /setup.xml requests and the
+    basicevent1 SOAP requests, keeping the switch state in the server.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.connections += 1
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.server.soap_actions.append(self.headers['SOAPAction'])
+        if self.server.fail_requests:
+            self.send_response(500)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if b'SetBinaryState' in body:
+            self.server.state = 1 if b'<BinaryState>1' in body else 0
+        response = (
+            '<s:Envelope xmlns:s="http://schemas.xmlsoap.org/soap/envelope/">'
+            '<s:Body><u:GetBinaryStateResponse '
+            'xmlns:u="urn:Belkin:service:basicevent:1"><BinaryState>%s'
+            '</BinaryState></u:GetBinaryStateResponse></s:Body></s:Envelope>'
+            % self.server.state).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, *args):
+        pass
+
+
+class SwitchServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class SwitchDiscoveryTestCase(unittest.TestCase):
+    """
+    Tests for the switch port discovery, using a local server in place of the
+    switch, so it does not require the hardware.
+    """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.server = SwitchServer(('127.0.0.1', 0), SwitchRequestHandler)
+        self.server.connections = 0
+        self.server.soap_actions = []
+        self.server.state = 0
+        self.server.fail_requests = False
+        self.server_thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        # Listening sockets that never reply act as ports that time out
+        self.silent_sockets = []
+        for _ in range(3):
+            silent_socket = socket.socket()
+            silent_socket.bind(('127.0.0.1', 0))
+            silent_socket.listen(5)
+            self.silent_sockets.append(silent_socket)
+
+    def tearDown(self):
+        HardwareSwitch._close_sessions()
+        self.server.shutdown()
+        self.server.server_close()
+        for silent_socket in self.silent_sockets:
+            silent_socket.close()
+        shutil.rmtree(self.temp_dir)
+
+    def test_port_discovery(self):
+        """
+        Checks the ports are probed at the same time, and that the working
+        port is saved and tried first the next time.
+        """
+        server_port = self.server.server_address[1]
+        ports = [silent.getsockname()[1] for silent in self.silent_sockets]
+        ports.append(server_port)
+        cache_path = os.path.join(self.temp_dir, 'wemo_ports')
+        with mock.patch.object(WemoSwitch, 'ports', tuple(ports)), \
+                mock.patch.object(WemoSwitch, 'port_cache_path', cache_path):
+            start_time = time.time()
+            switch = WemoSwitch('127.0.0.1')
+            self.assertLess(time.time() - start_time,
+                            WemoSwitch.probe_timeout * 2)
+            self.assertTrue(switch.connected)
+            self.assertEqual(switch.port, server_port)
+            with open(cache_path) as cache_file:
+                self.assertEqual(json.load(cache_file),
+                                 {'127.0.0.1': server_port})
+
+            with mock.patch.object(WemoSwitch, 'probe_port',
+                                   wraps=WemoSwitch.probe_port) as probe:
+                switch = WemoSwitch('127.0.0.1')
+                self.assertEqual(probe.call_count, 1)
+            self.assertEqual(switch.port, server_port)
+
+            # Stop the switch server, so no port answers
+            self.server.shutdown()
+            self.server.server_close()
+            switch = WemoSwitch('127.0.0.1')
+            self.assertFalse(switch.connected)
+            self.assertEqual(switch.port, WemoSwitch.ERROR_STATE)
+
+    def test_discover_switch(self):
+        """
+        Checks a switch discovered ahead of time is kept as a session, and
+        that it is replaced if it stops answering.
+        """
+        switch = mock.Mock()
+        switch.get_state.return_value = False
+        with mock.patch.object(HardwareSwitch, '_connect_switch',
+                               return_value=switch) as connect_switch:
+            HardwareSwitch.discover_switch('10.0.0.1').join(5)
+            self.assertEqual(connect_switch.call_count, 1)
+            self.assertIs(HardwareSwitch._get_switch('10.0.0.1'), switch)
+            self.assertIs(HardwareSwitch._get_switch('10.0.0.1'), switch)
+            self.assertEqual(connect_switch.call_count, 1)
+
+            # Discovering an existing session only checks it
+            HardwareSwitch.discover_switch('10.0.0.1').join(5)
+            self.assertEqual(connect_switch.call_count, 1)
+            self.assertEqual(switch.get_state.call_count, 1)
+            switch.get_state.return_value = WemoSwitch.ERROR_STATE
+            HardwareSwitch.discover_switch('10.0.0.1').join(5)
+            self.assertEqual(connect_switch.call_count, 2)
+            self.assertEqual(switch.close.call_count, 1)
+
+    def test_sessions(self):
+        """
+        Checks the switch functions reuse the session and its connection, and
+        that the health check drops sessions of switches not answering.
+        """
+        server_port = self.server.server_address[1]
+        cache_path = os.path.join(self.temp_dir, 'wemo_ports')
+        with mock.patch.object(WemoSwitch, 'ports', (server_port,)), \
+                mock.patch.object(WemoSwitch, 'port_cache_path', cache_path), \
+                mock.patch.object(HardwareSwitch, '_coffee_switch_ip',
+                                  '127.0.0.1'), \
+                mock.patch('sys.stderr', new=io.StringIO()):
+            HardwareSwitch.safe_on()
+            self.assertEqual(self.server.state, 1)
+            self.assertEqual(len(self.server.soap_actions), 2)
+            self.assertIn('GetBinaryState', self.server.soap_actions[0])
+            self.assertIn('SetBinaryState', self.server.soap_actions[1])
+            # One connection for the port probe, another for the session
+            self.assertEqual(self.server.connections, 2)
+
+            # The set request is only sent when the switch is OFF
+            with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+                HardwareSwitch.safe_on()
+                self.assertIn('already ON', test_srderr.getvalue())
+            self.assertEqual(self.server.state, 1)
+            self.assertEqual(len(self.server.soap_actions), 3)
+            self.assertIn('GetBinaryState', self.server.soap_actions[2])
+            self.assertFalse(HardwareSwitch.switch_off())
+            self.assertEqual(len(self.server.soap_actions), 5)
+            self.assertEqual(self.server.connections, 2)
+
+            # Nor when its state cannot be read
+            self.server.fail_requests = True
+            with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+                HardwareSwitch.safe_on()
+                self.assertIn('Could not read', test_srderr.getvalue())
+            self.assertEqual(len(self.server.soap_actions), 6)
+            self.assertIn('GetBinaryState', self.server.soap_actions[5])
+            self.assertEqual(self.server.state, 0)
+            self.server.fail_requests = False
+
+            switch = HardwareSwitch._get_switch()
+            self.assertTrue(HardwareSwitch._check_session('127.0.0.1', switch))
+            switch.close()
+            self.server.shutdown()
+            self.server.server_close()
+            self.assertFalse(
+                HardwareSwitch._check_session('127.0.0.1', switch))
+            self.assertNotIn('127.0.0.1', HardwareSwitch._sessions)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -16,6 +16,7 @@ import unittest
 import threading
 try:
     from LightUpHardware.HardwareThread import HardwareThread
+    from LightUpAlarm.AlarmClock import VirtualClock
 except ImportError:
     import os
     import sys
@@ -24,6 +25,7 @@ except ImportError:
     sys.path.insert(0, package_dir)
     print("path added: %s" % package_dir)
     from LightUpHardware.HardwareThread import HardwareThread
+    from LightUpAlarm.AlarmClock import VirtualClock
 
 
 class HardwareThreadTestCase(unittest.TestCase):
@@ -512,6 +514,14 @@ class HardwareThreadTestCase(unittest.TestCase):
         HardwareThread._launch_coffee = \
             types.MethodType(mock_launch_coffee, HardwareThread)
 
+        # Mocking the _prepare_coffee method, launched before the coffee time
+        def mock_prepare_coffee(cls):
+            self.prepare_coffee_counter += 1
+            self.assertLess(time.time(), start_time + coffee_time)
+        self.prepare_coffee_counter = 0
+        HardwareThread._prepare_coffee = \
+            types.MethodType(mock_prepare_coffee, HardwareThread)
+
         def assert_thread_not_running():
             start_time = time.time()
             hw_thread_instance.start()
@@ -559,6 +569,138 @@ class HardwareThreadTestCase(unittest.TestCase):
         self.assertEqual(self.launch_lamp_counter, 1)
         self.assertEqual(self.launch_room_light_counter, 1)
         self.assertEqual(self.launch_coffee_counter, 1)
+        self.assertEqual(self.prepare_coffee_counter, 1)
+        lateness = HardwareThread.get_lateness()
+        self.assertEqual(sorted(lateness.keys()),
+                         ['coffee', 'coffee_discovery', 'lamp', 'room_light'])
+        for action_lateness in lateness.values():
+            self.assertLess(action_lateness, 0.2)
+
+    def test_add_action(self):
+        """
+        Tests custom hardware actions run with the default ones, including
+        their dependencies, and that they can be removed.
+        """
+        hw_thread_instance = HardwareThread(
+            lamp=(0, 1), room_light=(0, 1), coffee_time=0, total_time=1)
+        launched = []
+
+        def mock_hw(cls):
+            launched.append(time.time())
+        HardwareThread._launch_lamp = \
+            types.MethodType(mock_hw, HardwareThread)
+        HardwareThread._launch_room_light = \
+            types.MethodType(mock_hw, HardwareThread)
+        HardwareThread._launch_coffee = \
+            types.MethodType(mock_hw, HardwareThread)
+        HardwareThread._prepare_coffee = \
+            types.MethodType(mock_hw, HardwareThread)
+
+        blinds = []
+        self.assertTrue(HardwareThread.add_action(
+            'blinds', blinds.append, 0.5, duration=2, depends_on=['lamp']))
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+            self.assertFalse(HardwareThread.add_action(
+                'lamp', blinds.append, 0.5))
+            self.assert_stderr(test_srderr)
+
+        start_time = time.time()
+        hw_thread_instance.start()
+        while hw_thread_instance.isAlive():
+            pass
+        self.assertAlmostEqual(1, time.time() - start_time, delta=0.1)
+        self.assertEqual(len(launched), 4)
+        self.assertEqual(blinds, [2])
+        self.assertIn('blinds', HardwareThread.get_lateness())
+
+        # Actions depending on unknown actions stop the thread from running
+        self.assertTrue(HardwareThread.add_action(
+            'kettle', blinds.append, 0, depends_on=['water']))
+        with mock.patch('sys.stderr', new=io.StringIO()) as test_srderr:
+            hw_thread_instance.start()
+            self.assertFalse(hw_thread_instance.isAlive())
+            self.assert_stderr(test_srderr)
+        self.assertTrue(HardwareThread.remove_action('kettle'))
+        self.assertTrue(HardwareThread.remove_action('blinds'))
+        self.assertFalse(HardwareThread.remove_action('blinds'))
+
+    def test_cancel(self):
+        """
+        Tests a cancelled run finishes straight away without launching the
+        remaining hardware actions, and that the next run is not cancelled.
+        """
+        hw_thread_instance = HardwareThread(
+            lamp=(0, 1), room_light=(1, 1), coffee_time=1, total_time=2)
+        launched = []
+
+        def mock_hw(cls):
+            launched.append(1)
+        HardwareThread._launch_lamp = \
+            types.MethodType(mock_hw, HardwareThread)
+        HardwareThread._launch_room_light = \
+            types.MethodType(mock_hw, HardwareThread)
+        HardwareThread._launch_coffee = \
+            types.MethodType(mock_hw, HardwareThread)
+        HardwareThread._prepare_coffee = \
+            types.MethodType(mock_hw, HardwareThread)
+
+        start_time = time.time()
+        hw_thread_instance.start()
+        time.sleep(0.3)
+        HardwareThread.cancel()
+        while hw_thread_instance.isAlive():
+            pass
+        self.assertLess(time.time() - start_time, 0.5)
+        # Only the lamp and coffee discovery at 0 seconds were launched
+        self.assertEqual(len(launched), 2)
+        self.assertEqual(sorted(HardwareThread.get_lateness().keys()),
+                         ['coffee_discovery', 'lamp'])
+
+        start_time = time.time()
+        hw_thread_instance.start()
+        while hw_thread_instance.isAlive():
+            pass
+        self.assertAlmostEqual(2, time.time() - start_time, delta=0.1)
+        self.assertEqual(len(launched), 6)
+
+    def test_virtual_clock(self):
+        """
+        Tests a long run with a virtual clock finishes straight away, with the
+        hardware actions recorded at their virtual times.
+        """
+        hw_thread_instance = HardwareThread(
+            lamp=(0, 600), room_light=(300, 600), coffee_time=900,
+            total_time=1800)
+
+        def mock_hw(cls):
+            pass
+        HardwareThread._launch_lamp = \
+            types.MethodType(mock_hw, HardwareThread)
+        HardwareThread._launch_room_light = \
+            types.MethodType(mock_hw, HardwareThread)
+        HardwareThread._launch_coffee = \
+            types.MethodType(mock_hw, HardwareThread)
+        HardwareThread._prepare_coffee = \
+            types.MethodType(mock_hw, HardwareThread)
+
+        clock = VirtualClock(1420416000)
+        HardwareThread.clock = clock
+        try:
+            start_time = time.time()
+            hw_thread_instance.start()
+            while hw_thread_instance.isAlive():
+                pass
+            self.assertLess(time.time() - start_time, 2)
+        finally:
+            HardwareThread.clock = None
+
+        self.assertEqual(clock.time(), 1420416000 + 1800)
+        launches = dict(
+            (record['action'], record['time'] - 1420416000)
+            for record in clock.get_records('hardware')
+            if record['state'] == 'launched')
+        self.assertEqual(launches, {'lamp': 0, 'room_light': 300,
+                                    'coffee_discovery': 840, 'coffee': 900})
 
     def test_multirun(self):
         """
@@ -582,6 +724,8 @@ class HardwareThreadTestCase(unittest.TestCase):
             types.MethodType(mock_hw, HardwareThread)
         HardwareThread._launch_coffee = \
             types.MethodType(mock_hw, HardwareThread)
+        HardwareThread._prepare_coffee = \
+            types.MethodType(mock_hw, HardwareThread)
 
         # Launch the hardware thread, ensure it lasts 2 seconds
         start_time = time.time()
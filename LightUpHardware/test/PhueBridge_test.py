@@ -0,0 +1,253 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+#
+# Unit test for the HTTP connection pool of the phue Bridge class.
+#
+# Copyright (c) 2015 carlosperate https://github.com/carlosperate/
+#
+# Licensed under The MIT License (MIT), a copy can be found in the LICENSE file
+#
+# The requests are sent to a local HTTP server standing in for the Hue bridge,
+# which counts the number of connections it receives.
+#
+from __future__ import unicode_literals, absolute_import
+import json
+import time
+import unittest
+import threading
+try:
+    import BaseHTTPServer
+    import SocketServer
+except ImportError:
+    import http.server as BaseHTTPServer
+    import socketserver as SocketServer
+try:
+    from LightUpHardware.phue.phue import Bridge, Light
+except ImportError:
+    import os
+    import sys
+    file_dir = os.path.dirname(os.path.realpath(__file__))
+    package_dir = os.path.dirname(os.path.dirname(file_dir))
+    sys.path.insert(0, package_dir)
+    from LightUpHardware.phue.phue import Bridge, Light
+
+
+class BridgeRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """ Keep-alive request handler that replies with a fixed Hue response. """
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections += 1
+
+    def reply(self):
+        length = int(self.headers.get('Content-Length', 0))
+        data = self.rfile.read(length) if length else None
+        with self.server.lock:
+            self.server.requests += 1
+            if data:
+                self.server.bodies.setdefault(self.path, []).append(
+                    json.loads(data.decode('utf-8')))
+            close = self.server.close_next
+            self.server.close_next = False
+            lights = self.server.lights
+        if self.command == 'GET' and self.path.endswith('/lights/'):
+            body = json.dumps(lights).encode('utf-8')
+        else:
+            body = json.dumps(
+                [{'success': {self.path: True}}]).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        if close:
+            # Drop the connection without telling the client, like a bridge
+            # closing an idle connection
+            self.close_connection = True
+
+    do_GET = reply
+    do_PUT = reply
+
+    def log_message(self, *args):
+        pass
+
+
+class BridgeServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+
+
+class PhueBridgeTestCase(unittest.TestCase):
+    """ Tests for the phue Bridge connection pool. """
+
+    def setUp(self):
+        self.server = BridgeServer(('127.0.0.1', 0), BridgeRequestHandler)
+        self.server.lock = threading.Lock()
+        self.server.connections = 0
+        self.server.requests = 0
+        self.server.close_next = False
+        self.server.bodies = {}
+        self.server.lights = {
+            '1': {'name': 'Bedroom', 'state': {'on': False, 'bri': 0,
+                                               'reachable': True}},
+            '4': {'name': 'Hall', 'state': {'on': True, 'bri': 100,
+                                            'reachable': False}}}
+        self.server_thread = threading.Thread(
+            target=self.server.serve_forever, kwargs={'poll_interval': 0.05})
+        self.server_thread.daemon = True
+        self.server_thread.start()
+        self.bridge_ip = '127.0.0.1:%s' % self.server.server_address[1]
+        Bridge.close_connections()
+        self.original_rate = Bridge.commands_per_second
+        self.original_ttl = Bridge.state_cache_ttl
+
+    def tearDown(self):
+        Bridge.commands_per_second = self.original_rate
+        Bridge.state_cache_ttl = self.original_ttl
+        Bridge.close_connections()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_keep_alive(self):
+        """ Checks consecutive requests, from any Bridge, reuse a connection. """
+        bridge = Bridge(self.bridge_ip, 'user')
+        for brightness in range(20):
+            response = bridge.request(
+                'PUT', '/api/user/lights/1/state',
+                json.dumps({'bri': brightness}))
+            self.assertEqual(
+                response, [{'success': {'/api/user/lights/1/state': True}}])
+        Bridge(self.bridge_ip, 'user').request('GET', '/api/user/config')
+        self.assertEqual(self.server.requests, 21)
+        self.assertEqual(self.server.connections, 1)
+
+    def test_reconnect(self):
+        """
+        Checks a connection closed by the server, or idle for longer than the
+        timeout, is replaced by a new one.
+        """
+        bridge = Bridge(self.bridge_ip, 'user')
+        self.server.close_next = True
+        bridge.request('GET', '/api/user/lights')
+        bridge.request('GET', '/api/user/lights')
+        bridge.request('GET', '/api/user/lights')
+        self.assertEqual(self.server.requests, 3)
+        self.assertEqual(self.server.connections, 2)
+
+        original_timeout = Bridge.connection_idle_timeout
+        Bridge.connection_idle_timeout = 0
+        try:
+            bridge.request('GET', '/api/user/lights')
+        finally:
+            Bridge.connection_idle_timeout = original_timeout
+        self.assertEqual(self.server.connections, 3)
+
+    def test_threads(self):
+        """
+        Checks several threads can use the same Bridge concurrently, without
+        opening more connections than threads.
+        """
+        bridge = Bridge(self.bridge_ip, 'user')
+        errors = []
+
+        def ramp():
+            try:
+                for brightness in range(25):
+                    bridge.request('PUT', '/api/user/lights/1/state',
+                                   json.dumps({'bri': brightness}))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=ramp) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(10)
+        self.assertEqual(errors, [])
+        self.assertEqual(self.server.requests, 75)
+        self.assertLessEqual(self.server.connections, 3)
+
+    def test_rate_limit(self):
+        """ Checks the set_light commands are spaced to the rate budget. """
+        Bridge.commands_per_second = 20
+        bridge = Bridge(self.bridge_ip, 'user')
+        start_time = time.time()
+        for brightness in range(6):
+            bridge.set_light(1, 'bri', brightness)
+        self.assertGreaterEqual(time.time() - start_time, 0.25)
+        self.assertEqual(self.server.requests, 6)
+        stats = bridge.get_write_stats()
+        self.assertEqual(stats['sent'], 6)
+        self.assertGreater(stats['throttled_time'], 0)
+
+    def test_write_behind(self):
+        """
+        Checks the queued writes to the same light are merged into the latest
+        values, and counted as merged or dropped.
+        """
+        Bridge.commands_per_second = 5
+        bridge = Bridge(self.bridge_ip, 'user')
+        # Use up the first slot, so the queued writes wait for the next one
+        bridge.set_light(4, 'on', False)
+        for brightness in range(30):
+            bridge.set_light(1, 'bri', brightness, wait=False)
+        bridge.set_light(1, 'on', True, wait=False)
+        bridge.set_light([2, 3], {'bri': 10}, transitiontime=20, wait=False)
+        self.assertTrue(bridge.flush_light_writes(10))
+
+        bodies = self.server.bodies
+        self.assertEqual(bodies['/api/user/lights/1/state'],
+                         [{'bri': 29, 'on': True}])
+        self.assertEqual(bodies['/api/user/lights/3/state'],
+                         [{'bri': 10, 'transitiontime': 20}])
+        stats = bridge.get_write_stats()
+        self.assertEqual(stats['queued'], 33)
+        self.assertEqual(stats['sent'], 4)
+        self.assertEqual(stats['dropped'], 29)
+        self.assertEqual(stats['merged'], 1)
+        self.assertEqual(stats['pending'], 0)
+
+    def test_state_cache(self):
+        """
+        Checks the lights state and names are read with a single request until
+        the cache expires, a command is sent, or fresh data is requested.
+        """
+        Bridge.state_cache_ttl = 60
+        bridge = Bridge(self.bridge_ip, 'user')
+        light = Light(bridge, 1)
+        self.assertFalse(light.on)
+        self.assertTrue(light.reachable)
+        self.assertEqual(bridge.get_light(4, 'bri'), 100)
+        self.assertEqual(bridge.get_light('Hall', 'reachable'), False)
+        self.assertEqual(bridge.get_light_id_by_name('Bedroom'), '1')
+        self.assertEqual(self.server.requests, 1)
+
+        # Returned state can be modified without changing the cache
+        bridge.get_light(1)['state']['bri'] = 50
+        self.assertEqual(bridge.get_light(1, 'bri'), 0)
+        self.assertEqual(self.server.requests, 1)
+
+        self.assertEqual(bridge.get_light(1, 'bri', fresh=True), 0)
+        self.assertEqual(self.server.requests, 2)
+        bridge.set_light(1, 'bri', 5)
+        self.server.lights['1']['state']['bri'] = 5
+        self.assertEqual(light.brightness, 5)
+        self.assertEqual(self.server.requests, 4)
+
+        # A new light name is read from the bridge, known ones are not
+        self.server.lights['5'] = {'name': 'Kitchen', 'state': {'on': True}}
+        self.assertEqual(bridge.get_light_id_by_name('Hall'), '4')
+        self.assertEqual(self.server.requests, 4)
+        self.assertEqual(bridge.get_light_id_by_name('Kitchen'), '5')
+        self.assertFalse(bridge.get_light_id_by_name('Garage'))
+        self.assertEqual(self.server.requests, 6)
+
+        Bridge.state_cache_ttl = 0
+        bridge.get_light(1)
+        bridge.get_light(1)
+        self.assertEqual(self.server.requests, 8)
+
+
+if __name__ == '__main__':
+    unittest.main()
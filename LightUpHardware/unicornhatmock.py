@@ -20,6 +20,9 @@ verbose = True
 brightness_level = 0
 verbose_counter = 0
 
+# Pixel buffer, indexed as [y][x] -> (r, g, b)
+pixels = [[(0, 0, 0)] * 8 for _ in range(8)]
+
 def brightness(b=0.2):
     global brightness_level
     brightness_level = b
@@ -28,10 +31,20 @@ def brightness(b=0.2):
 
 
 def set_pixel(x, y, r, g, b):
+    pixels[y][x] = (r, g, b)
     if verbose is True:
         print('Unicorn pixel set x: %s; y: %s; rgb: %s %s %s' % (x, y, r, g, b))
 
 
+def set_pixels(new_pixels):
+    for y in range(8):
+        for x in range(8):
+            r, g, b = new_pixels[y][x]
+            pixels[y][x] = (int(r), int(g), int(b))
+    if verbose is True:
+        print('Unicorn pixels set, first rgb: %s %s %s' % pixels[0][0])
+
+
 def show():
     global verbose_counter
     verbose_counter += 1
@@ -75,23 +75,57 @@ def template_test():
     return render_template('main.html', **templateData)
 
 
+def versioned_response(json_function, compact):
+    """
+    Creates a response for alarm data that only changes when the alarms do,
+    with an ETag. If the request ETag matches the current one the data is not
+    generated and a 304 (Not Modified) response is returned instead.
+    :param json_function: Function to generate the JSON string.
+    :param compact: Boolean to indicate the compact JSON format.
+    :return: Flask Response.
+    """
+    etag = alarm_adapt.get_etag(compact)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        response = Response(json_function(), mimetype='application/json')
+    response.set_etag(etag)
+    return response
+
+
 @flask_server.route('/LightUpPi/getAlarm', methods=['GET'])
 def get_alarm():
+    """
+    Retrieves the data of an alarm, all the alarms, or the next alarm to alert.
+    The 'all' and alarm ID responses contain an ETag to be able to do
+    conditional requests with the If-None-Match header.
+    The full request is:
+    /LightUpPi/getAlarm?id=<all/next/alarm_id>&compact=<>
+    :return: JSON string with the alarm data.
+    """
     callback()
     global alarm_adapt
     message = {'error': 'The \'id\' argument is required for \'getAlarm\''}
     alarm_id = request.args.get('id')
+    compact = request.args.get('compact', '').lower() in ('true', 'yes', '1')
     if alarm_id is not None:
         if alarm_id == 'all':
             # /LightUpPi/getAlarm?id=all
-            json_response = alarm_adapt.json_get_all_alarms()
+            return versioned_response(
+                lambda: alarm_adapt.json_get_all_alarms(compact=compact),
+                compact)
+        elif alarm_id == 'next':
+            # /LightUpPi/getAlarm?id=next
+            json_response = alarm_adapt.json_get_next_alarm(compact=compact)
             return Response(json_response,  mimetype='application/json')
         else:
             # /LightUpPi/getAlarm?id=<alarm_id>
             try:
                 alarm_id = int(alarm_id)
-                json_response = alarm_adapt.json_get_alarm(int(alarm_id))
-                return Response(json_response,  mimetype='application/json')
+                return versioned_response(
+                    lambda: alarm_adapt.json_get_alarm(
+                        alarm_id, compact=compact),
+                    compact)
             except ValueError:
                 message['error'] = 'The \'id\' argument has to be an integer'
 
@@ -343,6 +377,86 @@ def delete_alarm():
     return jsonify(message)
 
 
+@flask_server.route('/LightUpPi/batch', methods=['POST'])
+def batch():
+    """
+    Adds, edits and deletes several alarms with a single request. All the
+    operations are applied in a single database transaction.
+    The request body is a JSON object with any of the following lists:
+    {"add": [{"hour": <>, "minute": <>, "monday": <>, ... "sunday": <>,
+              "enabled": <>, "label": <>, "timestamp": <>}, ...],
+     "edit": [{"id": <>, "hour": <>, ... any other add key}, ...],
+     "delete": [<id>, ...]}
+    :return: JSON string with the response data of each operation, in the same
+             format as the addAlarm, editAlarm and deleteAlarm responses.
+    """
+    callback()
+    global alarm_adapt
+    data = request.get_json(force=True, silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'error': 'The \'batch\' request body must be a JSON '
+                                 'object'})
+
+    operations = {}
+    for key, item_type in (('add', dict), ('edit', dict), ('delete', int)):
+        items = data.get(key, [])
+        if not isinstance(items, list) or \
+                not all(isinstance(item, item_type) for item in items):
+            message = 'The \'%s\' data has to be a list of %s' % \
+                      (key, 'objects' if item_type is dict else 'integers')
+            return jsonify({'error': message})
+        operations[key] = items
+
+    json_response = alarm_adapt.json_batch(**operations)
+    return Response(json_response, mimetype='application/json')
+
+
+@flask_server.route('/LightUpPi/events', methods=['GET'])
+def events():
+    """
+    Feed of the alarm events (alarm 'add', 'edit', 'delete' and 'reload', and
+    'alert' triggered). Each event contains its 'version', 'type', alarm 'id'
+    and 'time', and the 'alert' events an 'offset' flag, true for the pre/post
+    alerts of the alarm. A 'reset' event indicates that some events have been
+    missed and all the alarms data should be retrieved again.
+    If the request accepts 'text/event-stream' (like the browser EventSource)
+    the events are streamed as Server-Sent Events. Otherwise the request is a
+    long-poll that returns as soon as there are events after the 'since'
+    version, or after 'timeout' seconds (default 25, maximum 60).
+    The full request is:
+    /LightUpPi/events?since=<version>&timeout=<>&compact=<>
+    :return: Event stream, or JSON string with the version to use as the
+             'since' argument of the next request and the list of events.
+    """
+    callback()
+    global alarm_adapt
+    # EventSource reconnections send the last received event ID as a header
+    since = request.args.get('since', request.headers.get('Last-Event-ID'))
+    if since is None:
+        since = alarm_adapt.get_events_version()
+    else:
+        try:
+            since = int(since)
+        except ValueError:
+            message = {'error': 'The \'since\' argument must be an integer'}
+            return jsonify(message)
+
+    if request.accept_mimetypes.best == 'text/event-stream':
+        return Response(alarm_adapt.sse_events(since),
+                        mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache'})
+
+    try:
+        timeout = min(max(float(request.args.get('timeout', 25)), 0), 60)
+    except ValueError:
+        message = {'error': 'The \'timeout\' argument must be a number'}
+        return jsonify(message)
+    compact = request.args.get('compact', '').lower() in ('true', 'yes', '1')
+    json_response = alarm_adapt.json_get_events(
+        since, timeout=timeout, compact=compact)
+    return Response(json_response, mimetype='application/json')
+
+
 def run(alarm_mgr_arg, silent=False, callback_arg=None):
     global alarm_adapt, callback_func
     alarm_adapt = ServerAlarmAdapter(alarm_mgr_arg)
@@ -360,5 +474,5 @@ def run(alarm_mgr_arg, silent=False, callback_arg=None):
     global flask_server
     flask_server.static_folder = static_dir
 
-    # Run flask
-    flask_server.run(host='0.0.0.0', port=80, debug=False)
+    # Run flask, threaded to not block requests while events are streamed
+    flask_server.run(host='0.0.0.0', port=80, debug=False, threaded=True)
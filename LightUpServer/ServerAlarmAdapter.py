@@ -12,6 +12,8 @@
 #
 from __future__ import unicode_literals, absolute_import
 import json
+import time
+import threading
 #try:
 #    from LightUpAlarm.AlarmManager import AlarmManager
 #except ImportError:
@@ -25,8 +27,17 @@ class ServerAlarmAdapter(object):
     This is an Object Adapter, rather than a Class adapter, to reduce coopling
     and dependency on the parent class and simplify the possible replacement
     of the LightUpPi Alarm system.
+
+    The JSON strings of the alarm data are cached until the AlarmManager alarms
+    version changes, so repeated requests for unchanged data do not need to
+    retrieve or serialise the alarms again. The ETag of the cached data can be
+    used to answer conditional requests.
     """
 
+    # Keys of the repeat days in the alarm dictionaries
+    weekdays = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday',
+                'saturday', 'sunday')
+
     #
     # metaclass methods
     #
@@ -39,6 +50,15 @@ class ServerAlarmAdapter(object):
         """
         self.alarm_mgr = alarm_mgr
 
+        # Dictionary of (data key, compact flag) -> JSON string, valid for the
+        # alarms version in __json_cache_version
+        self.__json_cache = {}
+        self.__json_cache_version = None
+        self.__json_cache_lock = threading.Lock()
+        # The alarms version restarts with the process, so the ETags need to
+        # be different for each run
+        self.__etag_prefix = '%x' % int(time.time() * 1000)
+
     #
     # Alarm operations with normal python data
     #
@@ -69,28 +89,135 @@ class ServerAlarmAdapter(object):
         alarm = self.alarm_mgr.get_alarm(alarm_id)
         return alarm.repeat
 
+    def get_etag(self, compact=False):
+        """
+        Gets the entity tag of the current alarms data in JSON format.
+        :param compact: Boolean to indicate if the tag is for the compact JSON
+                        format.
+        :return: String with the entity tag, it changes every time the alarms
+                 data changes.
+        """
+        return '%s-%s%s' % (self.__etag_prefix,
+                            self.alarm_mgr.get_alarms_version(),
+                            '-c' if compact else '')
+
     #
     # retrieve alarm data in json format
     #
-    def json_get_alarm(self, alarm_id):
-        alarm = self.alarm_mgr.get_alarm(alarm_id)
-        return json.dumps(
-            ServerAlarmAdapter.alarm_to_dict(alarm),
-            indent=4, separators=(',', ': '))
+    @staticmethod
+    def json_dumps(data, compact=False):
+        """
+        Serialises data into a JSON string.
+        :param data: Data to serialise.
+        :param compact: Boolean to indicate if the JSON string should not be
+                        indented and not contain any optional white spaces.
+        :return: JSON string.
+        """
+        if compact is True:
+            return json.dumps(data, separators=(',', ':'))
+        return json.dumps(data, indent=4, separators=(',', ': '))
+
+    def __cached_json(self, key, compact, data_function):
+        """
+        Gets a JSON string from the cache, or serialises and caches the output
+        of the data function if the alarms have changed since it was cached.
+        :param key: Key to identify the data in the cache.
+        :param compact: Boolean to indicate the compact JSON format.
+        :param data_function: Function to generate the data to serialise.
+        :return: JSON string.
+        """
+        version = self.alarm_mgr.get_alarms_version()
+        with self.__json_cache_lock:
+            if self.__json_cache_version != version:
+                self.__json_cache = {}
+                self.__json_cache_version = version
+            json_str = self.__json_cache.get((key, compact))
+        if json_str is None:
+            json_str = ServerAlarmAdapter.json_dumps(data_function(), compact)
+            with self.__json_cache_lock:
+                if self.__json_cache_version == version:
+                    self.__json_cache[(key, compact)] = json_str
+        return json_str
 
-    def json_get_next_alarm(self):
+    def json_get_alarm(self, alarm_id, compact=False):
+        def alarm_data():
+            return ServerAlarmAdapter.alarm_to_dict(
+                self.alarm_mgr.get_alarm(alarm_id))
+        return self.__cached_json(alarm_id, compact, alarm_data)
+
+    def json_get_next_alarm(self, compact=False):
+        # Not cached, as the next alarm also depends on the current time
         alarm = self.alarm_mgr.get_next_alarm()
-        return json.dump(ServerAlarmAdapter.alarm_to_dict(alarm))
-
-    def json_get_all_alarms(self):
-        all_alarms = self.alarm_mgr.get_all_alarms()
-        alarms_dicts = []
-        for alarm in all_alarms:
-            alarms_dicts.append(ServerAlarmAdapter.alarm_to_dict(alarm))
-        alarms_dicts = {'dataType': 'All alarms',
-                        'size': len(alarms_dicts),
-                        'alarms': alarms_dicts}
-        return json.dumps(alarms_dicts, indent=4, separators=(',', ': '))
+        if alarm is None:
+            return_dict = {'error': 'There are no active alarms'}
+        else:
+            return_dict = ServerAlarmAdapter.alarm_to_dict(alarm)
+            return_dict['next_alert'] = alarm.next_alert
+        return ServerAlarmAdapter.json_dumps(return_dict, compact)
+
+    def json_get_all_alarms(self, compact=False):
+        def all_alarms_data():
+            all_alarms = self.alarm_mgr.get_all_alarms()
+            alarms_dicts = []
+            for alarm in all_alarms:
+                alarms_dicts.append(ServerAlarmAdapter.alarm_to_dict(alarm))
+            return {'dataType': 'All alarms',
+                    'size': len(alarms_dicts),
+                    'alarms': alarms_dicts}
+        return self.__cached_json('all', compact, all_alarms_data)
+
+    #
+    # retrieve alarm events
+    #
+    def get_events_version(self):
+        """
+        :return: Integer with the version of the latest alarm event.
+        """
+        return self.alarm_mgr.get_events_version()
+
+    def json_get_events(self, since, timeout=None, compact=False):
+        """
+        Gets the alarm events after the given version, waiting for new events
+        if there are none.
+        :param since: Integer with the version of the last event received.
+        :param timeout: Maximum time, in seconds, to wait for new events.
+        :param compact: Boolean to indicate the compact JSON format.
+        :return: JSON string containing the data type, the version to use in
+                 the following request, and the list of events.
+        """
+        events = self.alarm_mgr.get_events(since, timeout)
+        version = max(event['version'] for event in events) if events else \
+            since
+        return_dict = {'dataType': 'Events',
+                       'version': version,
+                       'events': events}
+        return ServerAlarmAdapter.json_dumps(return_dict, compact)
+
+    def sse_events(self, since, keep_alive_time=15):
+        """
+        Generator of the alarm events after the given version, formatted as
+        Server-Sent Events. It never finishes, so it has to be closed by the
+        caller.
+        :param since: Integer with the version of the last event received.
+        :param keep_alive_time: Time, in seconds, without events after which a
+                                comment is sent to keep the connection alive.
+        :return: Generator of Server-Sent Events strings, one per alarm event,
+                 with the event version as the event ID.
+        """
+        # Tells the client how long to wait before reconnecting, in ms
+        yield 'retry: 3000\n\n'
+        while True:
+            events = self.alarm_mgr.get_events(since, keep_alive_time)
+            if not events:
+                yield ': keep-alive\n\n'
+                continue
+            for event in events:
+                since = max(since, event['version'])
+                yield 'id: %s\nevent: %s\ndata: %s\n\n' % (
+                    event['version'], event['type'],
+                    ServerAlarmAdapter.json_dumps(event, compact=True))
+            if events[0]['type'] == 'reset':
+                since = events[0]['version']
 
     #
     # Perform operations to the alarms (add, edit, delete) returning json data
@@ -114,19 +241,8 @@ class ServerAlarmAdapter(object):
         alarm_id = self.alarm_mgr.add_alarm(
             hour, minute, days=days, enabled=enabled, label=label,
             timestamp=timestamp)
-
-        return_dict = {'dataType': 'Add alarm'}
-        if alarm_id is not None:
-            retrieved_alarm = self.alarm_mgr.get_alarm(alarm_id)
-            return_dict['id'] = alarm_id
-            if retrieved_alarm is not None:
-                return_dict['success'] = True
-                return_dict['timestamp'] = retrieved_alarm.timestamp
-            else:
-                return_dict['success'] = False
-        else:
-            return_dict['success'] = False
-        return json.dumps(return_dict, indent=4, separators=(',', ': '))
+        return json.dumps(self.__add_result_dict(alarm_id),
+                          indent=4, separators=(',', ': '))
 
     def json_edit_alarm(self, alarm_id, hour=None, minute=None, days=None,
                         enabled=None, label=None):
@@ -144,16 +260,8 @@ class ServerAlarmAdapter(object):
         success = self.alarm_mgr.edit_alarm(
             alarm_id, hour=hour, minute=minute, days=days, enabled=enabled,
             label=label)
-        retrieved_alarm = self.alarm_mgr.get_alarm(alarm_id)
-        return_dict = {'dataType': 'Edit alarm',
-                       'id': alarm_id,
-                       'success': success}
-        if retrieved_alarm is None:
-            return_dict['error'] = 'This alarm does not exists'
-        else:
-            return_dict['timestamp'] = retrieved_alarm.timestamp
-
-        return json.dumps(return_dict, indent=4, separators=(',', ': '))
+        return json.dumps(self.__edit_result_dict(alarm_id, success),
+                          indent=4, separators=(',', ': '))
 
     def json_delete_alarm(self, alarm_id):
         """
@@ -163,10 +271,9 @@ class ServerAlarmAdapter(object):
                  success information.
         """
         success = self.alarm_mgr.delete_alarm(alarm_id)
-        return_dict = {'dataType': 'Deleted alarm',
-                       'id': alarm_id,
-                       'success': success}
-        return json.dumps(return_dict, indent=4, separators=(',', ': '))
+        return json.dumps(
+            ServerAlarmAdapter.__delete_result_dict(alarm_id, success),
+            indent=4, separators=(',', ': '))
 
     def json_delete_all_alarms(self):
         """
@@ -177,3 +284,127 @@ class ServerAlarmAdapter(object):
         return_dict = {'dataType': 'Deleted all alarms',
                        'success': success}
         return json.dumps(return_dict, indent=4, separators=(',', ': '))
+
+    def json_batch(self, add=None, edit=None, delete=None):
+        """
+        Adds, edits and deletes lists of alarms. All the operations are applied
+        by the AlarmManager in a single transaction, and the alarms are
+        rescheduled only once after it has been committed.
+        Input sanitation is done at the AlarmManager methods.
+        :param add: List of dictionaries with the data of the alarms to add,
+                    in the same format as the alarm_to_dict output. Only the
+                    'hour' and 'minute' keys are required.
+        :param edit: List of dictionaries with the data to edit. Only the 'id'
+                     key is required, and any other alarm_to_dict key present
+                     is edited.
+        :param delete: List of integers with the IDs of the alarms to delete.
+        :return: JSON string containing the data type and the result for each
+                 of the operations, in the same format as returned by the
+                 json_add_alarm, json_edit_alarm and json_delete_alarm methods.
+        """
+        edits = [self.__dict_to_edit_args(alarm_dict)
+                 for alarm_dict in edit or []]
+        delete = delete or []
+        alarm_ids, edit_results, delete_results = self.alarm_mgr.apply_batch(
+            add=[ServerAlarmAdapter.__dict_to_add_args(alarm_dict)
+                 for alarm_dict in add or []],
+            edit=edits, delete=delete)
+
+        return_dict = {'dataType': 'Batch', 'add': [], 'edit': [], 'delete': []}
+        for alarm_id in alarm_ids:
+            return_dict['add'].append(self.__add_result_dict(alarm_id))
+        for edit_args, success in zip(edits, edit_results):
+            return_dict['edit'].append(
+                self.__edit_result_dict(edit_args['alarm_id'], success))
+        for alarm_id, success in zip(delete, delete_results):
+            return_dict['delete'].append(
+                ServerAlarmAdapter.__delete_result_dict(alarm_id, success))
+
+        return json.dumps(return_dict, indent=4, separators=(',', ': '))
+
+    #
+    # Conversions between alarm operations and dictionaries for json data
+    #
+    def __add_result_dict(self, alarm_id):
+        """
+        :param alarm_id: ID of the added alarm, or None if it failed.
+        :return: Dictionary with the result of an 'add' operation.
+        """
+        return_dict = {'dataType': 'Add alarm'}
+        if alarm_id is not None:
+            retrieved_alarm = self.alarm_mgr.get_alarm(alarm_id)
+            return_dict['id'] = alarm_id
+            if retrieved_alarm is not None:
+                return_dict['success'] = True
+                return_dict['timestamp'] = retrieved_alarm.timestamp
+            else:
+                return_dict['success'] = False
+        else:
+            return_dict['success'] = False
+        return return_dict
+
+    def __edit_result_dict(self, alarm_id, success):
+        """
+        :param alarm_id: ID of the edited alarm.
+        :param success: Boolean indicating the success of the 'edit' operation.
+        :return: Dictionary with the result of an 'edit' operation.
+        """
+        retrieved_alarm = self.alarm_mgr.get_alarm(alarm_id)
+        return_dict = {'dataType': 'Edit alarm',
+                       'id': alarm_id,
+                       'success': success}
+        if retrieved_alarm is None:
+            return_dict['error'] = 'This alarm does not exists'
+        else:
+            return_dict['timestamp'] = retrieved_alarm.timestamp
+        return return_dict
+
+    @staticmethod
+    def __delete_result_dict(alarm_id, success):
+        """
+        :param alarm_id: ID of the deleted alarm.
+        :param success: Boolean indicating the success of the 'delete'
+                        operation.
+        :return: Dictionary with the result of a 'delete' operation.
+        """
+        return {'dataType': 'Deleted alarm',
+                'id': alarm_id,
+                'success': success}
+
+    @staticmethod
+    def __dict_to_add_args(alarm_dict):
+        """
+        Converts an alarm dictionary, in the alarm_to_dict format, into the
+        AlarmManager.add_alarm arguments. Missing repeat days are set to False.
+        :param alarm_dict: Dictionary with the alarm data.
+        :return: Dictionary with the add_alarm arguments.
+        """
+        return {'hour': alarm_dict.get('hour'),
+                'minute': alarm_dict.get('minute'),
+                'days': tuple(alarm_dict.get(day, False)
+                              for day in ServerAlarmAdapter.weekdays),
+                'enabled': alarm_dict.get('enabled', True),
+                'label': alarm_dict.get('label', ''),
+                'timestamp': alarm_dict.get('timestamp')}
+
+    def __dict_to_edit_args(self, alarm_dict):
+        """
+        Converts an alarm dictionary, in the alarm_to_dict format, into the
+        AlarmManager.edit_alarm arguments. Any repeat days not present keep
+        their current value.
+        :param alarm_dict: Dictionary with the alarm data to edit.
+        :return: Dictionary with the edit_alarm arguments.
+        """
+        alarm_id = alarm_dict.get('id')
+        days = None
+        if any(day in alarm_dict for day in ServerAlarmAdapter.weekdays):
+            alarm = self.alarm_mgr.get_alarm(alarm_id)
+            if alarm is not None:
+                days = tuple(alarm_dict.get(day, repeat) for day, repeat in
+                             zip(ServerAlarmAdapter.weekdays, alarm.repeat))
+        return {'alarm_id': alarm_id,
+                'hour': alarm_dict.get('hour'),
+                'minute': alarm_dict.get('minute'),
+                'days': days,
+                'enabled': alarm_dict.get('enabled'),
+                'label': alarm_dict.get('label')}